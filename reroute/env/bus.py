@@ -1,5 +1,5 @@
 import numpy as np
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Set
 from dataclasses import dataclass, field
 from enum import Enum
 from riders import Rider
@@ -57,11 +57,31 @@ class Bus:
 class BusFleet:
     """Manages a fleet of buses"""
     
-    def __init__(self, city_grid, num_buses: int = 6):
+    def __init__(self, city_grid, num_buses: int = 6, router=None):
         self.city_grid = city_grid
         self.buses: Dict[int, Bus] = {}
         self.num_buses = num_buses
         
+        # Optional TimeDependentRouter; None = route on current edge costs
+        self.router = router
+        self.current_time = 0.0
+        
+        # Start stop per bus, reused by reset() to restore initial state in place
+        self.start_stops: Dict[int, int] = {}
+        
+        # Lazily built neighborhood index for local (per-bus) observations
+        self._neighbor_stops: Optional[np.ndarray] = None
+        self._num_neighbor_stops = 0
+        
+        # Lazily built stop-to-stop distances for the HIGH_DEMAND / SKIP_LOW searches
+        self._stop_distances: Optional[np.ndarray] = None
+        
+        # Reverse index: edge -> buses whose remaining path uses it. Edge cost
+        # changes mark only those buses for rerouting at the next movement update.
+        self._buses_by_edge: Dict[Tuple[int, int], Set[int]] = {}
+        self._pending_reroutes: Set[int] = set()
+        self.city_grid.add_edge_listener(self._on_edges_changed)
+        
         # Static routes (baseline) - create this first
         self.static_routes = self._generate_static_routes()
         
@@ -76,6 +96,7 @@ class BusFleet:
             # Distribute buses across different stops
             start_stop = stop_ids[i % len(stop_ids)]
             stop = self.city_grid.stops[start_stop]
+            self.start_stops[i] = start_stop
             
             bus = Bus(
                 id=i,
@@ -91,6 +112,33 @@ class BusFleet:
             
             self.buses[i] = bus
     
+    def reset(self):
+        """Restore all buses to their initial state without reallocating them"""
+        self._buses_by_edge.clear()
+        self._pending_reroutes.clear()
+        self.current_time = 0.0
+        for bus_id, bus in self.buses.items():
+            start_stop = self.start_stops[bus_id]
+            stop = self.city_grid.stops[start_stop]
+            
+            bus.x = stop.x
+            bus.y = stop.y
+            bus.current_node = start_stop
+            bus.load = 0
+            bus.passengers.clear()
+            bus.mode = BusMode.STATIC
+            bus.route[:] = self.static_routes[bus_id % len(self.static_routes)]
+            bus.next_stop = bus.route[0] if bus.route else None
+            
+            bus.target_node = None
+            bus.path = []
+            bus.path_index = 0
+            bus.travel_progress = 0.0
+            
+            bus.total_distance = 0.0
+            bus.replan_count = 0
+            bus.hold_time_remaining = 0.0
+    
     def _generate_static_routes(self) -> List[List[int]]:
         """Generate fixed circular routes for baseline comparison"""
         stop_ids = list(self.city_grid.stops.keys())
@@ -163,18 +211,18 @@ class BusFleet:
         elif action == BusAction.HIGH_DEMAND:
             # Go to highest demand stop
             high_demand_stop = self._find_highest_demand_stop(bus, rider_queue)
-            if high_demand_stop and high_demand_stop != bus.current_node:
+            if high_demand_stop is not None and high_demand_stop != bus.current_node:
                 bus.next_stop = high_demand_stop
                 bus.replan_count += 1
         
         elif action == BusAction.SKIP_LOW:
             # Skip low demand stops
-            if bus.next_stop:
+            if bus.next_stop is not None:
                 queue_len = rider_queue.get_queue_length(bus.next_stop)
                 if queue_len < 2:  # Low demand threshold
                     # Find next stop with higher demand
                     alternative = self._find_alternative_stop(bus, rider_queue)
-                    if alternative:
+                    if alternative is not None:
                         bus.next_stop = alternative
                         bus.replan_count += 1
         
@@ -182,45 +230,82 @@ class BusFleet:
             # Hold at current stop for better spacing
             bus.hold_time_remaining = 2.0  # Hold for 2 minutes
     
-    def _find_highest_demand_stop(self, bus: Bus, rider_queue) -> Optional[int]:
-        """Find stop with highest rider demand"""
-        max_demand = 0
-        best_stop = None
+    def get_action_masks(self, rider_queue) -> np.ndarray:
+        """Feasibility of each BusAction per bus, bool array [num_buses, len(BusAction)]
         
-        for stop_id in self.city_grid.stops.keys():
-            if stop_id == bus.current_node:
-                continue
+        Mirrors _execute_action, using the same candidate searches: a masked
+        action would be a no-op. CONTINUE is always allowed so every bus keeps
+        at least one valid action.
+        """
+        masks = np.zeros((len(self.buses), len(BusAction)), dtype=bool)
+        masks[:, BusAction.CONTINUE.value] = True
+        queue_len = None
+        
+        for i, bus in enumerate(self.buses.values()):
+            if bus.is_moving:
+                continue  # Actions are ignored while moving
+            if queue_len is None:
+                queue_len = self._stop_queue_lengths(rider_queue)  # Once per call, shared by every bus
             
-            queue_len = rider_queue.get_queue_length(stop_id)
-            # Weight by inverse distance
-            distance = self.city_grid.distance_between_stops(bus.current_node, stop_id)
-            if distance > 0:
-                weighted_demand = queue_len / (1 + distance / 10)  # Normalize distance
-                if weighted_demand > max_demand:
-                    max_demand = weighted_demand
-                    best_stop = stop_id
+            # HIGH_DEMAND needs some other stop with weighted demand to head for
+            masks[i, BusAction.HIGH_DEMAND.value] = self._find_highest_demand_stop(bus, rider_queue, queue_len) is not None
+            # SKIP_LOW only reroutes away from a known, low-demand next stop, and only if a busier one is near
+            masks[i, BusAction.SKIP_LOW.value] = (
+                bus.next_stop is not None and rider_queue.get_queue_length(bus.next_stop) < 2
+                and self._find_alternative_stop(bus, rider_queue, queue_len) is not None
+            )
+            # SHORT_HOLD only makes sense at a stop
+            masks[i, BusAction.SHORT_HOLD.value] = bus.current_node in self.city_grid.stops
         
-        return best_stop
+        return masks
     
-    def _find_alternative_stop(self, bus: Bus, rider_queue) -> Optional[int]:
-        """Find alternative stop with higher demand"""
-        if not bus.next_stop:
+    def _build_stop_distances(self):
+        """Precompute Manhattan distances between all stops, in city_grid.stops order"""
+        stops = self.city_grid.stops
+        self._search_stop_ids = np.array(list(stops.keys()), dtype=np.int64)
+        self._search_stop_row = {stop_id: row for row, stop_id in enumerate(stops.keys())}
+        xy = np.array([(stop.x, stop.y) for stop in stops.values()], dtype=np.float64).reshape(-1, 2)
+        self._stop_distances = np.abs(xy[:, None, :] - xy[None, :, :]).sum(axis=2)
+    
+    def _stop_queue_lengths(self, rider_queue) -> np.ndarray:
+        """Queue length of every stop, in city_grid.stops order"""
+        if self._stop_distances is None:
+            self._build_stop_distances()
+        return np.fromiter((rider_queue.get_queue_length(stop_id) for stop_id in self._search_stop_ids),
+                           dtype=np.float64, count=len(self._search_stop_ids))
+    
+    def _find_highest_demand_stop(self, bus: Bus, rider_queue, queue_len: Optional[np.ndarray] = None) -> Optional[int]:
+        """Find stop with highest rider demand, weighted by inverse distance (first stop wins ties)"""
+        if queue_len is None:
+            queue_len = self._stop_queue_lengths(rider_queue)
+        row = self._search_stop_row.get(bus.current_node)
+        if row is None:
+            return None  # Not at a stop: every distance is infinite
+        
+        distance = self._stop_distances[row]
+        weighted_demand = np.where(distance > 0, queue_len / (1 + distance / 10), 0.0)  # Normalize distance
+        best = int(weighted_demand.argmax())
+        return int(self._search_stop_ids[best]) if weighted_demand[best] > 0 else None
+    
+    def _find_alternative_stop(self, bus: Bus, rider_queue, queue_len: Optional[np.ndarray] = None) -> Optional[int]:
+        """Find the first nearby stop with significantly higher demand than the next stop"""
+        if bus.next_stop is None:
+            return None
+        if queue_len is None:
+            queue_len = self._stop_queue_lengths(rider_queue)
+        row = self._search_stop_row.get(bus.current_node)
+        if row is None:
             return None
         
         current_demand = rider_queue.get_queue_length(bus.next_stop)
+        candidates = (queue_len > current_demand + 1) & (self._stop_distances[row] <= 8)  # Within reasonable distance
+        candidates[row] = False
+        next_row = self._search_stop_row.get(bus.next_stop)
+        if next_row is not None:
+            candidates[next_row] = False
         
-        # Look for nearby stops with higher demand
-        for stop_id in self.city_grid.stops.keys():
-            if stop_id in [bus.current_node, bus.next_stop]:
-                continue
-            
-            queue_len = rider_queue.get_queue_length(stop_id)
-            if queue_len > current_demand + 1:  # Significantly higher demand
-                distance = self.city_grid.distance_between_stops(bus.current_node, stop_id)
-                if distance <= 8:  # Within reasonable distance
-                    return stop_id
-        
-        return None
+        hits = np.flatnonzero(candidates)
+        return int(self._search_stop_ids[hits[0]]) if len(hits) else None
     
     def _find_nearest_stop(self, bus: Bus) -> Optional[int]:
         """Find nearest stop to bus"""
@@ -238,8 +323,74 @@ class BusFleet:
         
         return nearest_stop
     
-    def update_movement(self, time_step: float):
+    def _set_path(self, bus: Bus, path: List[int]):
+        """Assign a new path and keep the edge -> buses index in sync"""
+        self._unindex_edges(bus, bus.path[bus.path_index:])
+        bus.path = path
+        bus.path_index = 0
+        for key in zip(path, path[1:]):
+            self._buses_by_edge.setdefault(key, set()).add(bus.id)
+    
+    def _unindex_edges(self, bus: Bus, nodes: List[int]):
+        for key in zip(nodes, nodes[1:]):
+            users = self._buses_by_edge.get(key)
+            if users is not None:
+                users.discard(bus.id)
+                if not users:
+                    del self._buses_by_edge[key]
+    
+    def _on_edges_changed(self, edge_keys: List[Tuple[int, int]]):
+        """City grid callback: mark buses whose remaining path crosses a changed edge"""
+        for key in edge_keys:
+            users = self._buses_by_edge.get(key)
+            if users:
+                self._pending_reroutes.update(users)
+    
+    def _reroute_pending(self):
+        """Re-plan, as one batch, only the buses affected by edge changes since the last step"""
+        for bus_id in sorted(self._pending_reroutes):
+            self._reroute_ahead(self.buses[bus_id])
+        self._pending_reroutes.clear()
+    
+    def _reroute_ahead(self, bus: Bus):
+        """Re-plan the rest of a path from the node the bus is currently heading to
+        
+        The edge being traversed is kept (with its progress); a closure on it is
+        still handled by _replan_route when the bus tries to continue.
+        """
+        if not bus.next_stop or bus.path_index + 1 >= len(bus.path) - 1:
+            return
+        
+        pivot = bus.path[bus.path_index + 1]
+        edge_time = self.city_grid.get_travel_time(bus.path[bus.path_index], pivot)
+        pivot_time = self.current_time + (1.0 - bus.travel_progress) * (edge_time if edge_time != float('inf') else 0.0)
+        tail = self._plan_path(pivot, bus.next_stop, pivot_time)
+        if not tail:
+            return
+        
+        new_path = [bus.path[bus.path_index]] + tail
+        if new_path == bus.path[bus.path_index:]:
+            return
+        
+        travel_progress = bus.travel_progress
+        self._set_path(bus, new_path)
+        bus.target_node = new_path[1]
+        bus.travel_progress = travel_progress
+        bus.replan_count += 1
+    
+    def _plan_path(self, start: int, end: int, departure_time: float) -> List[int]:
+        """Shortest path, arrival-time aware when a time-dependent router is set"""
+        if self.router is not None:
+            return self.router.shortest_path(start, end, departure_time)[0]
+        return self.city_grid.shortest_path(start, end)
+    
+    def update_movement(self, time_step: float, current_time: Optional[float] = None):
         """Update bus positions and movement"""
+        if current_time is not None:
+            self.current_time = current_time
+        if self._pending_reroutes:
+            self._reroute_pending()
+        
         for bus in self.buses.values():
             # Handle holding
             if bus.hold_time_remaining > 0:
@@ -260,11 +411,10 @@ class BusFleet:
             return
         
         # Find path to target stop
-        path = self.city_grid.shortest_path(bus.current_node, bus.next_stop)
+        path = self._plan_path(bus.current_node, bus.next_stop, self.current_time)
         
         if len(path) > 1:
-            bus.path = path
-            bus.path_index = 0
+            self._set_path(bus, path)
             bus.target_node = path[1]  # Next node in path
             bus.travel_progress = 0.0
     
@@ -292,6 +442,7 @@ class BusFleet:
         # Check if reached next node
         if bus.travel_progress >= 1.0:
             bus.travel_progress = 0.0
+            self._unindex_edges(bus, [current_node, next_node])
             bus.path_index += 1
             bus.current_node = next_node
             
@@ -304,8 +455,7 @@ class BusFleet:
             # Check if reached destination
             if bus.path_index >= len(bus.path) - 1:
                 bus.target_node = None
-                bus.path = []
-                bus.path_index = 0
+                self._set_path(bus, [])
                 
                 # Arrived at stop, set up next destination
                 if bus.mode == BusMode.STATIC:
@@ -320,10 +470,9 @@ class BusFleet:
         if not bus.next_stop:
             return
         
-        new_path = self.city_grid.shortest_path(bus.current_node, bus.next_stop)
+        new_path = self._plan_path(bus.current_node, bus.next_stop, self.current_time)
         if len(new_path) > 1:
-            bus.path = new_path
-            bus.path_index = 0
+            self._set_path(bus, new_path)
             bus.target_node = new_path[1]
             bus.travel_progress = 0.0
             bus.replan_count += 1
@@ -378,6 +527,69 @@ class BusFleet:
         
         return np.array(state, dtype=np.float32)
     
+    def _build_neighbor_index(self, num_neighbor_stops: int):
+        """Precompute the nearest stops (Manhattan distance) for every grid node"""
+        num_nodes = self.city_grid.width * self.city_grid.height
+        self._node_xy = np.zeros((num_nodes, 2), dtype=np.float32)
+        for node_id, (x, y) in self.city_grid.id_to_node.items():
+            self._node_xy[node_id] = (x, y)
+        
+        self._stop_ids = np.array(sorted(self.city_grid.stops.keys()), dtype=np.int64)
+        stop_xy = self._node_xy[self._stop_ids]
+        
+        # [num_nodes, num_stops] distances, computed once per grid
+        dist = np.abs(self._node_xy[:, None, :] - stop_xy[None, :, :]).sum(axis=2)
+        k = min(num_neighbor_stops, len(self._stop_ids))
+        nearest = np.argsort(dist, axis=1, kind="stable")[:, :k]
+        
+        self._neighbor_stops = nearest  # indices into self._stop_ids
+        self._num_neighbor_stops = num_neighbor_stops
+        self._stop_xy = stop_xy
+    
+    def get_local_observations(self, rider_queue, num_neighbor_stops: int = 4) -> np.ndarray:
+        """Get one fixed-size local observation per bus, shape [num_buses, local_dim]
+        
+        Per bus: own x, y, load, is_moving, hold_time; then dx, dy and queue length
+        of its nearest stops; then distance to the nearest other bus (headway).
+        """
+        if self._neighbor_stops is None or self._num_neighbor_stops != num_neighbor_stops:
+            self._build_neighbor_index(num_neighbor_stops)
+        
+        width = float(self.city_grid.width)
+        height = float(self.city_grid.height)
+        buses = list(self.buses.values())
+        num_buses = len(buses)
+        
+        queue_len = np.fromiter(
+            (rider_queue.get_queue_length(stop_id) for stop_id in self._stop_ids),
+            dtype=np.float32, count=len(self._stop_ids)
+        )
+        queue_len = np.minimum(queue_len / 10.0, 1.0)
+        
+        nodes = np.fromiter((bus.current_node for bus in buses), dtype=np.int64, count=num_buses)
+        bus_xy = self._node_xy[nodes]  # [B, 2]
+        
+        own = np.empty((num_buses, 5), dtype=np.float32)
+        own[:, 0] = bus_xy[:, 0] / width
+        own[:, 1] = bus_xy[:, 1] / height
+        own[:, 2] = [bus.load / bus.capacity for bus in buses]
+        own[:, 3] = [1.0 if bus.is_moving else 0.0 for bus in buses]
+        own[:, 4] = [bus.hold_time_remaining / 5.0 for bus in buses]
+        
+        # Neighborhood query: nearest stops of the node each bus is on
+        neighbors = self._neighbor_stops[nodes]  # [B, K]
+        offsets = (self._stop_xy[neighbors] - bus_xy[:, None, :]) / np.array([width, height], dtype=np.float32)
+        stops = np.concatenate([offsets, queue_len[neighbors][:, :, None]], axis=2).reshape(num_buses, -1)
+        
+        # Headway: Manhattan distance to the closest other bus
+        headway = np.ones((num_buses, 1), dtype=np.float32)
+        if num_buses > 1:
+            dist = np.abs(bus_xy[:, None, :] - bus_xy[None, :, :]).sum(axis=2)
+            np.fill_diagonal(dist, np.inf)
+            headway[:, 0] = np.minimum(dist.min(axis=1) / (width + height), 1.0)
+        
+        return np.concatenate([own, stops, headway], axis=1).astype(np.float32)
+    
     def get_fleet_stats(self) -> Dict[str, float]:
         """Get fleet-wide statistics"""
         total_load = sum(bus.load for bus in self.buses.values())
@@ -1,6 +1,6 @@
 import numpy as np
 import networkx as nx
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, List, Tuple, Optional, Set
 from dataclasses import dataclass
 from enum import Enum
 
@@ -16,12 +16,13 @@ class Edge:
     base_time: float
     factor: float = 1.0
     closed: bool = False
+    traffic: float = 1.0  # Background congestion, kept separate from disruptions
     
     @property
     def travel_time(self) -> float:
         if self.closed:
             return float('inf')
-        return self.base_time * self.factor
+        return self.base_time * self.factor * self.traffic
 
 @dataclass
 class Stop:
@@ -62,6 +63,31 @@ class ManhattanGrid:
         self.edges: Dict[Tuple[int, int], Edge] = {}
         self._initialize_edges()
         
+        # Fixed edge order and endpoint coordinates for per-edge arrays
+        self.edge_keys: List[Tuple[int, int]] = list(self.edges.keys())
+        self.edge_u_xy = np.array([self.id_to_node[u] for u, _ in self.edge_keys], dtype=np.int64)
+        self.edge_v_xy = np.array([self.id_to_node[v] for _, v in self.edge_keys], dtype=np.int64)
+        self.edge_traffic = np.ones(len(self.edge_keys))
+        
+        # Routing cache: one persistent weighted graph plus memoized shortest paths.
+        # Edge cost changes update single weights and drop only the paths they can affect.
+        self._routing_graph = nx.DiGraph()
+        for (u, v), edge in self.edges.items():
+            self._routing_graph.add_edge(u, v, weight=edge.travel_time)
+        self._path_cache: Dict[Tuple[int, int], Tuple[List[int], float]] = {}
+        self._paths_by_edge: Dict[Tuple[int, int], Set[Tuple[int, int]]] = {}
+        # Lower bound on the cost of one grid step (only ever lowered)
+        self._min_edge_time = min(edge.travel_time for edge in self.edges.values())
+        self.routing_stats = {"hits": 0, "misses": 0, "invalidated": 0}
+        # Bumped whenever any edge travel time changes
+        self.edge_version = 0
+        
+        # Called with the keys of edges whose travel time changed (e.g. BusFleet rerouting)
+        self._edge_listeners: List[Callable[[List[Tuple[int, int]]], None]] = []
+        
+        # Edges currently deviating from normal conditions (closed or slowed)
+        self.dirty_edges: Set[Tuple[int, int]] = set()
+        
         # Place bus stops strategically (major intersections)
         self.stops: Dict[int, Stop] = {}
         self._place_stops()
@@ -125,39 +151,148 @@ class ManhattanGrid:
     
     def close_edge(self, u: int, v: int):
         """Close an edge (road closure)"""
-        if (u, v) in self.edges:
-            self.edges[(u, v)].closed = True
-        if (v, u) in self.edges:
-            self.edges[(v, u)].closed = True
+        changes = []
+        for key in ((u, v), (v, u)):
+            if key in self.edges:
+                old_time = self.edges[key].travel_time
+                self.edges[key].closed = True
+                self.dirty_edges.add(key)
+                changes.append((key, old_time))
+        self._apply_edge_changes(changes)
     
     def slow_edge(self, u: int, v: int, factor: float = 2.0):
         """Add traffic to an edge"""
-        if (u, v) in self.edges:
-            self.edges[(u, v)].factor = factor
-        if (v, u) in self.edges:
-            self.edges[(v, u)].factor = factor
+        changes = []
+        for key in ((u, v), (v, u)):
+            if key in self.edges:
+                old_time = self.edges[key].travel_time
+                self.edges[key].factor = factor
+                self.dirty_edges.add(key)
+                changes.append((key, old_time))
+        self._apply_edge_changes(changes)
     
     def reset_edge(self, u: int, v: int):
         """Reset edge to normal conditions"""
-        if (u, v) in self.edges:
-            self.edges[(u, v)].closed = False
-            self.edges[(u, v)].factor = 1.0
-        if (v, u) in self.edges:
-            self.edges[(v, u)].closed = False
-            self.edges[(v, u)].factor = 1.0
+        changes = []
+        for key in ((u, v), (v, u)):
+            if key in self.edges:
+                old_time = self.edges[key].travel_time
+                self.edges[key].closed = False
+                self.edges[key].factor = 1.0
+                self.dirty_edges.discard(key)
+                changes.append((key, old_time))
+        self._apply_edge_changes(changes)
+    
+    def reset_edges(self):
+        """Reset only the edges that were closed or slowed since the last reset"""
+        changes = []
+        for key in self.dirty_edges:
+            edge = self.edges[key]
+            old_time = edge.travel_time
+            edge.closed = False
+            edge.factor = 1.0
+            changes.append((key, old_time))
+        self.dirty_edges.clear()
+        self._apply_edge_changes(changes)
+    
+    def set_traffic_factors(self, factors: np.ndarray) -> List[Tuple[int, int]]:
+        """Set background congestion for every edge, aligned with self.edge_keys
+        
+        Only edges whose factor actually changed are touched; returns their keys.
+        """
+        changed = np.flatnonzero(factors != self.edge_traffic)
+        changes = []
+        for i, factor in zip(changed.tolist(), factors[changed].tolist()):
+            key = self.edge_keys[i]
+            old_time = self.edges[key].travel_time
+            self.edges[key].traffic = factor
+            changes.append((key, old_time))
+        self.edge_traffic[changed] = factors[changed]
+        self._apply_edge_changes(changes)
+        return [key for key, _ in changes]
+    
+    def _apply_edge_changes(self, changes: List[Tuple[Tuple[int, int], float]]):
+        """Sync routing weights for changed edges and drop cached paths they may affect
+        
+        A cost increase can only hurt paths that use the edge. A decrease can also
+        create a shortcut, so a cached path is dropped when the best route through
+        the cheaper edge (Manhattan lower bound on both sides) could beat it.
+        """
+        changed = []
+        decreased = []
+        stale: Set[Tuple[int, int]] = set()
+        for key, old_time in changes:
+            new_time = self.edges[key].travel_time
+            if new_time == old_time:
+                continue
+            changed.append(key)
+            self._routing_graph.edges[key]['weight'] = new_time
+            stale |= self._paths_by_edge.get(key, set())
+            if new_time < old_time:
+                decreased.append((key, new_time))
+                self._min_edge_time = min(self._min_edge_time, new_time)
+        
+        if decreased and self._path_cache:
+            step = self._min_edge_time
+            for (start, end), (_, cost) in self._path_cache.items():
+                if (start, end) in stale:
+                    continue
+                sx, sy = self.id_to_node[start]
+                ex, ey = self.id_to_node[end]
+                for (u, v), new_time in decreased:
+                    ux, uy = self.id_to_node[u]
+                    vx, vy = self.id_to_node[v]
+                    bound = (abs(sx - ux) + abs(sy - uy) + abs(vx - ex) + abs(vy - ey)) * step + new_time
+                    if bound < cost:
+                        stale.add((start, end))
+                        break
+        
+        for od in stale:
+            self._drop_cached_path(od)
+        self.routing_stats["invalidated"] += len(stale)
+        
+        if changed:
+            self.edge_version += 1
+            for listener in self._edge_listeners:
+                listener(changed)
+    
+    def get_edge_travel_times(self) -> np.ndarray:
+        """Current travel time of every edge (inf if closed), aligned with self.edge_keys"""
+        return np.array([self.edges[key].travel_time for key in self.edge_keys])
+    
+    def add_edge_listener(self, listener: Callable[[List[Tuple[int, int]]], None]):
+        """Register a callback receiving the keys of edges whose travel time changed"""
+        self._edge_listeners.append(listener)
+    
+    def _drop_cached_path(self, od: Tuple[int, int]):
+        path, _ = self._path_cache.pop(od)
+        for key in zip(path, path[1:]):
+            users = self._paths_by_edge.get(key)
+            if users is not None:
+                users.discard(od)
     
     def shortest_path(self, start: int, end: int) -> List[int]:
-        """Find shortest path considering current edge conditions"""
+        """Find shortest path considering current edge conditions (cached)"""
+        od = (start, end)
+        cached = self._path_cache.get(od)
+        if cached is not None:
+            self.routing_stats["hits"] += 1
+            return list(cached[0])
+        
+        self.routing_stats["misses"] += 1
         try:
-            # Create temporary graph with current travel times
-            temp_graph = nx.DiGraph()
-            for (u, v), edge in self.edges.items():
-                if not edge.closed:
-                    temp_graph.add_edge(u, v, weight=edge.travel_time)
-            
-            return nx.shortest_path(temp_graph, start, end, weight='weight')
+            # Closed edges have infinite weight; returning None hides them from Dijkstra
+            cost, path = nx.single_source_dijkstra(
+                self._routing_graph, start, end,
+                weight=lambda u, v, data: None if data['weight'] == float('inf') else data['weight']
+            )
         except (nx.NetworkXNoPath, nx.NodeNotFound):
-            return []
+            cost, path = float('inf'), []
+        
+        self._path_cache[od] = (path, cost)
+        for key in zip(path, path[1:]):
+            self._paths_by_edge.setdefault(key, set()).add(od)
+        return list(path)
     
     def get_neighbors(self, node_id: int) -> List[int]:
         """Get neighboring nodes"""
@@ -167,9 +302,9 @@ class ManhattanGrid:
         """Get all stop IDs"""
         return list(self.stops.keys())
     
-    def get_random_stop(self) -> int:
-        """Get random stop ID"""
-        return np.random.choice(list(self.stops.keys()))
+    def get_random_stop(self, rng: np.random.Generator) -> int:
+        """Get random stop ID drawn from the caller's generator (e.g. a make_rng_streams stream)"""
+        return rng.choice(list(self.stops.keys()))
     
     def distance_between_stops(self, stop1: int, stop2: int) -> float:
         """Manhattan distance between stops"""
@@ -0,0 +1,339 @@
+"""
+Compiled GTFS feed: stops, routes, trips, shapes and route patterns as memory-mapped NumPy arrays
+
+The text feed is parsed once (csv module, no pandas) into .npy files under
+ui_data/cache/gtfs_<hash>/, where <hash> covers the content of every source
+file. Later loads only hash the sources and np.load the arrays with mmap_mode,
+so server startup stays in the millisecond range until the feed changes.
+
+Route patterns are the distinct (route, direction, stop sequence) combinations
+of the trips, each with the shape it runs on. Stop sequences come from
+stop_times.txt when the feed has one; otherwise stops are snapped onto the
+curb side of each shape and ordered by distance along it.
+
+Usage: python gtfs_feed.py [--force]
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+FORMAT_VERSION = 2
+
+EARTH_RADIUS_M = 6371000.0
+
+DEFAULT_GTFS_DIR = os.path.join(os.path.dirname(__file__), '..', 'ui_data', 'gtfs_m')
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'ui_data', 'cache')
+DEFAULT_GEOJSON_PATH = os.path.join(os.path.dirname(__file__), '..', 'ui_data', 'sample_manhattan_stops.geojson')
+SOURCE_FILES = ('stops.txt', 'routes.txt', 'trips.txt', 'shapes.txt')
+OPTIONAL_SOURCE_FILES = ('stop_times.txt',)
+
+# Stop snapping when the feed has no stop_times.txt
+SNAP_RADIUS_M = 25.0       # Farther than this from the shape: not on the route
+MIN_STOP_SPACING_M = 80.0  # Closer stops (duplicate ids, corner clusters) collapse into the one nearest the shape
+
+def feed_digest(gtfs_dir: str = DEFAULT_GTFS_DIR, geojson_path: Optional[str] = DEFAULT_GEOJSON_PATH) -> str:
+    """Content hash of every source file that goes into the compiled feed"""
+    digest = hashlib.sha1(f"gtfs-feed-v{FORMAT_VERSION}".encode())
+    paths = [os.path.join(gtfs_dir, name) for name in SOURCE_FILES]
+    paths += [path for path in (os.path.join(gtfs_dir, name) for name in OPTIONAL_SOURCE_FILES) if os.path.exists(path)]
+    if geojson_path and os.path.exists(geojson_path):
+        paths.append(geojson_path)
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _read_table(path: str) -> List[Dict[str, str]]:
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+def _strings(values: List[str]) -> np.ndarray:
+    """Fixed-width unicode array (memory-mappable, unlike object arrays)"""
+    return np.array(values, dtype=str) if values else np.array([], dtype='<U1')
+
+def _local_xy(lat: np.ndarray, lon: np.ndarray, lat0: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Meters east/north on a plane tangent at lat0 (fine at city scale)"""
+    scale = np.pi / 180.0 * EARTH_RADIUS_M
+    return lon * scale * np.cos(np.radians(lat0)), lat * scale
+
+def shape_distances(shape_offsets: np.ndarray, shape_lat: np.ndarray, shape_lon: np.ndarray) -> np.ndarray:
+    """Cumulative meters along each shape at every point (0 at each shape's first point)"""
+    x, y = _local_xy(shape_lat, shape_lon, float(shape_lat.mean()) if len(shape_lat) else 0.0)
+    steps = np.zeros(len(shape_lat))
+    steps[1:] = np.hypot(np.diff(x), np.diff(y))
+    steps[shape_offsets[:-1][shape_offsets[:-1] < len(steps)]] = 0.0
+    cumulative = np.cumsum(steps)
+    starts = np.repeat(shape_offsets[:-1], np.diff(shape_offsets))
+    return cumulative - cumulative[starts]
+
+def _snap_to_shape(lat: np.ndarray, lon: np.ndarray, dist: np.ndarray, stop_lat: np.ndarray, stop_lon: np.ndarray):
+    """Nearest point of the polyline to each stop: (meters along, meters off, True if on the right-hand side)"""
+    if len(lat) < 2:
+        count = len(stop_lat)
+        return np.zeros(count), np.full(count, np.inf), np.zeros(count, dtype=bool)
+    lat0 = float(lat.mean())
+    px, py = _local_xy(lat, lon, lat0)
+    sx, sy = _local_xy(stop_lat, stop_lon, lat0)
+    dx, dy = np.diff(px), np.diff(py)
+    
+    # Every stop against every segment at once: (stops, segments)
+    rx, ry = sx[:, None] - px[:-1], sy[:, None] - py[:-1]
+    t = np.clip((rx * dx + ry * dy) / np.maximum(dx * dx + dy * dy, 1e-9), 0.0, 1.0)
+    off = np.hypot(rx - t * dx, ry - t * dy)
+    
+    segment = off.argmin(axis=1)
+    rows = np.arange(len(sx))
+    along = dist[segment] + t[rows, segment] * (dist[segment + 1] - dist[segment])
+    right = dx[segment] * ry[rows, segment] - dy[segment] * rx[rows, segment] <= 0
+    return along, off[rows, segment], right
+
+def _snapped_stops(lat: np.ndarray, lon: np.ndarray, dist: np.ndarray,
+                   stop_lat: np.ndarray, stop_lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(stop indices, meters along) of the stops served by a shape, derived from geometry alone"""
+    # Cheap bounding-box prefilter before the stops x segments pass
+    margin = SNAP_RADIUS_M / (np.pi / 180.0 * EARTH_RADIUS_M) * 2
+    candidates = np.flatnonzero(
+        (stop_lat >= lat.min() - margin) & (stop_lat <= lat.max() + margin) &
+        (stop_lon >= lon.min() - margin) & (stop_lon <= lon.max() + margin)
+    )
+    along, off, right = _snap_to_shape(lat, lon, dist, stop_lat[candidates], stop_lon[candidates])
+    keep = (off <= SNAP_RADIUS_M) & (right | (off < 3.0))
+    candidates, along, off = candidates[keep], along[keep], off[keep]
+    
+    order = np.argsort(along, kind='stable')
+    candidates, along, off = candidates[order], along[order], off[order]
+    if len(along) == 0:
+        return candidates, along
+    
+    # Runs of stops closer than MIN_STOP_SPACING_M are one stop: keep the one nearest the shape
+    cluster = np.concatenate([[0], np.cumsum(np.diff(along) >= MIN_STOP_SPACING_M)])
+    best = np.lexsort((off, cluster))
+    first = np.concatenate([[True], cluster[best][1:] != cluster[best][:-1]])
+    chosen = np.sort(best[first])
+    return candidates[chosen], along[chosen]
+
+def _scheduled_stops(stop_sequence: List[int], lat: np.ndarray, lon: np.ndarray, dist: np.ndarray,
+                     stop_lat: np.ndarray, stop_lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(stop indices, meters along) for a stop_times sequence; distances are forced non-decreasing"""
+    stops = np.array(stop_sequence, dtype=np.int64)
+    along, _, _ = _snap_to_shape(lat, lon, dist, stop_lat[stops], stop_lon[stops])
+    return stops, np.maximum.accumulate(along) if len(along) else along
+
+def _read_stop_sequences(path: str, trip_ids: Dict[str, int], stop_index: Dict[str, int]) -> Dict[int, List[int]]:
+    """Ordered stop indices of the given trips, streamed from stop_times.txt"""
+    rows: Dict[int, List[Tuple[int, int]]] = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            trip = trip_ids.get(row['trip_id'])
+            stop = stop_index.get(row['stop_id'])
+            if trip is not None and stop is not None:
+                rows.setdefault(trip, []).append((int(row['stop_sequence']), stop))
+    return {trip: [stop for _, stop in sorted(sequence)] for trip, sequence in rows.items()}
+
+def compile_patterns(arrays: Dict[str, np.ndarray], stop_times_path: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """Deduplicated route patterns: route, direction, shape, trip count and CSR stop lists with distances"""
+    trip_keys = list(zip(arrays['trip_route'].tolist(), arrays['trip_direction'].tolist(), arrays['trip_shape'].tolist()))
+    trip_count: Dict[Tuple[int, int, int], int] = {}
+    first_trip: Dict[Tuple[int, int, int], int] = {}
+    for trip, key in enumerate(trip_keys):
+        if key[0] < 0 or key[2] < 0:
+            continue
+        trip_count[key] = trip_count.get(key, 0) + 1
+        first_trip.setdefault(key, trip)
+    
+    sequences: Dict[int, List[int]] = {}
+    if stop_times_path and os.path.exists(stop_times_path):
+        trip_ids = {str(arrays['trip_id'][trip]): trip for trip in first_trip.values()}
+        stop_index = {stop_id: i for i, stop_id in enumerate(arrays['stop_id'].tolist())}
+        sequences = _read_stop_sequences(stop_times_path, trip_ids, stop_index)
+    
+    offsets, shape_lat, shape_lon, shape_dist = (arrays[name] for name in ('shape_offsets', 'shape_lat', 'shape_lon', 'shape_dist'))
+    stop_lat, stop_lon = arrays['stop_lat'], arrays['stop_lon']
+    patterns: Dict[Tuple, List] = {}
+    for key in sorted(trip_count, key=lambda k: (k[0], k[1], -trip_count[k], k[2])):
+        route, direction, shape = key
+        start, end = offsets[shape], offsets[shape + 1]
+        lat, lon, dist = shape_lat[start:end], shape_lon[start:end], shape_dist[start:end]
+        if first_trip[key] in sequences:
+            stops, along = _scheduled_stops(sequences[first_trip[key]], lat, lon, dist, stop_lat, stop_lon)
+        else:
+            stops, along = _snapped_stops(lat, lon, dist, stop_lat, stop_lon)
+        
+        # Shape variants with the same stops are one pattern, run on the busiest variant's shape
+        dedup_key = (route, direction, tuple(stops.tolist()))
+        if dedup_key in patterns:
+            patterns[dedup_key][3] += trip_count[key]
+        else:
+            patterns[dedup_key] = [route, direction, shape, trip_count[key], stops, along]
+    
+    rows = list(patterns.values())
+    stop_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    stop_offsets[1:] = np.cumsum([len(row[4]) for row in rows])
+    return {
+        'pattern_route': np.array([row[0] for row in rows], dtype=np.int32),
+        'pattern_direction': np.array([row[1] for row in rows], dtype=np.int8),
+        'pattern_shape': np.array([row[2] for row in rows], dtype=np.int32),
+        'pattern_trips': np.array([row[3] for row in rows], dtype=np.int32),
+        'pattern_stop_offsets': stop_offsets,
+        'pattern_stop': np.concatenate([row[4] for row in rows]).astype(np.int32) if rows else np.zeros(0, dtype=np.int32),
+        'pattern_stop_dist': np.concatenate([row[5] for row in rows]).astype(np.float64) if rows else np.zeros(0),
+    }
+
+def compile_feed(gtfs_dir: str = DEFAULT_GTFS_DIR, geojson_path: Optional[str] = DEFAULT_GEOJSON_PATH) -> Dict[str, np.ndarray]:
+    """Parse the text feed into flat arrays; trips and shapes reference routes/shapes by index"""
+    stops = _read_table(os.path.join(gtfs_dir, 'stops.txt'))
+    routes = _read_table(os.path.join(gtfs_dir, 'routes.txt'))
+    trips = _read_table(os.path.join(gtfs_dir, 'trips.txt'))
+    
+    # Shape points grouped per shape and ordered by sequence: CSR offsets into lat/lon
+    points: Dict[str, List[Tuple[int, float, float]]] = {}
+    with open(os.path.join(gtfs_dir, 'shapes.txt'), newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            points.setdefault(row['shape_id'], []).append(
+                (int(row['shape_pt_sequence']), float(row['shape_pt_lat']), float(row['shape_pt_lon']))
+            )
+    shape_ids = sorted(points)
+    shape_offsets = np.zeros(len(shape_ids) + 1, dtype=np.int64)
+    shape_offsets[1:] = np.cumsum([len(points[shape_id]) for shape_id in shape_ids])
+    ordered = [point for shape_id in shape_ids for point in sorted(points[shape_id])]
+    
+    route_index = {row['route_id']: i for i, row in enumerate(routes)}
+    shape_index = {shape_id: i for i, shape_id in enumerate(shape_ids)}
+    
+    arrays = {
+        'stop_id': _strings([row['stop_id'] for row in stops]),
+        'stop_name': _strings([row['stop_name'] for row in stops]),
+        'stop_lat': np.array([float(row['stop_lat']) for row in stops], dtype=np.float64),
+        'stop_lon': np.array([float(row['stop_lon']) for row in stops], dtype=np.float64),
+        'route_id': _strings([row['route_id'] for row in routes]),
+        'route_short_name': _strings([row.get('route_short_name', '') for row in routes]),
+        'route_long_name': _strings([row.get('route_long_name', '') for row in routes]),
+        'route_color': _strings([row.get('route_color', '') for row in routes]),
+        'trip_id': _strings([row['trip_id'] for row in trips]),
+        'trip_route': np.array([route_index.get(row['route_id'], -1) for row in trips], dtype=np.int32),
+        'trip_shape': np.array([shape_index.get(row.get('shape_id', ''), -1) for row in trips], dtype=np.int32),
+        'trip_direction': np.array([int(row.get('direction_id') or 0) for row in trips], dtype=np.int8),
+        'trip_headsign': _strings([row.get('trip_headsign', '') for row in trips]),
+        'shape_id': _strings(shape_ids),
+        'shape_offsets': shape_offsets,
+        'shape_lat': np.array([lat for _, lat, _ in ordered], dtype=np.float64),
+        'shape_lon': np.array([lon for _, _, lon in ordered], dtype=np.float64),
+    }
+    arrays['shape_dist'] = shape_distances(shape_offsets, arrays['shape_lat'], arrays['shape_lon'])
+    arrays.update(compile_patterns(arrays, os.path.join(gtfs_dir, 'stop_times.txt')))
+    
+    # Demo stops shipped with the UI
+    ui_stops = []
+    if geojson_path and os.path.exists(geojson_path):
+        with open(geojson_path, 'r') as f:
+            for feature in json.load(f).get('features', []):
+                geom = feature.get('geometry') or {}
+                if geom.get('type') == 'Point' and geom.get('coordinates'):
+                    ui_stops.append((feature.get('properties') or {}, geom['coordinates']))
+    arrays['ui_stop_id'] = _strings([str(props.get('stop_id', i)) for i, (props, _) in enumerate(ui_stops)])
+    arrays['ui_stop_name'] = _strings([props.get('stop_name', '') for props, _ in ui_stops])
+    arrays['ui_stop_lon'] = np.array([coords[0] for _, coords in ui_stops], dtype=np.float64)
+    arrays['ui_stop_lat'] = np.array([coords[1] for _, coords in ui_stops], dtype=np.float64)
+    return arrays
+
+class CompiledFeed:
+    """Read-only view over the compiled arrays (attributes named after the .npy files)"""
+    
+    def __init__(self, arrays: Dict[str, np.ndarray], source_hash: str, directory: Optional[str] = None):
+        self.arrays = arrays
+        self.source_hash = source_hash
+        self.directory = directory
+        for name, array in arrays.items():
+            setattr(self, name, array)
+    
+    @property
+    def num_stops(self) -> int:
+        return len(self.stop_id)
+    
+    def shape_points(self, shape: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(lat, lon) polyline of shape index"""
+        start, end = self.shape_offsets[shape], self.shape_offsets[shape + 1]
+        return self.shape_lat[start:end], self.shape_lon[start:end]
+    
+    @property
+    def num_patterns(self) -> int:
+        return len(self.pattern_route)
+    
+    def pattern_stops(self, pattern: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(stop indices, meters along the shape) of pattern index, in travel order"""
+        start, end = self.pattern_stop_offsets[pattern], self.pattern_stop_offsets[pattern + 1]
+        return self.pattern_stop[start:end], self.pattern_stop_dist[start:end]
+
+def _write_cache(arrays: Dict[str, np.ndarray], source_hash: str, directory: str):
+    """Write into a scratch directory, then rename it into place so readers never see half a cache"""
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    scratch = f"{directory}.tmp{os.getpid()}"
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    for name, array in arrays.items():
+        np.save(os.path.join(scratch, f"{name}.npy"), array)
+    with open(os.path.join(scratch, 'manifest.json'), 'w') as f:
+        json.dump({'format_version': FORMAT_VERSION, 'source_hash': source_hash, 'arrays': sorted(arrays)}, f)
+    try:
+        os.rename(scratch, directory)
+    except OSError:
+        shutil.rmtree(scratch, ignore_errors=True)  # Another process won the race
+
+def _read_cache(directory: str) -> Optional[CompiledFeed]:
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            return None
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+            for name in manifest['arrays']
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    return CompiledFeed(arrays, manifest['source_hash'], directory)
+
+def load_feed(gtfs_dir: str = DEFAULT_GTFS_DIR, geojson_path: Optional[str] = DEFAULT_GEOJSON_PATH,
+              cache_dir: str = DEFAULT_CACHE_DIR, force: bool = False) -> CompiledFeed:
+    """Memory-map the compiled feed, compiling it first if the sources changed"""
+    source_hash = feed_digest(gtfs_dir, geojson_path)
+    directory = os.path.join(cache_dir, f"gtfs_{source_hash[:16]}")
+    if force:
+        shutil.rmtree(directory, ignore_errors=True)
+    
+    feed = _read_cache(directory)
+    if feed is None:
+        shutil.rmtree(directory, ignore_errors=True)
+        _write_cache(compile_feed(gtfs_dir, geojson_path), source_hash, directory)
+        feed = _read_cache(directory)
+    return feed
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the GTFS feed into the NumPy cache")
+    parser.add_argument('--gtfs-dir', default=DEFAULT_GTFS_DIR)
+    parser.add_argument('--geojson', default=DEFAULT_GEOJSON_PATH)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the cache is current')
+    args = parser.parse_args()
+    
+    started = time.perf_counter()
+    feed = load_feed(args.gtfs_dir, args.geojson, args.cache_dir, force=args.force)
+    print(f"Compiled feed {feed.source_hash[:16]} in {time.perf_counter() - started:.2f}s: "
+          f"{feed.num_stops} stops, {len(feed.route_id)} routes, {len(feed.trip_id)} trips, "
+          f"{len(feed.shape_id)} shapes, {feed.num_patterns} patterns -> {feed.directory}")
+    
+    started = time.perf_counter()
+    load_feed(args.gtfs_dir, args.geojson, args.cache_dir)
+    print(f"Cached load: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
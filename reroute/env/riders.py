@@ -3,6 +3,7 @@ from typing import Dict, List, Tuple
 from dataclasses import dataclass
 from enum import Enum
 import math
+from seeding import make_rng_streams
 
 class TimeOfDay(Enum):
     MORNING_RUSH = "morning_rush"    # 7-9 AM
@@ -32,7 +33,8 @@ class RiderGenerator:
         self.stop_ids = list(stops.keys())
         self.rider_counter = 0
         
-        np.random.seed(seed)
+        # Private random streams so that generators in parallel envs stay independent
+        self.reseed(seed)
         
         # Time-of-day arrival rates (riders per minute per stop)
         self.base_rates = {
@@ -51,6 +53,9 @@ class RiderGenerator:
         # Current surge zones
         self.surge_zones: Dict[int, float] = {}  # stop_id -> multiplier
         
+        # Global scale on all arrival rates (curriculum / scenario knob)
+        self.demand_multiplier = 1.0
+        
     def _initialize_stop_popularity(self) -> Dict[int, float]:
         """Initialize stop popularity multipliers"""
         popularity = {}
@@ -106,6 +111,13 @@ class RiderGenerator:
         else:
             return TimeOfDay.NIGHT
     
+    def reseed(self, seed: int):
+        """Restart the arrival stream without rebuilding popularity/preference tables"""
+        streams = make_rng_streams(seed)
+        self.arrival_rng = streams["arrivals"]
+        self.destination_rng = streams["destinations"]
+        self.rider_counter = 0
+    
     def add_surge(self, stop_id: int, multiplier: float):
         """Add a demand surge at a specific stop"""
         self.surge_zones[stop_id] = multiplier
@@ -115,6 +127,10 @@ class RiderGenerator:
         if stop_id in self.surge_zones:
             del self.surge_zones[stop_id]
     
+    def set_demand_multiplier(self, multiplier: float):
+        """Scale arrival rates at every stop"""
+        self.demand_multiplier = max(0.0, float(multiplier))
+    
     def clear_surges(self):
         """Clear all surges"""
         self.surge_zones.clear()
@@ -123,7 +139,7 @@ class RiderGenerator:
         """Generate new rider arrivals in the time step"""
         new_riders = []
         time_period = self.get_time_of_day(current_time)
-        base_rate = self.base_rates[time_period]
+        base_rate = self.base_rates[time_period] * self.demand_multiplier
         
         for stop_id in self.stop_ids:
             # Calculate arrival rate for this stop
@@ -136,7 +152,7 @@ class RiderGenerator:
             # Generate arrivals using Poisson process
             # Expected arrivals in time_step
             lambda_param = rate * time_step
-            num_arrivals = np.random.poisson(lambda_param)
+            num_arrivals = self.arrival_rng.poisson(lambda_param)
             
             for _ in range(num_arrivals):
                 destination = self._choose_destination(stop_id, time_period)
@@ -145,7 +161,7 @@ class RiderGenerator:
                         id=self.rider_counter,
                         origin=stop_id,
                         destination=destination,
-                        arrival_time=current_time + np.random.uniform(0, time_step)
+                        arrival_time=current_time + self.arrival_rng.uniform(0, time_step)
                     )
                     new_riders.append(rider)
                     self.rider_counter += 1
@@ -164,9 +180,9 @@ class RiderGenerator:
         total_weight = sum(weights)
         if total_weight > 0:
             probs = [w / total_weight for w in weights]
-            return np.random.choice(possible_destinations, p=probs)
+            return self.destination_rng.choice(possible_destinations, p=probs)
         else:
-            return np.random.choice(possible_destinations)
+            return self.destination_rng.choice(possible_destinations)
 
 class RiderQueue:
     """Manages rider queues at bus stops"""
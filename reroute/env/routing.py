@@ -0,0 +1,140 @@
+import heapq
+import numpy as np
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+
+MINUTES_PER_DAY = 24 * 60
+
+class TimeDependentRouter:
+    """Arrival-time-aware shortest paths over precompiled time-of-day edge profiles
+    
+    Each edge's congestion multiplier is compiled once into a piecewise-linear
+    profile over the day: constant within a TrafficModel period and linearly
+    interpolated across a blend window around each period boundary. A query runs
+    a time-dependent Dijkstra that prices every edge at the time the bus reaches it.
+    
+    Live conditions (closures, slowdowns, zones, weather) come from the grid's
+    current travel times, rescaled by profile(t) / profile(live_period), where
+    live_period is the period those travel times were computed for.
+    """
+    
+    def __init__(self, city_grid, traffic_model, blend_minutes: float = 30.0):
+        self.city_grid = city_grid
+        self.traffic_model = traffic_model
+        self.blend_minutes = blend_minutes
+        
+        # Adjacency over edge indices (city_grid.edge_keys order)
+        self._adjacency: Dict[int, List[Tuple[int, int]]] = {}
+        for i, (u, v) in enumerate(city_grid.edge_keys):
+            self._adjacency.setdefault(u, []).append((v, i))
+        
+        # Period the grid's live edge factors belong to; the environment sets it with them
+        self.live_period = traffic_model.get_time_period(0)
+        
+        self._compiled_level = None
+        self._scaled_key = None
+        self.compile()
+    
+    def _period_boundaries(self) -> List[Tuple[int, str, str]]:
+        """(minute, period before, period after) for every period change in a day"""
+        boundaries = []
+        previous = self.traffic_model.get_time_period(0)
+        for minute in range(1, MINUTES_PER_DAY):
+            period = self.traffic_model.get_time_period(minute)
+            if period != previous:
+                boundaries.append((minute, previous, period))
+            previous = period
+        return boundaries
+    
+    def compile(self):
+        """Build breakpoints [K] and per-edge multipliers [K, num_edges] for the current traffic level"""
+        u_xy, v_xy = self.city_grid.edge_u_xy, self.city_grid.edge_v_xy
+        periods = self.traffic_model.time_of_day_factors.keys()
+        self.period_factors = {
+            period: self.traffic_model.get_period_edge_factors(period, u_xy, v_xy) for period in periods
+        }
+        
+        half = self.blend_minutes / 2
+        breakpoints = [0.0]
+        profiles = [self.period_factors[self.traffic_model.get_time_period(0)]]
+        for minute, before, after in self._period_boundaries():
+            breakpoints += [minute - half, minute + half]
+            profiles += [self.period_factors[before], self.period_factors[after]]
+        breakpoints.append(float(MINUTES_PER_DAY))
+        profiles.append(self.period_factors[self.traffic_model.get_time_period(MINUTES_PER_DAY - 1)])
+        
+        self.breakpoints = np.array(breakpoints)
+        self.profiles = np.stack(profiles)
+        # Segment k: multiplier(t) = profiles[k] + slopes[k] * (t - breakpoints[k])
+        self.slopes = np.diff(self.profiles, axis=0) / np.diff(self.breakpoints)[:, None]
+        self._compiled_level = self.traffic_model.traffic_level
+        self._scaled_key = None
+    
+    def _scaled_segments(self) -> Tuple[List[List[float]], List[List[float]]]:
+        """Per-segment intercepts and slopes in minutes, scaled to live grid conditions"""
+        if self.traffic_model.traffic_level != self._compiled_level:
+            self.compile()
+        
+        key = (self.city_grid.edge_version, self.live_period)
+        if key != self._scaled_key:
+            # Live times carry live_period's congestion; divide it out to get the per-edge baseline
+            live = self.city_grid.get_edge_travel_times()
+            scale = live / self.period_factors[self.live_period]
+            closed = np.isinf(scale)
+            scale[closed] = 0.0
+            
+            intercepts = self.profiles[:-1] * scale
+            intercepts[:, closed] = np.inf
+            self._intercepts = intercepts.tolist()
+            self._slopes = (self.slopes * scale).tolist()
+            self._breakpoint_list = self.breakpoints.tolist()
+            self._scaled_key = key
+        
+        return self._intercepts, self._slopes
+    
+    def shortest_path(self, start: int, end: int, departure_time: float) -> Tuple[List[int], float]:
+        """Earliest-arrival path from start to end leaving at departure_time
+        
+        Returns (path, arrival_time); ([], inf) if end is unreachable.
+        """
+        intercepts, slopes = self._scaled_segments()
+        breakpoints = self._breakpoint_list
+        last_segment = len(intercepts) - 1
+        
+        arrival = {start: departure_time}
+        previous: Dict[int, int] = {}
+        visited = set()
+        heap = [(departure_time, start)]
+        
+        while heap:
+            time, node = heapq.heappop(heap)
+            if node in visited:
+                continue
+            if node == end:
+                break
+            visited.add(node)
+            
+            # All edges leaving this node are priced at the same departure time
+            minute = time % MINUTES_PER_DAY
+            k = min(bisect_right(breakpoints, minute) - 1, last_segment)
+            offset = minute - breakpoints[k]
+            intercept, slope = intercepts[k], slopes[k]
+            
+            for neighbor, edge_index in self._adjacency.get(node, ()):
+                travel_time = intercept[edge_index] + slope[edge_index] * offset
+                if travel_time == float('inf'):
+                    continue
+                neighbor_arrival = time + travel_time
+                if neighbor_arrival < arrival.get(neighbor, float('inf')):
+                    arrival[neighbor] = neighbor_arrival
+                    previous[neighbor] = node
+                    heapq.heappush(heap, (neighbor_arrival, neighbor))
+        
+        if end not in arrival:
+            return [], float('inf')
+        
+        path = [end]
+        while path[-1] != start:
+            path.append(previous[path[-1]])
+        path.reverse()
+        return path, arrival[end]
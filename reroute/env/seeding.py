@@ -0,0 +1,11 @@
+import numpy as np
+from typing import Dict, Optional
+
+# Independent random streams owned by each simulation. Streams are spawned from a
+# single SeedSequence, so adding a name here never changes the existing streams.
+RNG_STREAMS = ("arrivals", "destinations", "disruptions", "baseline", "optimized", "layout")
+
+def make_rng_streams(seed: Optional[int]) -> Dict[str, np.random.Generator]:
+    """Derive one np.random.Generator per subsystem from a single seed"""
+    children = np.random.SeedSequence(seed).spawn(len(RNG_STREAMS))
+    return {name: np.random.default_rng(child) for name, child in zip(RNG_STREAMS, children)}
@@ -0,0 +1,403 @@
+"""
+Manhattan street graph with contraction-hierarchy hub labels for point-to-point queries
+
+The graph comes from GTFS shape polylines (load_shape_edges): points are snapped
+to a lat/lon grid, so routes sharing a street share nodes, and each directed
+segment is weighted by its length in meters.
+
+Preprocessing contracts the nodes in edge-difference order (_Contractor). Each
+node gets a rank, and a shortcut u->w is added, remembered in shortcut_via,
+wherever contracting v would break a shortest path u->v->w. Top-down over the
+ranks, every node's upward search space becomes a forward (out_*) and a
+backward (in_*) hub label. Entries that a higher hub already covers are pruned.
+Labels are stored as CSR arrays:
+
+    offsets  [num_nodes + 1]  label of node n is [offsets[n], offsets[n + 1])
+    hubs     sorted hub node ids per label
+    dists    meters from the node to the hub (out) or from the hub to it (in)
+    hops     first CH neighbor on the way, for unpacking paths
+
+distance(s, t) is the smallest out_dists + in_dists over the hubs that s's out
+label and t's in label share. shortest_path follows the hops to the meeting hub
+and expands shortcuts through shortcut_via.
+
+Everything is saved as one .npz, ui_data/cache/street_network_<hash>.npz.
+<hash> is the first 16 hex digits of the SHA-1 of shapes.txt, so changing the
+feed rebuilds the network. Changing FORMAT_VERSION does too: load() rejects the
+old file and load_or_build() builds and overwrites it.
+"""
+
+import csv
+import hashlib
+import heapq
+import math
+import os
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+EARTH_RADIUS_M = 6371000.0
+
+DEFAULT_SHAPES_PATH = os.path.join(os.path.dirname(__file__), '..', 'ui_data', 'gtfs_m', 'shapes.txt')
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'ui_data', 'cache')
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+def file_digest(path: str) -> str:
+    """Content hash used to key preprocessed caches"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_shape_edges(shapes_path: str, snap_decimals: int = 4) -> Tuple[np.ndarray, np.ndarray, Dict[Tuple[int, int], float]]:
+    """Directed street segments from GTFS shape polylines
+    
+    Shape points are snapped to a lat/lon grid (4 decimals is ~10 m) so that
+    polylines of different routes sharing a street merge into common nodes.
+    Returns (node_lat, node_lon, {(u, v): length_m}).
+    """
+    points: Dict[str, List[Tuple[int, float, float]]] = {}
+    with open(shapes_path, newline='') as f:
+        for row in csv.DictReader(f):
+            points.setdefault(row['shape_id'], []).append(
+                (int(row['shape_pt_sequence']), float(row['shape_pt_lat']), float(row['shape_pt_lon']))
+            )
+    
+    node_ids: Dict[Tuple[float, float], int] = {}
+    edges: Dict[Tuple[int, int], float] = {}
+    for shape_id in sorted(points):
+        previous = None
+        for _, lat, lon in sorted(points[shape_id]):
+            key = (round(lat, snap_decimals), round(lon, snap_decimals))
+            node = node_ids.setdefault(key, len(node_ids))
+            if previous is not None and previous != node:
+                (lat1, lon1), (lat2, lon2) = previous_key, key
+                length = haversine_m(lat1, lon1, lat2, lon2)
+                edge = (previous, node)
+                edges[edge] = min(length, edges.get(edge, float('inf')))
+            previous, previous_key = node, key
+    
+    coords = np.array(list(node_ids.keys()), dtype=np.float64).reshape(-1, 2)
+    return coords[:, 0].copy(), coords[:, 1].copy(), edges
+
+class _Contractor:
+    """Contraction hierarchy preprocessing over a directed weighted graph"""
+    
+    def __init__(self, num_nodes: int, edges: Dict[Tuple[int, int], float], witness_limit: int = 64):
+        self.num_nodes = num_nodes
+        self.witness_limit = witness_limit
+        self.out_adj: List[Dict[int, float]] = [{} for _ in range(num_nodes)]
+        self.in_adj: List[Dict[int, float]] = [{} for _ in range(num_nodes)]
+        for (u, v), weight in edges.items():
+            self.out_adj[u][v] = weight
+            self.in_adj[v][u] = weight
+        self.contracted = [False] * num_nodes
+        self.deleted_neighbors = [0] * num_nodes
+        # (u, w) -> contracted middle node for every shortcut
+        self.shortcut_via: Dict[Tuple[int, int], int] = {}
+        self.up_out: List[Dict[int, float]] = [None] * num_nodes
+        self.up_in: List[Dict[int, float]] = [None] * num_nodes
+        self.rank = np.zeros(num_nodes, dtype=np.int32)
+    
+    def _witness_distances(self, source: int, skip: int, limit: float) -> Dict[int, float]:
+        """Bounded Dijkstra from source over uncontracted nodes, avoiding skip"""
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        while heap and settled < self.witness_limit:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            for neighbor, weight in self.out_adj[node].items():
+                if neighbor == skip:
+                    continue
+                nd = d + weight
+                if nd < dist.get(neighbor, float('inf')):
+                    dist[neighbor] = nd
+                    heapq.heappush(heap, (nd, neighbor))
+        return dist
+    
+    def _shortcuts(self, node: int) -> List[Tuple[int, int, float]]:
+        """Shortcuts (u, w, weight) needed to contract node without breaking shortest paths"""
+        shortcuts = []
+        outgoing = self.out_adj[node]
+        if not outgoing:
+            return shortcuts
+        max_out = max(outgoing.values())
+        for u, w_in in self.in_adj[node].items():
+            witness = self._witness_distances(u, node, w_in + max_out)
+            for w, w_out in outgoing.items():
+                if w == u:
+                    continue
+                weight = w_in + w_out
+                if witness.get(w, float('inf')) > weight:
+                    shortcuts.append((u, w, weight))
+        return shortcuts
+    
+    def _priority(self, node: int) -> int:
+        edge_difference = len(self._shortcuts(node)) - len(self.in_adj[node]) - len(self.out_adj[node])
+        return edge_difference + self.deleted_neighbors[node]
+    
+    def contract(self):
+        """Contract every node in lazily updated edge-difference order"""
+        heap = [(self._priority(node), node) for node in range(self.num_nodes)]
+        heapq.heapify(heap)
+        level = 0
+        while heap:
+            _, node = heapq.heappop(heap)
+            priority = self._priority(node)
+            if heap and priority > heap[0][0]:
+                heapq.heappush(heap, (priority, node))
+                continue
+            
+            for u, w, weight in self._shortcuts(node):
+                if weight < self.out_adj[u].get(w, float('inf')):
+                    self.out_adj[u][w] = weight
+                    self.in_adj[w][u] = weight
+                    self.shortcut_via[(u, w)] = node
+            
+            # Every remaining neighbor is contracted later, i.e. ranks higher
+            self.up_out[node] = self.out_adj[node]
+            self.up_in[node] = self.in_adj[node]
+            for w in self.up_out[node]:
+                del self.in_adj[w][node]
+                self.deleted_neighbors[w] += 1
+            for u in self.up_in[node]:
+                del self.out_adj[u][node]
+                self.deleted_neighbors[u] += 1
+            self.out_adj[node], self.in_adj[node] = {}, {}
+            self.contracted[node] = True
+            self.rank[node] = level
+            level += 1
+
+def _merge_labels(node: int, upward: Dict[int, float], labels: List[Dict[int, Tuple[float, int]]]) -> Dict[int, Tuple[float, int]]:
+    """Label of node from the (final) labels of its upward neighbors: hub -> (distance, first hop)"""
+    label = {node: (0.0, node)}
+    for neighbor, weight in upward.items():
+        for hub, (d, _) in labels[neighbor].items():
+            candidate = weight + d
+            if candidate < label.get(hub, (float('inf'), -1))[0]:
+                label[hub] = (candidate, neighbor)
+    return label
+
+def _label_arrays(labels: List[Dict[int, Tuple[float, int]]]) -> Dict[str, np.ndarray]:
+    """CSR arrays with hubs sorted per node"""
+    offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(label) for label in labels])
+    hubs = np.empty(offsets[-1], dtype=np.int32)
+    dists = np.empty(offsets[-1], dtype=np.float64)
+    hops = np.empty(offsets[-1], dtype=np.int32)
+    for node, label in enumerate(labels):
+        start = offsets[node]
+        for i, hub in enumerate(sorted(label)):
+            hubs[start + i] = hub
+            dists[start + i], hops[start + i] = label[hub]
+    return {'offsets': offsets, 'hubs': hubs, 'dists': dists, 'hops': hops}
+
+class StreetNetwork:
+    """Real Manhattan street graph with hub-label point-to-point queries
+    
+    The graph is built from GTFS shape polylines, contracted into a contraction
+    hierarchy, and the CH upward search spaces are turned into pruned hub labels.
+    A distance query is then a single intersection of two short sorted label
+    arrays; paths are unpacked through label first hops and CH shortcuts.
+    """
+    
+    FORMAT_VERSION = 1
+    
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.node_lat = arrays['node_lat']
+        self.node_lon = arrays['node_lon']
+        self.edge_from = arrays['edge_from']
+        self.edge_to = arrays['edge_to']
+        self.edge_length = arrays['edge_length']
+        self.rank = arrays['rank']
+        self.source_hash = str(arrays['source_hash'])
+        self.num_nodes = len(self.node_lat)
+        
+        self._out = {name: arrays[f'out_{name}'] for name in ('offsets', 'hubs', 'dists', 'hops')}
+        self._in = {name: arrays[f'in_{name}'] for name in ('offsets', 'hubs', 'dists', 'hops')}
+        self.shortcut_via = {
+            (int(u), int(w)): int(v)
+            for u, w, v in zip(arrays['shortcut_from'], arrays['shortcut_to'], arrays['shortcut_via'])
+        }
+        
+        # Equirectangular projection for nearest-node lookups
+        self._lon_scale = math.cos(math.radians(float(np.mean(self.node_lat)))) if self.num_nodes else 1.0
+    
+    @classmethod
+    def build(cls, shapes_path: str = DEFAULT_SHAPES_PATH, snap_decimals: int = 4,
+              witness_limit: int = 64) -> 'StreetNetwork':
+        """Parse shapes.txt and preprocess it into hub labels (seconds, run once)"""
+        node_lat, node_lon, edges = load_shape_edges(shapes_path, snap_decimals)
+        num_nodes = len(node_lat)
+        
+        contractor = _Contractor(num_nodes, edges, witness_limit)
+        contractor.contract()
+        
+        # Top-down: every upward neighbor's label is final before it is merged
+        out_labels: List[Dict[int, Tuple[float, int]]] = [None] * num_nodes
+        in_labels: List[Dict[int, Tuple[float, int]]] = [None] * num_nodes
+        for node in np.argsort(-contractor.rank, kind='stable').tolist():
+            out_label = _merge_labels(node, contractor.up_out[node], out_labels)
+            in_label = _merge_labels(node, contractor.up_in[node], in_labels)
+            
+            # Prune entries that are not shortest paths (already covered via a higher hub)
+            for hub in [h for h in out_label if h != node]:
+                d = out_label[hub][0]
+                hub_in = in_labels[hub]
+                if any(out_label[g][0] + hub_in[g][0] < d for g in hub_in if g in out_label and g != hub):
+                    del out_label[hub]
+            for hub in [h for h in in_label if h != node]:
+                d = in_label[hub][0]
+                hub_out = out_labels[hub]
+                if any(hub_out[g][0] + in_label[g][0] < d for g in hub_out if g in in_label and g != hub):
+                    del in_label[hub]
+            
+            out_labels[node], in_labels[node] = out_label, in_label
+        
+        arrays = {
+            'node_lat': node_lat,
+            'node_lon': node_lon,
+            'edge_from': np.array([u for u, _ in edges], dtype=np.int32),
+            'edge_to': np.array([v for _, v in edges], dtype=np.int32),
+            'edge_length': np.array(list(edges.values()), dtype=np.float64),
+            'rank': contractor.rank,
+            'source_hash': np.array(file_digest(shapes_path)),
+            'shortcut_from': np.array([u for u, _ in contractor.shortcut_via], dtype=np.int32),
+            'shortcut_to': np.array([w for _, w in contractor.shortcut_via], dtype=np.int32),
+            'shortcut_via': np.array(list(contractor.shortcut_via.values()), dtype=np.int32),
+        }
+        for prefix, labels in (('out', out_labels), ('in', in_labels)):
+            for name, array in _label_arrays(labels).items():
+                arrays[f'{prefix}_{name}'] = array
+        return cls(arrays)
+    
+    def save(self, path: str):
+        """Persist the preprocessed network as a single .npz"""
+        arrays = {
+            'format_version': np.array(self.FORMAT_VERSION),
+            'node_lat': self.node_lat,
+            'node_lon': self.node_lon,
+            'edge_from': self.edge_from,
+            'edge_to': self.edge_to,
+            'edge_length': self.edge_length,
+            'rank': self.rank,
+            'source_hash': np.array(self.source_hash),
+            'shortcut_from': np.array([u for u, _ in self.shortcut_via], dtype=np.int32),
+            'shortcut_to': np.array([w for _, w in self.shortcut_via], dtype=np.int32),
+            'shortcut_via': np.array(list(self.shortcut_via.values()), dtype=np.int32),
+        }
+        for prefix, label in (('out', self._out), ('in', self._in)):
+            for name, array in label.items():
+                arrays[f'{prefix}_{name}'] = array
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str) -> 'StreetNetwork':
+        with np.load(path) as data:
+            if int(data['format_version']) != cls.FORMAT_VERSION:
+                raise ValueError(f"Unsupported street network format in {path}")
+            return cls({name: data[name] for name in data.files})
+    
+    @classmethod
+    def load_or_build(cls, shapes_path: str = DEFAULT_SHAPES_PATH,
+                      cache_dir: str = DEFAULT_CACHE_DIR) -> 'StreetNetwork':
+        """Load the cached network for this shapes.txt, preprocessing it only if the feed changed"""
+        cache_path = os.path.join(cache_dir, f'street_network_{file_digest(shapes_path)[:16]}.npz')
+        if os.path.exists(cache_path):
+            try:
+                return cls.load(cache_path)
+            except (ValueError, KeyError, OSError):
+                pass  # Stale or corrupt cache: rebuild below
+        
+        network = cls.build(shapes_path)
+        network.save(cache_path)
+        return network
+    
+    def _label(self, labels: Dict[str, np.ndarray], node: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = labels['offsets'][node], labels['offsets'][node + 1]
+        return labels['hubs'][start:end], labels['dists'][start:end]
+    
+    def _meeting_hub(self, source: int, target: int) -> Tuple[int, float]:
+        out_hubs, out_dists = self._label(self._out, source)
+        in_hubs, in_dists = self._label(self._in, target)
+        common, out_idx, in_idx = np.intersect1d(out_hubs, in_hubs, assume_unique=True, return_indices=True)
+        if len(common) == 0:
+            return -1, float('inf')
+        totals = out_dists[out_idx] + in_dists[in_idx]
+        best = int(np.argmin(totals))
+        return int(common[best]), float(totals[best])
+    
+    def distance(self, source: int, target: int) -> float:
+        """Shortest street distance in meters (inf if unreachable)"""
+        return self._meeting_hub(source, target)[1]
+    
+    def _hop(self, labels: Dict[str, np.ndarray], node: int, hub: int) -> int:
+        """First CH hop from node toward hub within node's label"""
+        start, end = labels['offsets'][node], labels['offsets'][node + 1]
+        i = start + int(np.searchsorted(labels['hubs'][start:end], hub))
+        return int(labels['hops'][i])
+    
+    def _unpack(self, u: int, w: int, path: List[int]):
+        """Append the original nodes of CH edge u->w (excluding u) to path"""
+        stack = [(u, w)]
+        while stack:
+            a, b = stack.pop()
+            via = self.shortcut_via.get((a, b))
+            if via is None:
+                path.append(b)
+            else:
+                stack.append((via, b))
+                stack.append((a, via))
+    
+    def shortest_path(self, source: int, target: int) -> Tuple[List[int], float]:
+        """Node sequence and length in meters; ([], inf) if unreachable"""
+        hub, distance = self._meeting_hub(source, target)
+        if hub < 0:
+            return [], float('inf')
+        
+        path = [source]
+        node = source
+        while node != hub:
+            hop = self._hop(self._out, node, hub)
+            self._unpack(node, hop, path)
+            node = hop
+        
+        # CH edges from the hub down to the target, collected target-first
+        chain = []
+        node = target
+        while node != hub:
+            hop = self._hop(self._in, node, hub)
+            chain.append((hop, node))
+            node = hop
+        for u, w in reversed(chain):
+            self._unpack(u, w, path)
+        return path, distance
+    
+    def nearest_nodes(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Closest graph node for each (lat, lon), vectorized over points"""
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        dlat = lats[:, None] - self.node_lat[None, :]
+        dlon = (lons[:, None] - self.node_lon[None, :]) * self._lon_scale
+        return np.argmin(dlat * dlat + dlon * dlon, axis=1)
+    
+    def nearest_node(self, lat: float, lon: float) -> int:
+        return int(self.nearest_nodes(lat, lon)[0])
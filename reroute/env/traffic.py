@@ -33,6 +33,12 @@ class TrafficModel:
         self.time_of_day_factors = {}
         self.active_zones: List[TrafficZone] = []
         
+        # Scales time-of-day congestion (0 = free flow, 1 = full pattern); zones always apply
+        self.traffic_level = 1.0
+        
+        # Bumped whenever factors can change for reasons other than the time period
+        self.version = 0
+        
         # Initialize time-of-day patterns
         self._initialize_traffic_patterns()
     
@@ -88,11 +94,17 @@ class TrafficModel:
         else:
             return 'night'
     
+    def set_traffic_level(self, level: float):
+        """Scale time-of-day congestion between free flow (0.0) and the full pattern (1.0)"""
+        self.traffic_level = max(0.0, float(level))
+        self.version += 1
+    
     def add_traffic_zone(self, center_x: int, center_y: int, radius: int, 
                         severity: float, duration: float, zone_type: str = "incident"):
         """Add a temporary traffic disruption zone"""
         zone = TrafficZone(center_x, center_y, radius, severity, duration, zone_type)
         self.active_zones.append(zone)
+        self.version += 1
     
     def remove_expired_zones(self, time_step: float):
         """Remove zones that have expired"""
@@ -101,6 +113,8 @@ class TrafficModel:
             zone.duration -= time_step
             if zone.duration > 0:
                 active_zones.append(zone)
+        if len(active_zones) != len(self.active_zones):
+            self.version += 1
         self.active_zones = active_zones
     
     def get_traffic_factor(self, x: int, y: int, sim_time_minutes: float) -> float:
@@ -119,7 +133,34 @@ class TrafficModel:
                 effect_strength = math.exp(-distance / max(1, zone.radius / 2))
                 zone_factor *= (1.0 + (zone.severity - 1.0) * effect_strength)
         
-        return base_factor * zone_factor
+        return (1.0 + self.traffic_level * (base_factor - 1.0)) * zone_factor
+    
+    def get_traffic_factors(self, xs: np.ndarray, ys: np.ndarray, sim_time_minutes: float) -> np.ndarray:
+        """Vectorized get_traffic_factor over arrays of grid coordinates"""
+        time_period = self.get_time_period(sim_time_minutes)
+        base_factor = self.time_of_day_factors[time_period][xs, ys]
+        
+        zone_factor = np.ones(len(xs))
+        for zone in self.active_zones:
+            distance = np.hypot(xs - zone.center_x, ys - zone.center_y)
+            effect_strength = np.exp(-distance / max(1, zone.radius / 2))
+            zone_factor *= np.where(distance <= zone.radius,
+                                    1.0 + (zone.severity - 1.0) * effect_strength, 1.0)
+        
+        return (1.0 + self.traffic_level * (base_factor - 1.0)) * zone_factor
+    
+    def get_period_edge_factors(self, time_period: str, u_xy: np.ndarray, v_xy: np.ndarray) -> np.ndarray:
+        """Time-of-day congestion per edge for one period, without zones"""
+        pattern = self.time_of_day_factors[time_period]
+        factor_u = 1.0 + self.traffic_level * (pattern[u_xy[:, 0], u_xy[:, 1]] - 1.0)
+        factor_v = 1.0 + self.traffic_level * (pattern[v_xy[:, 0], v_xy[:, 1]] - 1.0)
+        return (factor_u + factor_v) / 2
+    
+    def get_edge_factors(self, u_xy: np.ndarray, v_xy: np.ndarray, sim_time_minutes: float) -> np.ndarray:
+        """Traffic factor per edge (mean of its endpoints), for [num_edges, 2] coordinate arrays"""
+        traffic_u = self.get_traffic_factors(u_xy[:, 0], u_xy[:, 1], sim_time_minutes)
+        traffic_v = self.get_traffic_factors(v_xy[:, 0], v_xy[:, 1], sim_time_minutes)
+        return (traffic_u + traffic_v) / 2
     
     def get_traffic_condition(self, factor: float) -> TrafficCondition:
         """Convert traffic factor to condition enum"""
@@ -150,6 +191,8 @@ class TrafficModel:
     
     def clear_all_zones(self):
         """Clear all active traffic zones"""
+        if self.active_zones:
+            self.version += 1
         self.active_zones.clear()
     
     def get_zone_info(self) -> List[Dict]:
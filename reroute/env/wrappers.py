@@ -6,6 +6,11 @@ from city import ManhattanGrid
 from riders import RiderGenerator, RiderQueue
 from bus import BusFleet, BusMode, BusAction
 from reward import RewardCalculator
+from traffic import TrafficModel, WeatherModel
+from routing import TimeDependentRouter
+from seeding import make_rng_streams
+
+DISRUPTION_TYPES = ("closure", "traffic", "surge")
 
 class BusDispatchEnv(gym.Env):
     """Gym environment for bus dispatching RL"""
@@ -16,7 +21,11 @@ class BusDispatchEnv(gym.Env):
                  num_buses: int = 6,
                  time_step: float = 0.5,  # 30 seconds
                  max_episode_time: float = 120.0,  # 2 hours
-                 seed: int = 42):
+                 start_time: float = 0.0,  # Minute of the day episodes start at
+                 seed: int = 42,
+                 observation_mode: str = "global",
+                 num_neighbor_stops: int = 4,
+                 routing: str = "static"):
         
         super().__init__()
         
@@ -25,17 +34,46 @@ class BusDispatchEnv(gym.Env):
         self.num_buses = num_buses
         self.time_step = time_step
         self.max_episode_time = max_episode_time
+        self.start_time = start_time
         self.seed = seed
         
+        # "global": one flat vector over all buses and stops
+        # "local": one fixed-size row per bus, [num_buses, local_dim]
+        if observation_mode not in ("global", "local"):
+            raise ValueError(f"Unknown observation_mode: {observation_mode}")
+        self.observation_mode = observation_mode
+        self.num_neighbor_stops = min(num_neighbor_stops, num_stops)
+        
+        # "static": route on current edge costs (cached)
+        # "time_dependent": price each edge at the time a bus will reach it
+        if routing not in ("static", "time_dependent"):
+            raise ValueError(f"Unknown routing mode: {routing}")
+        self.routing = routing
+        
+        # Per-environment random streams (riders own their arrival/destination streams)
+        self.rng_streams = make_rng_streams(seed)
+        self.disruption_rng = self.rng_streams["disruptions"]
+        
         # Initialize city components
         self.city_grid = ManhattanGrid(grid_size[0], grid_size[1], num_stops)
         self.rider_generator = RiderGenerator(self.city_grid.stops, seed)
         self.rider_queue = RiderQueue()
-        self.bus_fleet = BusFleet(self.city_grid, num_buses)
         self.reward_calculator = RewardCalculator()
         
-        # Episode state
-        self.current_time = 0.0
+        # Background congestion; free flow unless a curriculum or scenario raises the level
+        self.traffic_model = TrafficModel(grid_size[0], grid_size[1])
+        self.traffic_model.set_traffic_level(0.0)
+        self.router = TimeDependentRouter(self.city_grid, self.traffic_model) if routing == "time_dependent" else None
+        self.bus_fleet = BusFleet(self.city_grid, num_buses, router=self.router)
+        self.weather_model = WeatherModel()
+        # (traffic version, time period, weather) the grid's edge factors were computed for
+        self._traffic_key = None
+        
+        # Expected random disruptions per simulated hour
+        self.disruption_frequency = 0.0
+        
+        # Episode state (current_time is the minute of the day, so time-of-day patterns apply)
+        self.current_time = start_time
         self.episode_step = 0
         
         # Action space: one action per bus
@@ -45,14 +83,21 @@ class BusDispatchEnv(gym.Env):
         # Observation space: bus states + stop queues
         bus_features = 5  # x, y, load, is_moving, hold_time
         stop_features = 1  # queue_length
-        obs_size = num_buses * bus_features + num_stops * stop_features
         
-        self.observation_space = spaces.Box(
-            low=0.0, high=1.0, shape=(obs_size,), dtype=np.float32
-        )
+        if observation_mode == "local":
+            # Own features + (dx, dy, queue_length) per nearby stop + headway
+            local_dim = bus_features + 3 * self.num_neighbor_stops + 1
+            self.observation_space = spaces.Box(
+                low=-1.0, high=1.0, shape=(num_buses, local_dim), dtype=np.float32
+            )
+        else:
+            obs_size = num_buses * bus_features + num_stops * stop_features
+            self.observation_space = spaces.Box(
+                low=0.0, high=1.0, shape=(obs_size,), dtype=np.float32
+            )
         
         # Baseline comparison
-        self.baseline_fleet = BusFleet(self.city_grid, num_buses)
+        self.baseline_fleet = BusFleet(self.city_grid, num_buses, router=self.router)
         self.baseline_queue = RiderQueue()
         self.baseline_stats_history = []
         
@@ -60,28 +105,32 @@ class BusDispatchEnv(gym.Env):
         """Reset environment to initial state"""
         if seed is not None:
             self.seed = seed
-            np.random.seed(seed)
-            self.rider_generator = RiderGenerator(self.city_grid.stops, seed)
+            self.rng_streams = make_rng_streams(seed)
+            self.disruption_rng = self.rng_streams["disruptions"]
+            self.rider_generator.reseed(seed)
         
         # Reset time and episode
-        self.current_time = 0.0
+        self.current_time = self.start_time
         self.episode_step = 0
         
-        # Reset components
+        # Reset components in place (fleets and grid are reused across episodes)
         self.rider_queue.reset()
-        self.bus_fleet = BusFleet(self.city_grid, self.num_buses)
+        self.bus_fleet.reset()
         self.bus_fleet.set_mode(BusMode.RL)
         self.reward_calculator.reset()
         
         # Reset baseline
         self.baseline_queue.reset()
-        self.baseline_fleet = BusFleet(self.city_grid, self.num_buses)
+        self.baseline_fleet.reset()
         self.baseline_fleet.set_mode(BusMode.STATIC)
         self.baseline_stats_history.clear()
         
         # Clear any disruptions
         self.rider_generator.clear_surges()
+        self.traffic_model.clear_all_zones()
+        self.weather_model.set_condition("clear")
         self._reset_all_edges()
+        self._update_traffic()
         
         observation = self._get_observation()
         info = {}
@@ -90,6 +139,15 @@ class BusDispatchEnv(gym.Env):
     def step(self, action: np.ndarray) -> Tuple[np.ndarray, float, bool, bool, Dict]:
         """Execute one step in the environment"""
         
+        # Random disruptions (curriculum); no draws at all while disabled
+        if self.disruption_frequency > 0:
+            if self.disruption_rng.random() < self.disruption_frequency * self.time_step / 60.0:
+                self.apply_disruption(str(self.disruption_rng.choice(DISRUPTION_TYPES)), {})
+        
+        # Expire traffic zones and refresh edge costs if congestion changed
+        self.traffic_model.update(self.time_step)
+        self._update_traffic()
+        
         # Apply RL actions
         self.bus_fleet.apply_rl_actions(action.tolist(), self.rider_queue, self.current_time)
         
@@ -99,8 +157,8 @@ class BusDispatchEnv(gym.Env):
         self.baseline_queue.add_riders([r for r in new_riders])  # Copy for baseline
         
         # Update bus movements
-        self.bus_fleet.update_movement(self.time_step)
-        self.baseline_fleet.update_movement(self.time_step)
+        self.bus_fleet.update_movement(self.time_step, self.current_time)
+        self.baseline_fleet.update_movement(self.time_step, self.current_time)
         
         # Process stop arrivals (pickup/dropoff)
         self.bus_fleet.process_stop_arrivals(self.rider_queue, self.current_time)
@@ -120,7 +178,7 @@ class BusDispatchEnv(gym.Env):
         self.episode_step += 1
         
         # Check if episode is done
-        terminated = self.current_time >= self.max_episode_time
+        terminated = self.current_time - self.start_time >= self.max_episode_time
         truncated = False  # We don't use truncation in this environment
         
         # Collect info
@@ -130,8 +188,14 @@ class BusDispatchEnv(gym.Env):
     
     def _get_observation(self) -> np.ndarray:
         """Get current observation"""
+        if self.observation_mode == "local":
+            return self.bus_fleet.get_local_observations(self.rider_queue, self.num_neighbor_stops)
         return self.bus_fleet.get_state_vector(self.rider_queue)
     
+    def action_masks(self) -> np.ndarray:
+        """Flat bool mask over the MultiDiscrete action space (sb3-contrib MaskablePPO convention)"""
+        return self.bus_fleet.get_action_masks(self.rider_queue).reshape(-1)
+    
     def _get_info(self) -> Dict[str, Any]:
         """Get episode information"""
         # RL stats
@@ -182,7 +246,7 @@ class BusDispatchEnv(gym.Env):
             if "stop_id" in params:
                 center_stop = params["stop_id"]
             else:
-                center_stop = np.random.choice(stop_ids)
+                center_stop = self.disruption_rng.choice(stop_ids)
             
             # Close edges around the stop
             neighbors = self.city_grid.get_neighbors(center_stop)
@@ -195,7 +259,7 @@ class BusDispatchEnv(gym.Env):
             if "stop_id" in params:
                 center_stop = params["stop_id"]
             else:
-                center_stop = np.random.choice(stop_ids)
+                center_stop = self.disruption_rng.choice(stop_ids)
             
             slowdown_factor = params.get("factor", 2.0)
             
@@ -210,15 +274,85 @@ class BusDispatchEnv(gym.Env):
             if "stop_id" in params:
                 surge_stop = params["stop_id"]
             else:
-                surge_stop = np.random.choice(stop_ids)
+                surge_stop = self.disruption_rng.choice(stop_ids)
             
             surge_multiplier = params.get("multiplier", 3.0)
             self.rider_generator.add_surge(surge_stop, surge_multiplier)
+        
+        elif disruption_type == "zone":
+            # Temporary congestion zone (accident, event) in the traffic model
+            if "center_x" in params and "center_y" in params:
+                x, y = params["center_x"], params["center_y"]
+            else:
+                stop_ids = list(self.city_grid.stops.keys())
+                if "stop_id" in params:
+                    center_stop = params["stop_id"]
+                else:
+                    center_stop = self.disruption_rng.choice(stop_ids)
+                x, y = self.city_grid.id_to_node[center_stop]
+            
+            self.traffic_model.add_traffic_zone(
+                x, y, params.get("radius", 3), params.get("severity", 2.0),
+                params.get("duration", 30.0), params.get("zone_type", "incident")
+            )
+        
+        elif disruption_type == "weather":
+            self.set_weather(params.get("condition", "rain"))
     
     def _reset_all_edges(self):
         """Reset all edges to normal conditions"""
-        for (u, v), edge in self.city_grid.edges.items():
-            self.city_grid.reset_edge(u, v)
+        self.city_grid.reset_edges()
+    
+    def _update_traffic(self):
+        """Recompute all edge factors in one batch when traffic or weather changed
+        
+        Time-of-day congestion, active zones and weather combine into one array;
+        the grid only touches (and only re-routes around) edges whose factor moved.
+        """
+        key = (
+            self.traffic_model.version,
+            self.traffic_model.get_time_period(self.current_time),
+            self.weather_model.current_condition
+        )
+        if key == self._traffic_key:
+            return
+        self._traffic_key = key
+        
+        factors = self.traffic_model.get_edge_factors(
+            self.city_grid.edge_u_xy, self.city_grid.edge_v_xy, self.current_time
+        )
+        factors *= self.weather_model.get_traffic_impact()
+        self.city_grid.set_traffic_factors(factors)
+        if self.router is not None:
+            self.router.live_period = key[1]
+    
+    def set_weather(self, condition: str):
+        """Set the weather; its traffic impact applies from the next step"""
+        self.weather_model.set_condition(condition)
+    
+    def set_start_time(self, start_time: float):
+        """Set the minute of the day episodes start at, from the next reset"""
+        self.start_time = float(start_time)
+    
+    def set_disruption_frequency(self, frequency: float):
+        """Set the expected number of random disruptions per simulated hour"""
+        self.disruption_frequency = max(0.0, float(frequency))
+    
+    def set_curriculum_params(self, params: Dict[str, Any]):
+        """Apply curriculum phase parameters
+        
+        Demand, disruptions and traffic level change immediately (traffic reaches
+        the grid at the next step); the episode start time applies from the next
+        reset. Single entry point so VecEnv.env_method reaches every worker.
+        """
+        if 'traffic_level' in params:
+            self.traffic_model.set_traffic_level(params['traffic_level'])
+        if 'demand_multiplier' in params:
+            self.rider_generator.set_demand_multiplier(params['demand_multiplier'])
+        if 'disruption_frequency' in params:
+            self.set_disruption_frequency(params['disruption_frequency'])
+        if 'start_time' in params:
+            self.set_start_time(params['start_time'])
     
     def get_system_state(self) -> Dict[str, Any]:
         """Get complete system state for visualization"""
@@ -5,14 +5,216 @@ Evaluation utilities for trained RL policies
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Tuple, Any, Iterator, Optional
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import NormalDist
+import inspect
 import json
+import os
 import time
+import zipfile
 import sys
-sys.path.append('../env')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'env'))
 from wrappers import BusDispatchEnv
 from bus import BusMode
 
+# Disruption parameters used by stress tests and parallel scenario evaluation
+STRESS_SCENARIOS = {
+    'closure': {'stop_id': 210},
+    'traffic': {'factor': 2.0},
+    'surge': {'multiplier': 3.0}
+}
+
+@dataclass(frozen=True)
+class EvalJob:
+    """One seeded evaluation episode of a scenario
+    
+    Every episode also runs the static baseline fleet, so an "rl" job yields
+    results for both fleets; a "baseline" job (no model) leaves the RL fleet idle.
+    """
+    index: int
+    seed: int
+    scenario: str  # "normal" or a key of STRESS_SCENARIOS
+    policy: str    # "rl" or "baseline"
+
+# Per-process state populated by _init_eval_worker (policy and env are loaded once per worker)
+_WORKER_STATE: Dict[str, Any] = {}
+
+def _is_maskable_checkpoint(model_path: str) -> bool:
+    """True for SB3 checkpoints saved by sb3-contrib's MaskablePPO"""
+    zip_path = model_path if model_path.endswith('.zip') else f"{model_path}.zip"
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            data = json.loads(archive.read('data'))
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return False
+    return data.get('policy_class', {}).get('__module__', '').startswith('sb3_contrib')
+
+def _load_policy(model_path: str):
+    """Load an ONNX or SB3 policy exposing predict(obs, deterministic=True)"""
+    if model_path.endswith('.onnx'):
+        from export_onnx import ONNXPolicyInference
+        return ONNXPolicyInference(model_path)
+    
+    if _is_maskable_checkpoint(model_path):
+        from sb3_contrib import MaskablePPO
+        return MaskablePPO.load(model_path, device='cpu')
+    
+    from stable_baselines3 import PPO
+    return PPO.load(model_path, device='cpu')
+
+def _accepts_action_masks(policy) -> bool:
+    """True if policy.predict takes action_masks (ONNXPolicyInference, MaskablePPO)"""
+    return policy is not None and 'action_masks' in inspect.signature(policy.predict).parameters
+
+def _init_eval_worker(model_path: Optional[str], env_kwargs: Dict[str, Any]):
+    """Process pool initializer: build one env and load the policy once"""
+    try:
+        import torch
+        torch.set_num_threads(1)  # One core per worker, avoid oversubscription
+    except ImportError:
+        pass
+    
+    _WORKER_STATE['env'] = BusDispatchEnv(**env_kwargs)
+    _WORKER_STATE['policy'] = _load_policy(model_path) if model_path else None
+
+def run_eval_job(env: BusDispatchEnv, policy, job: EvalJob, max_steps: int = 1000) -> List[Dict[str, Any]]:
+    """Run one seeded episode; returns one result per fleet, the job's own first
+    
+    Results depend only on the job, not on the worker. The reward belongs to the
+    RL fleet, so baseline results carry episode_reward None.
+    """
+    obs, _ = env.reset(seed=job.seed)
+    if job.scenario in STRESS_SCENARIOS:
+        env.apply_disruption(job.scenario, STRESS_SCENARIOS[job.scenario])
+    
+    fleets = ['rl', 'baseline'] if job.policy == 'rl' else ['baseline']
+    idle_action = np.zeros(env.num_buses, dtype=int)
+    use_masks = _accepts_action_masks(policy)
+    
+    episode_reward = 0.0
+    episode_length = 0
+    wait_times = {fleet: [] for fleet in fleets}
+    load_std_devs = {fleet: [] for fleet in fleets}
+    info = {}
+    done = False
+    
+    while not done and episode_length < max_steps:
+        if job.policy == 'rl':
+            if use_masks:
+                action = policy.predict(obs, deterministic=True, action_masks=env.action_masks())
+            else:
+                action = policy.predict(obs, deterministic=True)
+            if isinstance(action, tuple):  # SB3 returns (action, state)
+                action = action[0]
+            action = np.asarray(action)
+        else:
+            action = idle_action
+        
+        obs, reward, terminated, truncated, info = env.step(action)
+        done = terminated or truncated
+        episode_reward += reward
+        episode_length += 1
+        
+        for fleet in fleets:
+            wait_times[fleet].append(info[f'{fleet}_stats']['avg_wait'])
+            load_std_devs[fleet].append(info[f'{fleet}_stats']['load_std'])
+    
+    results = []
+    for fleet in fleets:
+        result = asdict(job)
+        result.update({
+            'policy': fleet,
+            'episode_reward': float(episode_reward) if fleet == 'rl' else None,
+            'episode_length': episode_length,
+            'avg_wait_time': float(np.mean(wait_times[fleet])) if wait_times[fleet] else 0.0,
+            'max_wait_time': float(np.max(wait_times[fleet])) if wait_times[fleet] else 0.0,
+            'avg_load_std': float(np.mean(load_std_devs[fleet])) if load_std_devs[fleet] else 0.0,
+            'total_replans': float(info.get('rl_stats', {}).get('total_replans', 0)) if fleet == 'rl' else 0.0
+        })
+        results.append(result)
+    return results
+
+def _run_eval_job_in_worker(job: EvalJob) -> List[Dict[str, Any]]:
+    return run_eval_job(_WORKER_STATE['env'], _WORKER_STATE['policy'], job)
+
+def make_eval_jobs(seeds: List[int], scenarios: List[str], policies: List[str]) -> List[EvalJob]:
+    """One job per (scenario, seed) in a fixed order
+    
+    Baseline results come out of the RL episodes, so a separate baseline job only
+    runs when RL is not being evaluated.
+    """
+    policy = 'rl' if 'rl' in policies else 'baseline'
+    jobs = []
+    for scenario in scenarios:
+        for seed in seeds:
+            jobs.append(EvalJob(len(jobs), seed, scenario, policy))
+    return jobs
+
+def iter_parallel_evaluation(jobs: List[EvalJob], model_path: Optional[str], env_kwargs: Dict[str, Any],
+                             n_workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Run jobs across a process pool, yielding per-fleet episode results as they finish"""
+    n_workers = n_workers or os.cpu_count() or 1
+    
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_eval_worker,
+                             initargs=(model_path, env_kwargs)) as pool:
+        futures = [pool.submit(_run_eval_job_in_worker, job) for job in jobs]
+        for future in as_completed(futures):
+            yield from future.result()
+
+def confidence_interval(values: List[float], confidence: float = 0.95) -> Tuple[float, float]:
+    """Normal-approximation confidence interval for the mean"""
+    n = len(values)
+    if n == 0:
+        return (0.0, 0.0)
+    mean = float(np.mean(values))
+    if n == 1:
+        return (mean, mean)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    half_width = z * float(np.std(values, ddof=1)) / np.sqrt(n)
+    return (mean - half_width, mean + half_width)
+
+def aggregate_eval_results(results: List[Dict[str, Any]], confidence: float = 0.95) -> Dict[str, Any]:
+    """Aggregate per-episode results by scenario and policy, with confidence intervals"""
+    # Sort by job index so aggregates are identical regardless of completion order (stable within a job)
+    results = sorted(results, key=lambda r: r['index'])
+    
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for result in results:
+        groups.setdefault((result['scenario'], result['policy']), []).append(result)
+    
+    summary: Dict[str, Dict[str, Any]] = {}
+    for (scenario, policy), episodes in groups.items():
+        stats = {'n_episodes': len(episodes)}
+        for metric in ['episode_reward', 'avg_wait_time', 'avg_load_std', 'total_replans']:
+            values = [ep[metric] for ep in episodes if ep[metric] is not None]
+            if not values:
+                # Not defined for this fleet (baseline episode_reward)
+                stats[f'mean_{metric}'] = stats[f'std_{metric}'] = stats[f'ci_{metric}'] = None
+                continue
+            ci_low, ci_high = confidence_interval(values, confidence)
+            stats[f'mean_{metric}'] = float(np.mean(values))
+            stats[f'std_{metric}'] = float(np.std(values))
+            stats[f'ci_{metric}'] = [ci_low, ci_high]
+        summary.setdefault(scenario, {})[policy] = stats
+    
+    # Wait time improvement of RL over baseline, next to (not among) each scenario's policies
+    for scenario, policies in summary.items():
+        if 'rl' in policies and 'baseline' in policies:
+            baseline_wait = policies['baseline']['mean_avg_wait_time']
+            if baseline_wait > 0:
+                policies['_comparison'] = {
+                    'wait_time_improvement': (baseline_wait - policies['rl']['mean_avg_wait_time']) / baseline_wait
+                }
+    
+    return {
+        'confidence': confidence,
+        'n_episodes': len(results),
+        'scenarios': summary,
+        'episode_results': results
+    }
+
 class PolicyEvaluator:
     """Comprehensive policy evaluation with multiple metrics"""
     
@@ -21,6 +223,51 @@ class PolicyEvaluator:
         self.model = model
         self.baseline_env = baseline_env or env
         self.evaluation_results = {}
+    
+    def _env_kwargs(self) -> Dict[str, Any]:
+        """Constructor arguments needed to rebuild self.env in a worker process"""
+        return {
+            'grid_size': self.env.grid_size,
+            'num_stops': self.env.num_stops,
+            'num_buses': self.env.num_buses,
+            'time_step': self.env.time_step,
+            'max_episode_time': self.env.max_episode_time,
+            'start_time': self.env.start_time,
+            'seed': self.env.seed,
+            'observation_mode': self.env.observation_mode,
+            'num_neighbor_stops': self.env.num_neighbor_stops,
+            'routing': self.env.routing
+        }
+    
+    def evaluate_parallel(self, model_path: str, seeds: List[int], scenarios: List[str] = None,
+                          policies: List[str] = None, n_workers: Optional[int] = None,
+                          confidence: float = 0.95, verbose: bool = True) -> Dict[str, Any]:
+        """Evaluate (seed, scenario, policy) jobs across a process pool"""
+        if scenarios is None:
+            scenarios = ['normal'] + list(STRESS_SCENARIOS.keys())
+        if policies is None:
+            policies = ['rl', 'baseline']
+        
+        jobs = make_eval_jobs(seeds, scenarios, policies)
+        print(f"Evaluating {len(jobs)} episodes with {n_workers or os.cpu_count()} workers...")
+        
+        start_time = time.time()
+        results = []
+        episodes = 0
+        for result in iter_parallel_evaluation(jobs, model_path, self._env_kwargs(), n_workers):
+            if result['policy'] in policies:
+                results.append(result)
+            # Count each episode once, on the fleet its job was made for
+            if result['policy'] == jobs[result['index']].policy:
+                episodes += 1
+                if verbose and episodes % 100 == 0:
+                    elapsed = time.time() - start_time
+                    print(f"  {episodes}/{len(jobs)} episodes ({episodes / elapsed:.1f} episodes/s)")
+        
+        aggregate = aggregate_eval_results(results, confidence)
+        aggregate['wall_time'] = time.time() - start_time
+        self.evaluation_results['parallel'] = aggregate
+        return aggregate
         
     def evaluate_episode(self, render: bool = False, max_steps: int = 1000) -> Dict[str, Any]:
         """Evaluate a single episode"""
@@ -208,12 +455,8 @@ class PolicyEvaluator:
             obs = self.env.reset()
             
             # Apply disruption
-            if disruption == 'closure':
-                self.env.apply_disruption('closure', {'stop_id': 210})
-            elif disruption == 'traffic':
-                self.env.apply_disruption('traffic', {'factor': 2.0})
-            elif disruption == 'surge':
-                self.env.apply_disruption('surge', {'multiplier': 3.0})
+            if disruption in STRESS_SCENARIOS:
+                self.env.apply_disruption(disruption, STRESS_SCENARIOS[disruption])
             
             # Run episode with disruption
             episode_stats = self.evaluate_episode(render=False)
@@ -378,7 +621,34 @@ if __name__ == "__main__":
     parser.add_argument("--model", type=str, required=True, help="Path to trained model")
     parser.add_argument("--output", type=str, default="./eval_results", help="Output directory")
     parser.add_argument("--episodes", type=int, default=10, help="Number of evaluation episodes")
+    parser.add_argument("--parallel-seeds", type=int, default=0,
+                        help="Run seeded parallel evaluation over this many seeds and all disruption scenarios")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for parallel evaluation")
     
     args = parser.parse_args()
     
-    run_comprehensive_evaluation(args.model, args.output)
+    if args.parallel_seeds > 0:
+        os.makedirs(args.output, exist_ok=True)
+        env = BusDispatchEnv(grid_size=(20, 20), num_stops=32, num_buses=6,
+                             time_step=0.5, max_episode_time=120.0, seed=42)
+        evaluator = PolicyEvaluator(env, None)
+        results = evaluator.evaluate_parallel(args.model, seeds=list(range(args.parallel_seeds)),
+                                              n_workers=args.workers)
+        
+        for scenario, policies in results['scenarios'].items():
+            for policy in ['rl', 'baseline']:
+                if policy in policies:
+                    stats = policies[policy]
+                    low, high = stats['ci_avg_wait_time']
+                    print(f"{scenario:>8} {policy:>8}: wait {stats['mean_avg_wait_time']:.2f} "
+                          f"[{low:.2f}, {high:.2f}] over {stats['n_episodes']} episodes")
+            if '_comparison' in policies:
+                print(f"{scenario:>8} improvement: {policies['_comparison']['wait_time_improvement']:.1%}")
+        print(f"Wall time: {results['wall_time']:.1f}s")
+        
+        results_path = os.path.join(args.output, "parallel_results.json")
+        with open(results_path, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"Detailed results saved to {results_path}")
+    else:
+        run_comprehensive_evaluation(args.model, args.output)
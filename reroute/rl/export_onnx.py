@@ -4,18 +4,37 @@ import numpy as np
 from stable_baselines3 import PPO
 import onnx
 import onnxruntime as ort
+import os
 import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quant_pre_process, quantize_dynamic, quantize_static
+)
 sys.path.append('../env')
 from wrappers import BusDispatchEnv
+from bus import BusAction
+from policies import DecentralizedBusPolicy, export_per_bus_policy_to_onnx
 
-def export_ppo_to_onnx(model_path: str, onnx_path: str, opset_version: int = 11):
-    """Export trained PPO model to ONNX format for device inference"""
+def export_ppo_to_onnx(model_path: str, onnx_path: str, opset_version: int = 11,
+                       action_masks: bool = False):
+    """Export trained PPO model to ONNX format for device inference
+    
+    With action_masks=True the graph takes a second bool input, a flat
+    [batch, num_buses * num_actions] mask (BusDispatchEnv.action_masks()),
+    and masked actions get a large negative logit.
+    """
     
     print(f"Loading PPO model from {model_path}")
     
-    # Load the trained model
+    # Load the trained model (MaskablePPO checkpoints share the same policy layout)
     model = PPO.load(model_path)
     
+    # Per-bus checkpoints (train.py --observation-mode local) accept any fleet size;
+    # their graph has no mask input, ONNXPolicyInference masks the logits instead
+    if isinstance(model.policy, DecentralizedBusPolicy):
+        return export_per_bus_policy_to_onnx(model.policy, onnx_path)
+    
     # Create dummy environment to get observation space
     env = BusDispatchEnv(
         grid_size=(20, 20),
@@ -28,32 +47,56 @@ def export_ppo_to_onnx(model_path: str, onnx_path: str, opset_version: int = 11)
     obs_space_shape = env.observation_space.shape
     print(f"Observation space shape: {obs_space_shape}")
     
-    # Extract the policy network
+    # MultiDiscrete([num_actions] * num_buses)
+    num_buses = len(model.action_space.nvec)
+    num_actions = int(model.action_space.nvec[0])
+    
+    # Extract the policy network (features extractor is identity-like for MlpPolicy,
+    # BusDispatchFeaturesExtractor for BusDispatchPolicy)
+    features_extractor = model.policy.pi_features_extractor
     policy_net = model.policy.mlp_extractor
     action_net = model.policy.action_net
     
     # Create a wrapper that combines feature extraction and action prediction
     class ONNXPolicyWrapper(torch.nn.Module):
-        def __init__(self, mlp_extractor, action_net):
+        def __init__(self, features_extractor, mlp_extractor, action_net, num_buses, num_actions):
             super().__init__()
+            self.features_extractor = features_extractor
             self.mlp_extractor = mlp_extractor
             self.action_net = action_net
+            self.num_buses = num_buses
+            self.num_actions = num_actions
             
-        def forward(self, observations):
+        def forward(self, observations, action_masks=None):
             # Extract features
-            features = self.mlp_extractor.forward_actor(observations)
-            # Get action logits
-            action_logits = self.action_net(features)
-            # Return action probabilities (softmax) and raw logits
+            features = self.features_extractor(observations)
+            features = self.mlp_extractor.forward_actor(features)
+            # Get action logits, one categorical distribution per bus
+            action_logits = self.action_net(features).view(-1, self.num_buses, self.num_actions)
+            if action_masks is not None:
+                # Same fill value as sb3-contrib's MaskableCategorical
+                action_masks = action_masks.view(-1, self.num_buses, self.num_actions)
+                action_logits = torch.where(action_masks, action_logits, torch.full_like(action_logits, -1e8))
+            # Return action probabilities (softmax per bus) and raw logits
             action_probs = torch.softmax(action_logits, dim=-1)
             return action_probs, action_logits
     
     # Create the wrapper
-    onnx_model = ONNXPolicyWrapper(policy_net, action_net)
+    onnx_model = ONNXPolicyWrapper(features_extractor, policy_net, action_net, num_buses, num_actions)
     onnx_model.eval()
     
     # Create dummy input
     dummy_input = torch.randn(1, *obs_space_shape, dtype=torch.float32)
+    input_names = ['observations']
+    dynamic_axes = {
+        'observations': {0: 'batch_size'},
+        'action_probs': {0: 'batch_size'},
+        'action_logits': {0: 'batch_size'}
+    }
+    if action_masks:
+        dummy_input = (dummy_input, torch.ones(1, num_buses * num_actions, dtype=torch.bool))
+        input_names.append('action_masks')
+        dynamic_axes['action_masks'] = {0: 'batch_size'}
     
     print("Exporting to ONNX...")
     
@@ -65,15 +108,19 @@ def export_ppo_to_onnx(model_path: str, onnx_path: str, opset_version: int = 11)
         export_params=True,
         opset_version=opset_version,
         do_constant_folding=True,
-        input_names=['observations'],
+        input_names=input_names,
         output_names=['action_probs', 'action_logits'],
-        dynamic_axes={
-            'observations': {0: 'batch_size'},
-            'action_probs': {0: 'batch_size'},
-            'action_logits': {0: 'batch_size'}
-        }
+        dynamic_axes=dynamic_axes
     )
     
+    # Record the action layout so inference does not have to guess it
+    exported = onnx.load(onnx_path)
+    onnx.helper.set_model_props(exported, {
+        'num_buses': str(num_buses),
+        'num_actions': str(num_actions)
+    })
+    onnx.save(exported, onnx_path)
+    
     print(f"Model exported to {onnx_path}")
     
     # Verify the ONNX model
@@ -81,8 +128,11 @@ def export_ppo_to_onnx(model_path: str, onnx_path: str, opset_version: int = 11)
     
     return onnx_path
 
-def verify_onnx_model(onnx_path: str, test_input: torch.Tensor, original_model):
-    """Verify ONNX model produces same outputs as original"""
+def verify_onnx_model(onnx_path: str, test_input, original_model):
+    """Verify ONNX model produces same outputs as original
+    
+    test_input is a tensor, or a tuple of tensors for models with several inputs.
+    """
     
     print("Verifying ONNX model...")
     
@@ -95,17 +145,20 @@ def verify_onnx_model(onnx_path: str, test_input: torch.Tensor, original_model):
     ort_session = ort.InferenceSession(onnx_path)
     
     # Test inference
-    test_input_np = test_input.detach().numpy()
+    test_inputs = test_input if isinstance(test_input, tuple) else (test_input,)
     
     # Original model output
     original_model.eval()
     with torch.no_grad():
-        orig_probs, orig_logits = original_model(test_input)
+        orig_probs, orig_logits = original_model(*test_inputs)
         orig_probs_np = orig_probs.numpy()
         orig_logits_np = orig_logits.numpy()
     
     # ONNX model output
-    ort_inputs = {ort_session.get_inputs()[0].name: test_input_np}
+    ort_inputs = {
+        inp.name: tensor.detach().numpy()
+        for inp, tensor in zip(ort_session.get_inputs(), test_inputs)
+    }
     onnx_probs, onnx_logits = ort_session.run(None, ort_inputs)
     
     # Compare outputs
@@ -123,48 +176,150 @@ def verify_onnx_model(onnx_path: str, test_input: torch.Tensor, original_model):
     
     return prob_diff < 1e-5 and logit_diff < 1e-5
 
+# ONNX Runtime session profiles
+#   latency:    one thread, sequential execution - lowest per-call jitter for the live dispatch loop
+#   throughput: intra/inter-op parallelism across all cores - large batches from many envs
+SESSION_PROFILES = {
+    'latency': {
+        'intra_op_num_threads': 1,
+        'inter_op_num_threads': 1,
+        'execution_mode': ort.ExecutionMode.ORT_SEQUENTIAL
+    },
+    'throughput': {
+        'intra_op_num_threads': 0,  # 0 = let ORT use all physical cores
+        'inter_op_num_threads': 0,
+        'execution_mode': ort.ExecutionMode.ORT_PARALLEL
+    }
+}
+
+def make_session_options(profile: str = 'latency') -> ort.SessionOptions:
+    """Build ORT session options for a named profile"""
+    if profile not in SESSION_PROFILES:
+        raise ValueError(f"Unknown session profile: {profile}. Available: {list(SESSION_PROFILES.keys())}")
+    
+    settings = SESSION_PROFILES[profile]
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = settings['intra_op_num_threads']
+    options.inter_op_num_threads = settings['inter_op_num_threads']
+    options.execution_mode = settings['execution_mode']
+    return options
+
 class ONNXPolicyInference:
-    """ONNX-based policy inference for deployment"""
-    
-    def __init__(self, onnx_path: str):
-        self.session = ort.InferenceSession(onnx_path)
+    """ONNX-based policy inference for deployment
+    
+    Inputs and outputs are bound once per batch size to preallocated float32
+    buffers (ORT IOBinding), so an instance must not be shared between threads.
+    Per-bus models (see policies.export_per_bus_policy_to_onnx) take
+    [batch, num_buses, local_dim] observations with any number of buses.
+    Action masks are fed to the graph when it was exported with them and
+    applied to the logits here otherwise.
+    """
+    
+    def __init__(self, onnx_path: str, seed: Optional[int] = None, profile: str = 'latency'):
+        self.profile = profile
+        self.session = ort.InferenceSession(onnx_path, sess_options=make_session_options(profile),
+                                            providers=['CPUExecutionProvider'])
         self.input_name = self.session.get_inputs()[0].name
+        self.mask_name = next((inp.name for inp in self.session.get_inputs()[1:] if inp.name == 'action_masks'), None)
         self.output_names = [output.name for output in self.session.get_outputs()]
+        self.num_buses, self.num_actions = self._read_action_shape()
+        
+        # Static (non-batch) dims of the observation input and logits output
+        self.obs_rank = len(self.session.get_inputs()[0].shape)
+        self.per_bus = self.obs_rank == 3
+        self.obs_dim = self.session.get_inputs()[0].shape[-1]
+        self.logits_dims = list(self.session.get_outputs()[-1].shape[1:])
+        
+        # observation shape -> (io_binding, input buffer, mask buffer or None, logits buffer)
+        self._bindings: Dict[Tuple[int, ...], Tuple[ort.IOBinding, np.ndarray, Optional[np.ndarray], np.ndarray]] = {}
         
-        print(f"Loaded ONNX model: {onnx_path}")
+        # Sampling stream for stochastic inference
+        self.rng = np.random.default_rng(seed)
+        
+        print(f"Loaded ONNX model: {onnx_path} (profile: {profile})")
         print(f"Input name: {self.input_name}")
         print(f"Output names: {self.output_names}")
+        print(f"Action layout: {self.num_buses or 'any number of'} buses x {self.num_actions} actions")
     
-    def predict(self, observation: np.ndarray, deterministic: bool = True):
-        """Predict action given observation"""
+    def _read_action_shape(self) -> Tuple[Optional[int], int]:
+        """Get (num_buses, num_actions) from model metadata or output shape
+        
+        num_buses is None for per-bus models, which accept any fleet size.
+        """
+        props = self.session.get_modelmeta().custom_metadata_map
+        if props.get('num_buses') == 'dynamic' and 'num_actions' in props:
+            return None, int(props['num_actions'])
+        if 'num_buses' in props and 'num_actions' in props:
+            return int(props['num_buses']), int(props['num_actions'])
+        
+        logits_shape = self.session.get_outputs()[-1].shape
+        if len(logits_shape) == 3 and all(isinstance(d, int) for d in logits_shape[1:]):
+            return logits_shape[1], logits_shape[2]
+        
+        # Legacy exports flatten logits to [batch, num_buses * num_actions]
+        num_actions = len(BusAction)
+        return logits_shape[-1] // num_actions, num_actions
+    
+    def _get_binding(self, obs_shape: Tuple[int, ...]) -> Tuple[ort.IOBinding, np.ndarray, Optional[np.ndarray], np.ndarray]:
+        """Get (creating on first use) the IOBinding and buffers for an observation shape"""
+        if obs_shape not in self._bindings:
+            input_buffer = np.zeros(obs_shape, dtype=np.float32)
+            if self.per_bus:
+                logits_buffer = np.zeros((obs_shape[0], obs_shape[1], self.num_actions), dtype=np.float32)
+            else:
+                logits_buffer = np.zeros([obs_shape[0]] + self.logits_dims, dtype=np.float32)
+            
+            # OrtValues wrap the numpy buffers directly, so later calls only copy observations in
+            binding = self.session.io_binding()
+            binding.bind_ortvalue_input(self.input_name, ort.OrtValue.ortvalue_from_numpy(input_buffer))
+            mask_buffer = None
+            if self.mask_name is not None:
+                mask_buffer = np.ones((obs_shape[0], self.num_buses * self.num_actions), dtype=bool)
+                binding.bind_ortvalue_input(self.mask_name, ort.OrtValue.ortvalue_from_numpy(mask_buffer))
+            # Logits are enough for both modes: softmax does not change argmax
+            binding.bind_ortvalue_output(self.output_names[-1], ort.OrtValue.ortvalue_from_numpy(logits_buffer))
+            self._bindings[obs_shape] = (binding, input_buffer, mask_buffer, logits_buffer)
+        
+        return self._bindings[obs_shape]
+    
+    def predict_batch(self, observations: np.ndarray, deterministic: bool = True,
+                      action_masks: Optional[np.ndarray] = None) -> np.ndarray:
+        """Predict actions for stacked observations in one session call
+        
+        Observations are [batch, obs_dim] (or [batch, num_buses, local_dim] for
+        per-bus models). action_masks are bools, num_buses * num_actions per row
+        (BusDispatchEnv.action_masks()). Returns an int array of shape [batch, num_buses].
+        """
+        if observations.ndim == self.obs_rank - 1:
+            observations = observations[np.newaxis]
+        batch_size = observations.shape[0]
+        
+        binding, input_buffer, mask_buffer, logits_buffer = self._get_binding(observations.shape)
+        np.copyto(input_buffer, observations, casting='same_kind')
+        if mask_buffer is not None:
+            if action_masks is None:
+                mask_buffer.fill(True)
+            else:
+                np.copyto(mask_buffer, np.reshape(action_masks, mask_buffer.shape))
+        self.session.run_with_iobinding(binding)
+        action_logits = logits_buffer.reshape(batch_size, -1, self.num_actions)
+        
+        if action_masks is not None and mask_buffer is None:
+            action_masks = np.reshape(action_masks, action_logits.shape).astype(bool, copy=False)
+            action_logits = np.where(action_masks, action_logits, -1e8)
         
-        # Ensure correct shape (add batch dimension if needed)
-        if observation.ndim == 1:
-            observation = observation.reshape(1, -1)
-        
-        # Run inference
-        ort_inputs = {self.input_name: observation.astype(np.float32)}
-        action_probs, action_logits = self.session.run(self.output_names, ort_inputs)
-        
-        if deterministic:
-            # Take argmax for each bus
-            actions = np.argmax(action_probs, axis=-1)
-        else:
-            # Sample from distribution
-            actions = []
-            for i in range(action_probs.shape[0]):
-                # action_probs has shape [batch_size, num_buses * num_actions]
-                # Reshape to [batch_size, num_buses, num_actions]
-                # Assuming 6 buses and 4 actions each
-                probs_reshaped = action_probs[i].reshape(6, 4)
-                bus_actions = []
-                for bus_probs in probs_reshaped:
-                    action = np.random.choice(4, p=bus_probs)
-                    bus_actions.append(action)
-                actions.append(bus_actions)
-            actions = np.array(actions)
-        
-        return actions.squeeze() if actions.shape[0] == 1 else actions
+        if not deterministic:
+            # Gumbel-max trick: argmax(logits + Gumbel noise) samples the categorical
+            action_logits = action_logits + self.rng.gumbel(size=action_logits.shape)
+        
+        return np.argmax(action_logits, axis=-1)
+    
+    def predict(self, observation: np.ndarray, deterministic: bool = True,
+                action_masks: Optional[np.ndarray] = None):
+        """Predict action given observation"""
+        actions = self.predict_batch(observation, deterministic, action_masks)
+        return actions.squeeze(0) if actions.shape[0] == 1 else actions
     
     def get_model_info(self):
         """Get model information"""
@@ -189,38 +344,195 @@ class ONNXPolicyInference:
             'outputs': outputs_info
         }
 
-def benchmark_inference(onnx_path: str, num_iterations: int = 1000):
-    """Benchmark ONNX inference performance"""
+def benchmark_inference(onnx_path: str, num_iterations: int = 1000, batch_sizes=(1,),
+                        profiles=('latency', 'throughput')):
+    """Benchmark ONNX inference latency per session profile and batch size"""
     
     import time
     
     print(f"Benchmarking ONNX inference with {num_iterations} iterations...")
     
-    # Create inference engine
-    policy = ONNXPolicyInference(onnx_path)
-    
     # Create dummy observation
     env = BusDispatchEnv(seed=42)
-    obs = env.reset()
+    obs, _ = env.reset()
     
-    # Warm up
-    for _ in range(10):
-        policy.predict(obs)
-    
-    # Benchmark
-    start_time = time.time()
-    for _ in range(num_iterations):
-        actions = policy.predict(obs)
-    end_time = time.time()
-    
-    total_time = end_time - start_time
-    avg_time = total_time / num_iterations
+    results = {}
+    for profile in profiles:
+        # Create inference engine
+        policy = ONNXPolicyInference(onnx_path, profile=profile)
+        results[profile] = {}
+        
+        for batch_size in batch_sizes:
+            batch = np.tile(obs, (batch_size, 1))
+            
+            # Warm up
+            for _ in range(10):
+                policy.predict_batch(batch)
+            
+            # Benchmark
+            latencies = np.empty(num_iterations)
+            for i in range(num_iterations):
+                start_time = time.perf_counter()
+                policy.predict_batch(batch)
+                latencies[i] = time.perf_counter() - start_time
+            
+            p50, p99 = np.percentile(latencies, [50, 99])
+            avg_time = latencies.mean()
+            results[profile][batch_size] = {'mean': avg_time, 'p50': p50, 'p99': p99}
+            
+            print(f"[{profile}] batch size {batch_size}:")
+            print(f"  Latency p50: {p50*1000:.3f} ms, p99: {p99*1000:.3f} ms")
+            print(f"  Inference rate: {1/avg_time:.1f} Hz ({batch_size/avg_time:.0f} observations/s)")
     
-    print(f"Total time: {total_time:.3f} seconds")
-    print(f"Average inference time: {avg_time*1000:.3f} ms")
-    print(f"Inference rate: {1/avg_time:.1f} Hz")
+    return results
+
+def collect_calibration_observations(onnx_path: str, seeds: List[int], max_steps: int = 240) -> np.ndarray:
+    """Record observations from seeded BusDispatchEnv rollouts driven by the fp32 policy"""
+    policy = ONNXPolicyInference(onnx_path)
+    env = BusDispatchEnv(seed=seeds[0])
+    
+    observations = []
+    for seed in seeds:
+        obs, _ = env.reset(seed=seed)
+        for _ in range(max_steps):
+            observations.append(obs)
+            obs, _, terminated, truncated, _ = env.step(policy.predict(obs, action_masks=env.action_masks()))
+            if terminated or truncated:
+                break
+    
+    return np.stack(observations).astype(np.float32)
+
+class RolloutCalibrationReader(CalibrationDataReader):
+    """Feeds recorded rollout observations to the static quantization calibrator"""
+    
+    def __init__(self, input_name: str, observations: np.ndarray, batch_size: int = 64,
+                 mask_input: Optional[Tuple[str, int]] = None):
+        self.input_name = input_name
+        self.mask_input = mask_input  # (name, mask width) for graphs exported with action masks
+        self.batches = iter([observations[i:i + batch_size] for i in range(0, len(observations), batch_size)])
+    
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        batch = next(self.batches, None)
+        if batch is None:
+            return None
+        feeds = {self.input_name: batch}
+        if self.mask_input is not None:
+            mask_name, mask_width = self.mask_input
+            feeds[mask_name] = np.ones((len(batch), mask_width), dtype=bool)
+        return feeds
+
+def quantize_policy(onnx_path: str, mode: str = "dynamic", calibration_obs: np.ndarray = None) -> str:
+    """Write an INT8 copy of an exported policy using dynamic or static quantization"""
+    if mode not in ("dynamic", "static"):
+        raise ValueError(f"Unknown quantization mode: {mode}. Use 'dynamic' or 'static'")
+    if mode == "static" and calibration_obs is None:
+        raise ValueError("Static quantization requires calibration observations")
+    
+    base_path = os.path.splitext(onnx_path)[0]
+    int8_path = f"{base_path}.int8_{mode}.onnx"
+    print(f"Quantizing {onnx_path} ({mode}) -> {int8_path}")
+    
+    # Shape inference + graph cleanup; the raw exporter output can carry stale shapes
+    preprocessed_path = f"{base_path}.preprocessed.onnx"
+    quant_pre_process(onnx_path, preprocessed_path)
+    
+    if mode == "dynamic":
+        quantize_dynamic(preprocessed_path, int8_path, weight_type=QuantType.QInt8)
+    else:
+        graph_inputs = onnx.load(preprocessed_path).graph.input
+        input_name = graph_inputs[0].name
+        mask_input = None
+        if len(graph_inputs) > 1:
+            mask_dims = graph_inputs[1].type.tensor_type.shape.dim
+            mask_input = (graph_inputs[1].name, mask_dims[-1].dim_value)
+        quantize_static(
+            preprocessed_path,
+            int8_path,
+            RolloutCalibrationReader(input_name, calibration_obs, mask_input=mask_input),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8
+        )
+    os.remove(preprocessed_path)
+    
+    # Carry the action layout metadata over to the quantized model
+    source = onnx.load(onnx_path)
+    quantized = onnx.load(int8_path)
+    onnx.helper.set_model_props(quantized, {prop.key: prop.value for prop in source.metadata_props})
+    onnx.save(quantized, int8_path)
+    
+    return int8_path
+
+def _profile_model(onnx_path: str, observation: np.ndarray, num_iterations: int = 500) -> Dict[str, float]:
+    """Model size, session load time and p50/p99 single-observation latency"""
+    start_time = time.perf_counter()
+    policy = ONNXPolicyInference(onnx_path)
+    load_time = time.perf_counter() - start_time
     
-    return avg_time
+    for _ in range(10):
+        policy.predict(observation)
+    latencies = np.empty(num_iterations)
+    for i in range(num_iterations):
+        start_time = time.perf_counter()
+        policy.predict(observation)
+        latencies[i] = time.perf_counter() - start_time
+    p50, p99 = np.percentile(latencies, [50, 99])
+    
+    return {
+        'size_bytes': os.path.getsize(onnx_path),
+        'load_time_ms': load_time * 1000,
+        'p50_latency_ms': p50 * 1000,
+        'p99_latency_ms': p99 * 1000
+    }
+
+def quantization_accuracy_gate(fp32_path: str, int8_path: str, observations: np.ndarray,
+                               seeds: List[int], min_agreement: float = 0.98,
+                               max_kpi_delta: float = 0.05) -> Dict[str, Any]:
+    """Compare an INT8 policy against its fp32 source before it is allowed to ship
+    
+    Checks per-bus argmax agreement on recorded observations and the relative change
+    of episode KPIs (avg wait, load std) over seeded episodes.
+    """
+    from eval import EvalJob, run_eval_job
+    
+    fp32_policy = ONNXPolicyInference(fp32_path)
+    int8_policy = ONNXPolicyInference(int8_path)
+    
+    # Action agreement on the same observations
+    agreement = float(np.mean(fp32_policy.predict_batch(observations) == int8_policy.predict_batch(observations)))
+    
+    # KPI deltas on closed-loop seeded episodes
+    env = BusDispatchEnv(seed=seeds[0])
+    kpi_deltas = {'avg_wait_time': [], 'avg_load_std': []}
+    for seed in seeds:
+        job = EvalJob(0, seed, 'normal', 'rl')
+        fp32_result = run_eval_job(env, fp32_policy, job)[0]
+        int8_result = run_eval_job(env, int8_policy, job)[0]
+        for metric in kpi_deltas:
+            baseline = fp32_result[metric]
+            delta = abs(int8_result[metric] - baseline) / baseline if baseline > 0 else 0.0
+            kpi_deltas[metric].append(delta)
+    kpi_deltas = {metric: float(np.mean(deltas)) for metric, deltas in kpi_deltas.items()}
+    
+    report = {
+        'action_agreement': agreement,
+        'kpi_relative_delta': kpi_deltas,
+        'fp32': _profile_model(fp32_path, observations[0]),
+        'int8': _profile_model(int8_path, observations[0])
+    }
+    report['passed'] = agreement >= min_agreement and all(d <= max_kpi_delta for d in kpi_deltas.values())
+    
+    print(f"Accuracy gate for {int8_path}:")
+    print(f"  Action agreement: {agreement:.2%} (min {min_agreement:.0%})")
+    for metric, delta in kpi_deltas.items():
+        print(f"  {metric} delta: {delta:.2%} (max {max_kpi_delta:.0%})")
+    for precision in ['fp32', 'int8']:
+        stats = report[precision]
+        print(f"  {precision}: {stats['size_bytes'] / 1024:.1f} KB, load {stats['load_time_ms']:.1f} ms, "
+              f"p50 {stats['p50_latency_ms']:.3f} ms, p99 {stats['p99_latency_ms']:.3f} ms")
+    print("✓ Accuracy gate passed!" if report['passed'] else "✗ Accuracy gate failed!")
+    
+    return report
 
 if __name__ == "__main__":
     import argparse
@@ -234,14 +546,34 @@ if __name__ == "__main__":
                        help="Run inference benchmark")
     parser.add_argument("--iterations", type=int, default=1000,
                        help="Benchmark iterations")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1],
+                       help="Observation batch sizes to benchmark")
+    parser.add_argument("--profiles", type=str, nargs="+", default=list(SESSION_PROFILES.keys()),
+                       help="ONNX Runtime session profiles to benchmark")
+    parser.add_argument("--quantize", type=str, nargs="+", choices=["dynamic", "static"], default=[],
+                       help="Also write INT8 models and run the accuracy gate")
+    parser.add_argument("--calibration-seeds", type=int, default=4,
+                       help="Seeded rollouts recorded for static calibration and action agreement")
+    parser.add_argument("--gate-seeds", type=int, default=5,
+                       help="Seeded episodes used for the KPI accuracy gate")
+    parser.add_argument("--action-masks", action="store_true",
+                       help="Export with an action_masks input applied to the logits")
     
     args = parser.parse_args()
     
     # Export model
-    onnx_path = export_ppo_to_onnx(args.input, args.output)
+    onnx_path = export_ppo_to_onnx(args.input, args.output, action_masks=args.action_masks)
     
     # Run benchmark if requested
     if args.benchmark:
-        benchmark_inference(onnx_path, args.iterations)
+        benchmark_inference(onnx_path, args.iterations, tuple(args.batch_sizes), tuple(args.profiles))
+    
+    # Quantize and gate if requested
+    if args.quantize:
+        calibration_obs = collect_calibration_observations(onnx_path, list(range(args.calibration_seeds)))
+        gate_seeds = list(range(1000, 1000 + args.gate_seeds))  # Disjoint from calibration seeds
+        for mode in args.quantize:
+            int8_path = quantize_policy(onnx_path, mode, calibration_obs)
+            quantization_accuracy_gate(onnx_path, int8_path, calibration_obs, gate_seeds)
     
     print("Export completed successfully!")
@@ -11,16 +11,25 @@ from stable_baselines3.common.policies import ActorCriticPolicy
 from stable_baselines3.common.utils import get_device
 
 class BusDispatchFeaturesExtractor(BaseFeaturesExtractor):
-    """Custom feature extractor for bus dispatch observations"""
+    """Custom feature extractor for bus dispatch observations
     
-    def __init__(self, observation_space, features_dim: int = 128):
+    Bus and stop encoders are shared across entities and applied once over
+    [batch, entities, features] tensors, so the cost is two matmuls per layer
+    regardless of fleet size. The stop count is derived from the observation size.
+    """
+    
+    def __init__(self, observation_space, features_dim: int = 128, num_buses: int = 6):
         super().__init__(observation_space, features_dim)
         
         # Calculate input dimensions
         self.bus_features = 5  # x, y, load, is_moving, hold_time
         self.stop_features = 1  # queue_length
-        self.num_buses = 6
-        self.num_stops = 32
+        self.num_buses = num_buses
+        
+        stop_obs_size = observation_space.shape[0] - self.num_buses * self.bus_features
+        if stop_obs_size <= 0 or stop_obs_size % self.stop_features != 0:
+            raise ValueError(f"Observation size {observation_space.shape[0]} does not match {num_buses} buses")
+        self.num_stops = stop_obs_size // self.stop_features
         
         # Bus feature processing
         self.bus_encoder = nn.Sequential(
@@ -45,31 +54,15 @@ class BusDispatchFeaturesExtractor(BaseFeaturesExtractor):
     
     def forward(self, observations: torch.Tensor) -> torch.Tensor:
         """Extract features from observations"""
-        batch_size = observations.shape[0]
-        
-        # Split observations into bus and stop features
-        bus_obs = observations[:, :self.num_buses * self.bus_features]
-        stop_obs = observations[:, self.num_buses * self.bus_features:]
-        
-        # Reshape for processing
-        bus_obs = bus_obs.view(batch_size, self.num_buses, self.bus_features)
-        stop_obs = stop_obs.view(batch_size, self.num_stops, self.stop_features)
-        
-        # Process bus features
-        bus_features = []
-        for i in range(self.num_buses):
-            bus_feat = self.bus_encoder(bus_obs[:, i, :])
-            bus_features.append(bus_feat)
-        
-        bus_features = torch.cat(bus_features, dim=1)  # [batch_size, num_buses * 16]
+        bus_size = self.num_buses * self.bus_features
         
-        # Process stop features
-        stop_features = []
-        for i in range(self.num_stops):
-            stop_feat = self.stop_encoder(stop_obs[:, i, :])
-            stop_features.append(stop_feat)
+        # Split observations into [batch, entities, features] (reshape keeps ONNX batch axis dynamic)
+        bus_obs = observations[:, :bus_size].reshape(-1, self.num_buses, self.bus_features)
+        stop_obs = observations[:, bus_size:].reshape(-1, self.num_stops, self.stop_features)
         
-        stop_features = torch.cat(stop_features, dim=1)  # [batch_size, num_stops * 8]
+        # Shared encoders over all entities at once
+        bus_features = self.bus_encoder(bus_obs).flatten(1)  # [batch_size, num_buses * 16]
+        stop_features = self.stop_encoder(stop_obs).flatten(1)  # [batch_size, num_stops * 8]
         
         # Combine and process globally
         combined = torch.cat([bus_features, stop_features], dim=1)
@@ -86,7 +79,7 @@ class BusDispatchPolicy(ActorCriticPolicy):
             action_space,
             lr_schedule,
             features_extractor_class=BusDispatchFeaturesExtractor,
-            features_extractor_kwargs={"features_dim": 128},
+            features_extractor_kwargs={"features_dim": 128, "num_buses": len(action_space.nvec)},
             **kwargs
         )
     
@@ -94,6 +87,110 @@ class BusDispatchPolicy(ActorCriticPolicy):
         """Forward pass with custom logic"""
         return super().forward(obs, deterministic)
 
+class PerBusMlpExtractor(nn.Module):
+    """Shared-weight encoder applied independently to every bus's local observation
+    
+    Actor latents stay per bus ([batch, num_buses, hidden_dim]); the critic sees
+    the mean over buses. No parameter depends on the number of buses.
+    """
+    
+    def __init__(self, local_dim: int, hidden_dim: int = 64):
+        super().__init__()
+        self.local_dim = local_dim
+        self.latent_dim_pi = hidden_dim
+        self.latent_dim_vf = hidden_dim
+        
+        self.encoder = nn.Sequential(
+            nn.Linear(local_dim, hidden_dim),
+            nn.Tanh(),
+            nn.Linear(hidden_dim, hidden_dim),
+            nn.Tanh()
+        )
+    
+    def forward(self, features: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        latent = self.forward_actor(features)
+        return latent, latent.mean(dim=1)
+    
+    def forward_actor(self, features: torch.Tensor) -> torch.Tensor:
+        # Features arrive flattened ([batch, num_buses * local_dim]) or per bus
+        return self.encoder(features.reshape(features.shape[0], -1, self.local_dim))
+    
+    def forward_critic(self, features: torch.Tensor) -> torch.Tensor:
+        return self.forward_actor(features).mean(dim=1)
+
+class DecentralizedBusPolicy(ActorCriticPolicy):
+    """Shared-weight per-bus policy for BusDispatchEnv(observation_mode="local")
+    
+    Every bus is scored by the same encoder and action head in one batched call,
+    so inference cost is linear in fleet size and the weights trained on 6 buses
+    load unchanged into a policy for 600.
+    """
+    
+    def __init__(self, observation_space, action_space, lr_schedule, hidden_dim: int = 64, **kwargs):
+        self.hidden_dim = hidden_dim
+        self.local_dim = observation_space.shape[-1]
+        super().__init__(observation_space, action_space, lr_schedule, **kwargs)
+    
+    def _build_mlp_extractor(self) -> None:
+        self.mlp_extractor = PerBusMlpExtractor(self.local_dim, self.hidden_dim)
+    
+    def _build(self, lr_schedule) -> None:
+        super()._build(lr_schedule)
+        
+        # Replace the [hidden, num_buses * num_actions] head with one shared per-bus head
+        num_actions = int(self.action_space.nvec[0])
+        self.action_net = nn.Linear(self.hidden_dim, num_actions)
+        if self.ortho_init:
+            self.init_weights(self.action_net, gain=0.01)
+        self.optimizer = self.optimizer_class(self.parameters(), lr=lr_schedule(1), **self.optimizer_kwargs)
+    
+    def _get_action_dist_from_latent(self, latent_pi: torch.Tensor):
+        # [batch, num_buses, num_actions] -> flat logits expected by MultiCategoricalDistribution
+        action_logits = self.action_net(latent_pi).flatten(1)
+        return self.action_dist.proba_distribution(action_logits=action_logits)
+
+def export_per_bus_policy_to_onnx(policy: DecentralizedBusPolicy, onnx_path: str, opset_version: int = 14):
+    """Export a DecentralizedBusPolicy actor with dynamic batch and bus axes"""
+    import onnx
+    
+    class PerBusActor(nn.Module):
+        def __init__(self, encoder: nn.Module, action_net: nn.Module):
+            super().__init__()
+            self.encoder = encoder
+            self.action_net = action_net
+        
+        def forward(self, observations):
+            action_logits = self.action_net(self.encoder(observations))
+            return torch.softmax(action_logits, dim=-1), action_logits
+    
+    actor = PerBusActor(policy.mlp_extractor.encoder, policy.action_net).cpu().eval()
+    dummy_input = torch.rand(2, len(policy.action_space.nvec), policy.local_dim)
+    torch.onnx.export(
+        actor,
+        dummy_input,
+        onnx_path,
+        export_params=True,
+        opset_version=opset_version,
+        do_constant_folding=True,
+        input_names=['observations'],
+        output_names=['action_probs', 'action_logits'],
+        dynamic_axes={
+            'observations': {0: 'batch_size', 1: 'num_buses'},
+            'action_probs': {0: 'batch_size', 1: 'num_buses'},
+            'action_logits': {0: 'batch_size', 1: 'num_buses'}
+        }
+    )
+    
+    # Same metadata keys as export_onnx.export_ppo_to_onnx; the bus count is free
+    exported = onnx.load(onnx_path)
+    onnx.helper.set_model_props(exported, {
+        'num_buses': 'dynamic',
+        'num_actions': str(int(policy.action_space.nvec[0]))
+    })
+    onnx.save(exported, onnx_path)
+    print(f"Per-bus policy exported to {onnx_path}")
+    return onnx_path
+
 class MultiHeadPolicy(nn.Module):
     """Multi-head policy for different bus types or scenarios"""
     
@@ -146,71 +243,100 @@ class MultiHeadPolicy(nn.Module):
         return weighted_output
 
 class AttentionPolicy(nn.Module):
-    """Attention-based policy for bus dispatching"""
+    """Permutation-invariant set-attention policy for any number of buses and stops
+    
+    Buses and stops are encoded into a shared embedding space and every bus attends
+    over all entities. Padding is handled with boolean masks (True = present), so one
+    model serves the 20x20 training grid and larger GTFS deployments; per-bus action
+    logits come from a single batched head.
+    """
     
-    def __init__(self, input_dim: int, num_buses: int = 6, num_actions: int = 4):
+    def __init__(self, num_actions: int = 4, embed_dim: int = 32, num_heads: int = 4,
+                 bus_dim: int = 5, stop_dim: int = 1):
         super().__init__()
-        self.num_buses = num_buses
         self.num_actions = num_actions
         
         # Feature dimensions
-        self.bus_dim = 5
-        self.stop_dim = 1
-        self.num_stops = 32
+        self.bus_dim = bus_dim
+        self.stop_dim = stop_dim
         
-        # Bus and stop encoders
-        self.bus_encoder = nn.Linear(self.bus_dim, 32)
-        self.stop_encoder = nn.Linear(self.stop_dim, 16)
+        # Bus and stop encoders (both project straight into the attention space)
+        self.bus_encoder = nn.Linear(self.bus_dim, embed_dim)
+        self.stop_encoder = nn.Linear(self.stop_dim, embed_dim)
         
         # Attention mechanism
-        self.attention = nn.MultiheadAttention(embed_dim=32, num_heads=4, batch_first=True)
+        self.attention = nn.MultiheadAttention(embed_dim=embed_dim, num_heads=num_heads, batch_first=True)
         
-        # Policy network
+        # Policy network, shared by all buses
         self.policy_net = nn.Sequential(
-            nn.Linear(32, 64),
+            nn.Linear(embed_dim, 64),
             nn.ReLU(),
             nn.Linear(64, num_actions)
         )
     
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        """Forward pass with attention mechanism"""
-        batch_size = x.shape[0]
-        
-        # Split and encode bus and stop features
-        bus_features = x[:, :self.num_buses * self.bus_dim]
-        stop_features = x[:, self.num_buses * self.bus_dim:]
-        
-        # Reshape for attention
-        bus_features = bus_features.view(batch_size, self.num_buses, self.bus_dim)
-        bus_encoded = self.bus_encoder(bus_features)  # [batch_size, num_buses, 32]
-        
-        stop_features = stop_features.view(batch_size, self.num_stops, self.stop_dim)
-        stop_encoded = self.stop_encoder(stop_features)  # [batch_size, num_stops, 16]
-        
-        # Pad stop features to match bus features
-        stop_padded = torch.zeros(batch_size, self.num_stops, 32)
-        stop_padded[:, :, :16] = stop_encoded
-        
-        # Combine bus and stop features
-        all_features = torch.cat([bus_encoded, stop_padded], dim=1)  # [batch_size, num_buses + num_stops, 32]
-        
-        # Apply attention
-        attended_features, _ = self.attention(all_features, all_features, all_features)
-        
-        # Extract bus-specific features
-        bus_attended = attended_features[:, :self.num_buses, :]  # [batch_size, num_buses, 32]
-        
-        # Generate actions for each bus
-        actions = []
-        for i in range(self.num_buses):
-            bus_feat = bus_attended[:, i, :]  # [batch_size, 32]
-            bus_action = self.policy_net(bus_feat)  # [batch_size, num_actions]
-            actions.append(bus_action)
-        
-        # Stack actions
-        actions = torch.stack(actions, dim=1)  # [batch_size, num_buses, num_actions]
-        
-        return actions
+    def forward(self, bus_obs: torch.Tensor, stop_obs: torch.Tensor,
+                bus_mask: torch.Tensor = None, stop_mask: torch.Tensor = None) -> torch.Tensor:
+        """Per-bus action logits
+        
+        bus_obs: [batch, num_buses, bus_dim], stop_obs: [batch, num_stops, stop_dim]
+        bus_mask / stop_mask: optional [batch, entities] bools, True for real entities
+        Returns [batch, num_buses, num_actions]; rows of padded buses are meaningless.
+        """
+        bus_encoded = self.bus_encoder(bus_obs)
+        stop_encoded = self.stop_encoder(stop_obs)
+        entities = torch.cat([bus_encoded, stop_encoded], dim=1)
+        
+        # key_padding_mask marks entities to ignore (True = padding)
+        padding_mask = None
+        if bus_mask is not None or stop_mask is not None:
+            if bus_mask is None:
+                bus_mask = torch.ones(bus_obs.shape[:2], dtype=torch.bool, device=bus_obs.device)
+            if stop_mask is None:
+                stop_mask = torch.ones(stop_obs.shape[:2], dtype=torch.bool, device=stop_obs.device)
+            padding_mask = ~torch.cat([bus_mask, stop_mask], dim=1)
+        
+        # Buses query the whole set of buses and stops
+        bus_attended, _ = self.attention(bus_encoded, entities, entities,
+                                         key_padding_mask=padding_mask, need_weights=False)
+        
+        # One head application over [batch, num_buses, embed_dim]
+        return self.policy_net(bus_attended)
+    
+    def forward_flat(self, x: torch.Tensor, num_buses: int) -> torch.Tensor:
+        """Per-bus logits from a flat BusDispatchEnv observation"""
+        bus_size = num_buses * self.bus_dim
+        bus_obs = x[:, :bus_size].reshape(x.shape[0], num_buses, self.bus_dim)
+        stop_obs = x[:, bus_size:].reshape(x.shape[0], -1, self.stop_dim)
+        return self.forward(bus_obs, stop_obs)
+
+def export_attention_policy_to_onnx(policy: AttentionPolicy, onnx_path: str, opset_version: int = 14):
+    """Export AttentionPolicy with dynamic batch, bus and stop axes"""
+    policy.eval()
+    dummy_inputs = (
+        torch.rand(2, 6, policy.bus_dim),
+        torch.rand(2, 32, policy.stop_dim),
+        torch.ones(2, 6, dtype=torch.bool),
+        torch.ones(2, 32, dtype=torch.bool)
+    )
+    torch.onnx.export(
+        policy,
+        dummy_inputs,
+        onnx_path,
+        export_params=True,
+        opset_version=opset_version,
+        do_constant_folding=True,
+        input_names=['bus_obs', 'stop_obs', 'bus_mask', 'stop_mask'],
+        output_names=['action_logits'],
+        dynamic_axes={
+            'bus_obs': {0: 'batch_size', 1: 'num_buses'},
+            'stop_obs': {0: 'batch_size', 1: 'num_stops'},
+            'bus_mask': {0: 'batch_size', 1: 'num_buses'},
+            'stop_mask': {0: 'batch_size', 1: 'num_stops'},
+            'action_logits': {0: 'batch_size', 1: 'num_buses'}
+        }
+    )
+    print(f"Attention policy exported to {onnx_path}")
+    return onnx_path
 
 class CurriculumPolicy:
     """Curriculum learning wrapper for policy training"""
@@ -253,6 +379,10 @@ class CurriculumPolicy:
         if 'disruption_frequency' in params:
             # Gradually introduce disruptions
             env.set_disruption_frequency(params['disruption_frequency'])
+        
+        if 'start_time' in params:
+            # Episodes start inside the congested periods the traffic level scales
+            env.set_start_time(params['start_time'])
 
 def create_curriculum_schedule() -> Dict[str, Any]:
     """Create curriculum learning schedule"""
@@ -262,27 +392,69 @@ def create_curriculum_schedule() -> Dict[str, Any]:
             'end': 10000,
             'traffic_level': 0.1,
             'demand_multiplier': 0.5,
-            'disruption_frequency': 0.0
+            'disruption_frequency': 0.0,
+            'start_time': 600.0  # 10 AM, midday
         },
         '1': {  # Phase 1: Light traffic
             'start': 10000,
             'end': 30000,
             'traffic_level': 0.3,
             'demand_multiplier': 0.7,
-            'disruption_frequency': 0.1
+            'disruption_frequency': 0.1,
+            'start_time': 600.0  # 10 AM, midday
         },
         '2': {  # Phase 2: Moderate traffic
             'start': 30000,
             'end': 60000,
             'traffic_level': 0.6,
             'demand_multiplier': 1.0,
-            'disruption_frequency': 0.2
+            'disruption_frequency': 0.2,
+            'start_time': 480.0  # 8 AM, morning rush into midday
         },
         '3': {  # Phase 3: Heavy traffic with disruptions
             'start': 60000,
             'end': 100000,
             'traffic_level': 1.0,
             'demand_multiplier': 1.5,
-            'disruption_frequency': 0.3
+            'disruption_frequency': 0.3,
+            'start_time': 930.0  # 3:30 PM, midday into evening rush
         }
     }
+
+def benchmark_features_extractor(batch_size: int = 64, num_iterations: int = 200,
+                                 num_buses: int = 6, num_stops: int = 32) -> Dict[str, float]:
+    """Compare the vectorized extractor against the per-entity Python loop it replaced"""
+    import time
+    from gymnasium import spaces
+    
+    obs_size = num_buses * 5 + num_stops
+    observation_space = spaces.Box(low=0.0, high=1.0, shape=(obs_size,), dtype=np.float32)
+    extractor = BusDispatchFeaturesExtractor(observation_space, num_buses=num_buses)
+    observations = torch.rand(batch_size, obs_size)
+    
+    def loop_forward(obs: torch.Tensor) -> torch.Tensor:
+        # Previous implementation: one encoder call per bus and per stop
+        bus_obs = obs[:, :num_buses * 5].view(-1, num_buses, 5)
+        stop_obs = obs[:, num_buses * 5:].view(-1, num_stops, 1)
+        bus_features = torch.cat([extractor.bus_encoder(bus_obs[:, i, :]) for i in range(num_buses)], dim=1)
+        stop_features = torch.cat([extractor.stop_encoder(stop_obs[:, i, :]) for i in range(num_stops)], dim=1)
+        return extractor.global_encoder(torch.cat([bus_features, stop_features], dim=1))
+    
+    results = {}
+    with torch.no_grad():
+        max_diff = (extractor(observations) - loop_forward(observations)).abs().max().item()
+        
+        for name, forward in [('loop', loop_forward), ('vectorized', extractor)]:
+            for _ in range(10):
+                forward(observations)
+            start_time = time.perf_counter()
+            for _ in range(num_iterations):
+                forward(observations)
+            results[name] = (time.perf_counter() - start_time) / num_iterations
+    
+    print(f"Features extractor benchmark (batch {batch_size}, {num_buses} buses, {num_stops} stops):")
+    print(f"  Loop:       {results['loop']*1000:.3f} ms")
+    print(f"  Vectorized: {results['vectorized']*1000:.3f} ms")
+    print(f"  Speedup:    {results['loop'] / results['vectorized']:.1f}x (max output diff {max_diff:.2e})")
+    
+    return results
@@ -5,8 +5,10 @@ from stable_baselines3.common.env_util import make_vec_env
 from stable_baselines3.common.callbacks import BaseCallback
 import torch
 import sys
+import time
 sys.path.append('../env')
 from wrappers import BusDispatchEnv
+from policies import CurriculumPolicy, DecentralizedBusPolicy, create_curriculum_schedule
 
 class TrainingCallback(BaseCallback):
     """Custom callback to track training progress"""
@@ -45,7 +47,73 @@ class TrainingCallback(BaseCallback):
         
         return True
 
-def create_training_env(seed: int = 42):
+class CurriculumCallback(BaseCallback):
+    """Advance curriculum phases by timestep and push them to every vectorized env
+    
+    Logs throughput (env steps/s) and mean episode reward for each phase.
+    """
+    
+    def __init__(self, curriculum_schedule=None, verbose: int = 1):
+        super().__init__(verbose)
+        self.curriculum = CurriculumPolicy(None, curriculum_schedule or create_curriculum_schedule())
+        self.phase_history = []
+        self._phase = None
+        self._phase_start_steps = 0
+        self._phase_start_time = 0.0
+        self._phase_rewards = []
+    
+    def _on_training_start(self) -> None:
+        self._start_phase()
+    
+    def _start_phase(self):
+        self.curriculum.update_curriculum(self.num_timesteps)
+        self._phase = self.curriculum.current_phase
+        params = {k: v for k, v in self.curriculum.get_curriculum_params().items() if k not in ('start', 'end')}
+        self.training_env.env_method("set_curriculum_params", params)
+        
+        self._phase_start_steps = self.num_timesteps
+        self._phase_start_time = time.time()
+        self._phase_rewards = []
+        if self.verbose > 0:
+            print(f"Curriculum phase {self._phase} at step {self.num_timesteps}: {params}")
+    
+    def _end_phase(self):
+        elapsed = max(time.time() - self._phase_start_time, 1e-9)
+        steps = self.num_timesteps - self._phase_start_steps
+        stats = {
+            'phase': self._phase,
+            'steps': steps,
+            'steps_per_second': steps / elapsed,
+            'episodes': len(self._phase_rewards),
+            'mean_reward': float(np.mean(self._phase_rewards)) if self._phase_rewards else float('nan')
+        }
+        self.phase_history.append(stats)
+        
+        self.logger.record("curriculum/phase", stats['phase'])
+        self.logger.record("curriculum/steps_per_second", stats['steps_per_second'])
+        self.logger.record("curriculum/mean_reward", stats['mean_reward'])
+        if self.verbose > 0:
+            print(f"Phase {stats['phase']} done: {steps} steps at {stats['steps_per_second']:.0f} steps/s, "
+                  f"{stats['episodes']} episodes, mean reward {stats['mean_reward']:.2f}")
+    
+    def _on_step(self) -> bool:
+        # Monitor adds an 'episode' entry to info when an episode ends
+        for info in self.locals.get('infos', []):
+            if 'episode' in info:
+                self._phase_rewards.append(info['episode']['r'])
+        
+        self.curriculum.update_curriculum(self.num_timesteps)
+        if self.curriculum.current_phase != self._phase:
+            self._end_phase()
+            self._start_phase()
+        
+        return True
+    
+    def _on_training_end(self) -> None:
+        self._end_phase()
+
+def create_training_env(seed: int = 42, routing: str = "static", observation_mode: str = "global",
+                        num_neighbor_stops: int = 4):
     """Create training environment with curriculum"""
     
     def _init():
@@ -55,7 +123,10 @@ def create_training_env(seed: int = 42):
             num_buses=6,
             time_step=0.5,  # 30 seconds
             max_episode_time=60.0,  # 1 hour episodes for training
-            seed=seed
+            seed=seed,
+            routing=routing,
+            observation_mode=observation_mode,
+            num_neighbor_stops=num_neighbor_stops
         )
         return env
     
@@ -69,20 +140,47 @@ def train_ppo_policy(
     n_epochs: int = 10,
     gamma: float = 0.99,
     seed: int = 42,
-    device: str = "auto"
+    device: str = "auto",
+    action_masking: bool = False,
+    curriculum: bool = False,
+    n_envs: int = 1,
+    routing: str = "static",
+    observation_mode: str = "global",
+    num_neighbor_stops: int = 4
 ):
-    """Train PPO policy for bus dispatching"""
+    """Train PPO policy for bus dispatching
+    
+    With action_masking, trains sb3-contrib's MaskablePPO, which reads
+    BusDispatchEnv.action_masks() each step and never samples no-op actions.
+    With routing="time_dependent" and the curriculum, the later phases start
+    episodes just before a period change, so routes are priced across it.
+    With observation_mode="local", every bus sees only its own state and its
+    next num_neighbor_stops stops, scored by the shared-weight DecentralizedBusPolicy.
+    """
+    
+    algorithm = PPO
+    policy = "MlpPolicy"
+    if observation_mode == "local":
+        if action_masking:
+            raise ValueError("Action masking is not supported with observation_mode='local'")
+        policy = DecentralizedBusPolicy
+    if action_masking:
+        try:
+            from sb3_contrib import MaskablePPO
+        except ImportError:
+            raise ImportError("Action masking requires sb3-contrib: pip install sb3-contrib")
+        algorithm = MaskablePPO
     
     print("Creating training environment...")
     
     # Create vectorized environment
-    env = make_vec_env(create_training_env(seed), n_envs=1)
+    env = make_vec_env(create_training_env(seed, routing, observation_mode, num_neighbor_stops), n_envs=n_envs)
     
     print("Initializing PPO agent...")
     
     # PPO configuration
-    model = PPO(
-        "MlpPolicy",
+    model = algorithm(
+        policy,
         env,
         learning_rate=learning_rate,
         n_steps=n_steps,
@@ -100,8 +198,10 @@ def train_ppo_policy(
         tensorboard_log="./ppo_bus_tensorboard/"
     )
     
-    # Create callback
-    callback = TrainingCallback(check_freq=1000, verbose=1)
+    # Create callbacks
+    callback = [TrainingCallback(check_freq=1000, verbose=1)]
+    if curriculum:
+        callback.append(CurriculumCallback(create_curriculum_schedule(), verbose=1))
     
     print("Starting training...")
     print(f"Total timesteps: {total_timesteps}")
@@ -125,7 +225,8 @@ def train_ppo_policy(
     
     return model
 
-def evaluate_policy(model_path: str, n_episodes: int = 10, render: bool = False):
+def evaluate_policy(model_path: str, n_episodes: int = 10, render: bool = False,
+                    observation_mode: str = "global", num_neighbor_stops: int = 4):
     """Evaluate trained policy"""
     
     print(f"Loading model from {model_path}")
@@ -137,7 +238,9 @@ def evaluate_policy(model_path: str, n_episodes: int = 10, render: bool = False)
         num_buses=6,
         time_step=0.5,
         max_episode_time=120.0,  # Longer episodes for evaluation
-        seed=42
+        seed=42,
+        observation_mode=observation_mode,
+        num_neighbor_stops=num_neighbor_stops
     )
     
     # Load model
@@ -206,6 +309,18 @@ if __name__ == "__main__":
                        help="Random seed")
     parser.add_argument("--render", action="store_true",
                        help="Render during evaluation")
+    parser.add_argument("--action-masking", action="store_true",
+                       help="Train with MaskablePPO and the env's action masks (needs sb3-contrib)")
+    parser.add_argument("--curriculum", action="store_true",
+                       help="Ramp traffic, demand and disruptions with the curriculum schedule")
+    parser.add_argument("--n-envs", type=int, default=1,
+                       help="Number of vectorized training environments")
+    parser.add_argument("--routing", type=str, choices=["static", "time_dependent"], default="static",
+                       help="Bus routing: current edge costs, or priced at the time each edge is reached")
+    parser.add_argument("--observation-mode", type=str, choices=["global", "local"], default="global",
+                       help="Whole-fleet observation, or per-bus local ones with the shared-weight policy")
+    parser.add_argument("--neighbor-stops", type=int, default=4,
+                       help="Upcoming stops each bus sees with --observation-mode local")
     
     args = parser.parse_args()
     
@@ -214,12 +329,20 @@ if __name__ == "__main__":
         model = train_ppo_policy(
             total_timesteps=args.timesteps,
             learning_rate=args.lr,
-            seed=args.seed
+            seed=args.seed,
+            action_masking=args.action_masking,
+            curriculum=args.curriculum,
+            n_envs=args.n_envs,
+            routing=args.routing,
+            observation_mode=args.observation_mode,
+            num_neighbor_stops=args.neighbor_stops
         )
         
         print("Training completed! Running quick evaluation...")
-        evaluate_policy("ppo_bus_final", n_episodes=3)
+        evaluate_policy("ppo_bus_final", n_episodes=3, observation_mode=args.observation_mode,
+                        num_neighbor_stops=args.neighbor_stops)
         
     elif args.mode == "eval":
         print("Evaluating trained policy...")
-        evaluate_policy(args.model, n_episodes=args.episodes, render=args.render)
\ No newline at end of file
+        evaluate_policy(args.model, n_episodes=args.episodes, render=args.render,
+                        observation_mode=args.observation_mode, num_neighbor_stops=args.neighbor_stops)
\ No newline at end of file
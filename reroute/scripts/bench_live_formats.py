@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark /live wire formats: encode time and bytes per tick for growing fleets.
+Compares the legacy full JSON state with protocol 2 deltas as JSON, MessagePack
+and columnar binary, with and without deflate (permessage-deflate estimate).
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+import zlib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'env'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+from fastapi_manhattan_comparison import Bus, BusStop, ComparisonManhattanSystem
+from live_codecs import available_formats, encode_json
+from live_protocol import DeltaStateEncoder
+
+STOPS_PATH = os.path.join(os.path.dirname(__file__), '..', 'ui_data', 'gtfs_m', 'stops.txt')
+
+def build_system(num_buses: int, seed: int) -> ComparisonManhattanSystem:
+    """Comparison system with every GTFS stop and a synthetic fleet of num_buses"""
+    system = ComparisonManhattanSystem(seed=seed)
+    system.stops = {}
+    with open(STOPS_PATH, newline='') as f:
+        rows = list(csv.DictReader(f))
+    lats = [float(row['stop_lat']) for row in rows]
+    lons = [float(row['stop_lon']) for row in rows]
+    avenues, streets = system.projection.to_grid(lats, lons)
+    for row, lat, lon, avenue, street in zip(rows, lats, lons, avenues.tolist(), streets.tolist()):
+        system.stops[row['stop_id']] = BusStop(row['stop_id'], row['stop_name'], lat, lon, avenue, street)
+    
+    rng = np.random.default_rng(seed)
+    system.buses = {
+        i: Bus(id=i, route_id="M15", route_name="Route M15",
+               avenue=int(rng.integers(1, 13)), street=int(rng.integers(1, 201)),
+               is_optimized=bool(i % 2))
+        for i in range(num_buses)
+    }
+    place_on_grid(system)
+    return system
+
+def place_on_grid(system: ComparisonManhattanSystem):
+    """Synthetic buses live on grid intersections; give them the matching lat/lon"""
+    buses = list(system.buses.values())
+    lats, lons = system.projection.to_latlon([bus.avenue for bus in buses], [bus.street for bus in buses])
+    for bus, lat, lon in zip(buses, lats.tolist(), lons.tolist()):
+        bus.lat, bus.lon = lat, lon
+
+def mutate(system: ComparisonManhattanSystem, rng: np.random.Generator, move_fraction: float = 0.6):
+    """One tick of synthetic motion: most buses step a block, ~40% of queues change"""
+    system.simulation_time += 1
+    for bus in system.buses.values():
+        if rng.random() < move_fraction:
+            if rng.random() < 0.5:
+                bus.street = int(np.clip(bus.street + rng.choice((-1, 1)), 1, 200))
+                bus.direction = "north" if bus.street % 2 else "south"
+            else:
+                bus.avenue = int(np.clip(bus.avenue + rng.choice((-1, 1)), 1, 12))
+                bus.direction = "east" if bus.avenue % 2 else "west"
+            bus.load = int(np.clip(bus.load + rng.integers(-3, 4), 0, bus.capacity))
+    for stop in system.stops.values():
+        if rng.random() < 0.4:
+            stop.queue_length = int(rng.integers(0, 26))
+    place_on_grid(system)
+
+def deflated_size(payload) -> int:
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return len(compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+def bench(num_buses: int, ticks: int, seed: int):
+    system = build_system(num_buses, seed)
+    encoder = DeltaStateEncoder(system)
+    encoder.encode_tick()
+    rng = np.random.default_rng(seed)
+    
+    variants = [("full", "json")] + [("delta", fmt) for fmt in available_formats()]
+    seconds = {variant: 0.0 for variant in variants}
+    sizes = {variant: 0 for variant in variants}
+    deflated = {variant: 0 for variant in variants}
+    diff_seconds = 0.0
+    
+    for _ in range(ticks):
+        mutate(system, rng)
+        
+        started = time.perf_counter()
+        full_state = encode_json(system.get_system_state())
+        seconds[("full", "json")] += time.perf_counter() - started
+        
+        started = time.perf_counter()
+        frame = encoder.encode_tick({})
+        diff_seconds += time.perf_counter() - started
+        
+        payloads = {("full", "json"): full_state}
+        for variant in variants[1:]:
+            started = time.perf_counter()
+            payloads[variant] = frame.encode(*variant)
+            seconds[variant] += time.perf_counter() - started
+        
+        for variant, payload in payloads.items():
+            sizes[variant] += len(payload.encode('utf-8') if isinstance(payload, str) else payload)
+            deflated[variant] += deflated_size(payload)
+    
+    print(f"\n{num_buses} buses, {len(system.stops)} stops, {ticks} ticks (delta diff: {diff_seconds / ticks * 1000:.2f} ms/tick shared by all delta formats)")
+    print(f"{'format':<16}{'encode ms':>12}{'bytes':>12}{'deflated':>12}")
+    for kind, fmt in variants:
+        variant = (kind, fmt)
+        print(f"{kind + '/' + fmt:<16}{seconds[variant] / ticks * 1000:>12.2f}"
+              f"{sizes[variant] / ticks:>12.0f}{deflated[variant] / ticks:>12.0f}")
+    for fmt in available_formats():
+        snapshot = frame.encode("snapshot", fmt)
+        print(f"{'snapshot/' + fmt:<16}{'':>12}{len(snapshot):>12}{deflated_size(snapshot):>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /live wire formats")
+    parser.add_argument('--buses', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--ticks', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    
+    for num_buses in args.buses:
+        bench(num_buses, args.ticks, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -42,7 +42,6 @@ class DemoSeedGenerator:
     
     def __init__(self, seed: int = 42):
         self.seed = seed
-        np.random.seed(seed)
         self.scenarios = {}
         self._create_scenarios()
     
@@ -146,14 +145,17 @@ class DemoRunner:
             seed=self.seed
         )
         
+        # Reset environment (reset puts the fleet in RL mode)
+        obs, _ = env.reset()
+        
         # Set mode
         if mode == "rl":
             env.bus_fleet.set_mode(BusMode.RL)
         else:
             env.bus_fleet.set_mode(BusMode.STATIC)
         
-        # Reset environment
-        obs = env.reset()
+        # Demo actions get their own stream so every run of a scenario is identical
+        action_rng = env.rng_streams["baseline"]
         
         # Track metrics
         metrics_history = []
@@ -177,13 +179,14 @@ class DemoRunner:
             # Generate action
             if mode == "rl":
                 # For RL mode, use random actions (in practice, load trained model)
-                action = np.random.randint(0, 4, size=env.num_buses)
+                action = action_rng.integers(0, 4, size=env.num_buses)
             else:
                 # Static mode - no actions needed
                 action = np.zeros(env.num_buses, dtype=int)
             
             # Step environment
-            obs, reward, done, info = env.step(action)
+            obs, reward, terminated, truncated, info = env.step(action)
+            done = terminated or truncated
             current_time += env.time_step
             step += 1
             
@@ -234,7 +237,7 @@ class DemoRunner:
             center_y = params.get('center_y', 10)
             radius = params.get('radius', 3)
             severity = params.get('severity', 2.0)
-            env.apply_disruption('traffic', {
+            env.apply_disruption('zone', {
                 'center_x': center_x,
                 'center_y': center_y,
                 'radius': radius,
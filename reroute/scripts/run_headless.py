@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Headless comparison run: step ComparisonManhattanSystem as fast as it goes, no
+server or browser attached, and record the KPI time series to a columnar .npz
+(one array per KPI, plus simulation_time).
+
+Usage: python run_headless.py --ticks 172800 --seed 42 --output kpis.npz
+       python run_headless.py --policy ../rl/ppo_bus_policy.onnx   (optimized fleet driven by the policy)
+
+From Python:
+    from run_headless import run_headless
+    run = run_headless(ticks=10000, seed=42)
+    run.columns["improvement_percentage"][-1], run.ticks_per_second
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from typing import Dict, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'env'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+from fastapi_manhattan_comparison import ComparisonManhattanSystem
+
+class HeadlessRun:
+    """KPI columns of one run and how fast it went"""
+    
+    def __init__(self, columns: Dict[str, np.ndarray], ticks: int, seed: Optional[int], elapsed: float):
+        self.columns = columns
+        self.ticks = ticks
+        self.seed = seed
+        self.elapsed = elapsed
+    
+    @property
+    def ticks_per_second(self) -> float:
+        return self.ticks / self.elapsed if self.elapsed > 0 else float('inf')
+    
+    def final_kpis(self) -> Dict[str, float]:
+        return {name: column[-1].item() for name, column in self.columns.items() if len(column)}
+    
+    def save(self, path: str):
+        """Columnar .npz: one array per KPI plus run metadata as scalars"""
+        np.savez_compressed(path, **self.columns, ticks=self.ticks, seed=-1 if self.seed is None else self.seed,
+                            elapsed=self.elapsed, ticks_per_second=self.ticks_per_second)
+
+def _kpi_row(system: ComparisonManhattanSystem) -> Dict[str, float]:
+    kpis, comparison = system.get_kpis()
+    row = {"simulation_time": system.simulation_time}
+    row.update(kpis)
+    row.update(comparison)
+    return row
+
+def run_headless(ticks: int, seed: Optional[int] = None, record_every: int = 1,
+                 system: Optional[ComparisonManhattanSystem] = None, policy_path: Optional[str] = None) -> HeadlessRun:
+    """Step the comparison system ticks times, sampling KPIs every record_every ticks"""
+    system = system or ComparisonManhattanSystem(seed=seed, policy_path=policy_path)
+    driver = system.policy_driver
+    samples = ticks // record_every
+    
+    # Columns come from the first KPI row, so new KPIs are recorded without touching this file
+    columns: Dict[str, np.ndarray] = {}
+    sample = 0
+    started = time.perf_counter()
+    for tick in range(1, ticks + 1):
+        # No event loop here, so the policy runs inline (the server hands it to an executor)
+        if driver is not None:
+            driver.decide()
+        system.step()
+        if tick % record_every == 0:
+            row = _kpi_row(system)
+            if not columns:
+                columns = {name: np.zeros(samples, dtype=np.int64 if name == "simulation_time" else np.float64)
+                           for name in row}
+            for name, value in row.items():
+                columns[name][sample] = value
+            sample += 1
+    elapsed = time.perf_counter() - started
+    
+    return HeadlessRun(columns, ticks, seed, elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the baseline-vs-optimized comparison without the server")
+    parser.add_argument('--ticks', type=int, default=10000, help='Simulation ticks to run')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--every', type=int, default=1, help='Record KPIs every N ticks')
+    parser.add_argument('--policy', type=str, default=None, help='ONNX policy driving the optimized fleet')
+    parser.add_argument('--output', type=str, default='headless_kpis.npz', help='Columnar KPI output (.npz)')
+    args = parser.parse_args()
+    
+    run = run_headless(args.ticks, seed=args.seed, record_every=args.every, policy_path=args.policy)
+    run.save(args.output)
+    
+    final = run.final_kpis()
+    print(f"{run.ticks} ticks in {run.elapsed:.2f}s ({run.ticks_per_second:,.0f} ticks/s)")
+    print(f"Baseline avg wait: {final.get('baseline_avg_wait', 0):.2f}  "
+          f"Optimized avg wait: {final.get('optimized_avg_wait', 0):.2f}  "
+          f"Improvement: {final.get('improvement_percentage', 0):.1f}%")
+    if final.get('policy_driven'):
+        print(f"Policy inference: {final.get('policy_latency_p50_ms', 0):.3f} ms median per tick")
+    print(f"KPI time series ({len(run.columns)} columns) -> {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,38 @@
 #!/usr/bin/env python3
 """
 Manhattan Bus Dispatch Server - Baseline vs Optimized Comparison
-Shows both untrained (baseline) and trained (optimized) routes with wait time comparison
+Shows baseline buses and policy-driven (optimized) buses on the same routes with measured wait comparison
 """
 
 import os
 import sys
 import json
 import asyncio
-import random
 import time
-import math
-import pandas as pd
-from typing import Dict, List, Any, Tuple
+import copy
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Tuple, Optional
 from dataclasses import dataclass
 
 # Add paths for imports
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'env'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'rl'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.dirname(__file__))
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
+from seeding import make_rng_streams
+from gtfs_feed import load_feed
+from projection import GridProjection
+from route_topology import RouteTopology
+from wait_metrics import ArrivalQueues, WaitWindow
+from policy_driver import DEFAULT_POLICY_PATH, PolicyDriver, load_policy
+from live_feed import LiveBroadcaster
+from live_protocol import DeltaStateEncoder, PROTOCOL_VERSION
+from live_codecs import encode_message, negotiate_format
+from live_viewport import CLUSTER_BELOW_ZOOM, ViewportIndex
 
 app = FastAPI(title="Manhattan Bus Dispatch - Baseline vs Optimized")
 
@@ -33,10 +44,11 @@ class BusStop:
     lon: float
     avenue: int
     street: int
-    queue_length: int = 0
+    queue_length: int = 0  # Riders waiting for the optimized fleet (the one shown on the map)
     routes_served: List[str] = None
     baseline_wait_time: float = 0.0
     optimized_wait_time: float = 0.0
+    queue_slot: int = -1  # Row of this stop in each fleet's rider arrival ring buffer
 
 @dataclass
 class Bus:
@@ -48,24 +60,49 @@ class Bus:
     load: int = 0
     capacity: int = 50
     color: str = "#FF6B6B"
-    target_avenue: int = 0
-    target_street: int = 0
     direction: str = "north"
-    route_stops: List[str] = None
-    current_stop_index: int = 0
     is_optimized: bool = False  # True for optimized, False for baseline
-    efficiency_score: float = 0.0
+    efficiency_score: float = 0.0  # Mean occupancy (load / capacity) since the start of the run
+    # Position along the route topology (see route_topology.RouteTopology)
+    pattern: int = 0
+    distance: float = 0.0  # Meters along the pattern's shape
+    shape_cursor: int = 0
+    stop_cursor: int = 0   # Next stop, as an index into the topology's stop arrays
+    dwell: int = 0         # Ticks spent so far at the current stop
+    hold: int = 0          # Ticks to stay at a stop even once nobody is left to board (set by the policy)
+    skip_until: int = -1   # Stops before this stop cursor are passed without halting (set by the policy)
+    lat: float = 0.0
+    lon: float = 0.0
+    load_ticks: int = 0    # Sum of load over every tick, for efficiency_score
+
+# Demo routes (GTFS route_id -> display color)
+ROUTE_COLORS = {
+    "M1": "#FF6B6B", "M2": "#4ECDC4", "M3": "#45B7D1", "M4": "#96CEB4",
+    "M5": "#FFEAA7", "M7": "#DDA0DD", "M10": "#98D8C8", "M11": "#F39C12",
+    "M15": "#E74C3C", "M20": "#9B59B6", "M23+": "#1ABC9C", "M34+": "#F39C12"
+}
 
 class ComparisonManhattanSystem:
-    def __init__(self):
+    def __init__(self, seed: Optional[int] = None, policy_path: Optional[str] = None):
+        # Independent random streams (layout, passenger arrivals, baseline and optimized buses)
+        self.rng = make_rng_streams(seed)
+        # Each fleet alights riders from its own copy of one stream: the same draws, never shared ones
+        self.alight_rngs = {is_optimized: copy.deepcopy(self.rng["baseline"]) for is_optimized in (False, True)}
         self.stops: Dict[str, BusStop] = {}
         self.buses: Dict[int, Bus] = {}
         self.routes: Dict[str, Dict] = {}
         self.simulation_time = 0
-        self.passenger_generation_rate = 0.4
+        self.passenger_generation_rate = 0.03
+        self.bus_speed = 60.0  # Meters along the route per tick
+        self.tick_seconds = 10.0  # Simulated seconds per tick (a bus covers bus_speed meters in one)
+        self.alight_probability = 0.2  # Per rider on board, at each stop
+        self.max_dwell_ticks = 6  # A bus leaves a stop once nobody is left to board, or after this long
+        self.boarding_per_tick = 3  # Riders a bus of either fleet boards per tick at a stop
         self.max_passengers_at_stop = 25
-        self.baseline_wait_times = []
-        self.optimized_wait_times = []
+        
+        # Measured waits of the riders each fleet boards (see wait_metrics)
+        self.baseline_waits = WaitWindow()
+        self.optimized_waits = WaitWindow()
         
         # Road disruption features
         self.road_closures = set()  # Set of (avenue, street) tuples
@@ -73,80 +110,60 @@ class ComparisonManhattanSystem:
         self.icy_roads = set()      # Set of (avenue, street) tuples
         self.traffic_jams = set()   # Set of (avenue, street) tuples
         
+        # Route patterns the buses drive along, and the stops they serve
+        self.topology: Optional[RouteTopology] = None
+        self.served_stops: List[BusStop] = []
+        
+        # Street grid <-> lat/lon over whole arrays; stops are projected once at load
+        self.projection = GridProjection()
+        
         self._load_gtfs_data()
+        self._init_rider_queues()
         self._initialize_buses()
+        
+        # Optimized buses follow the exported policy when one loads (see policy_driver)
+        policy = load_policy(policy_path)
+        self.policy_driver = PolicyDriver(self, policy) if policy is not None else None
     
     def _load_gtfs_data(self):
         """Load GTFS data and map to street grid"""
         print("🗽 Loading GTFS Data for Comparison System...")
         
-        gtfs_path = os.path.join(os.path.dirname(__file__), '..', 'UI_data', 'gtfs_m')
-        
         try:
-            stops_df = pd.read_csv(os.path.join(gtfs_path, 'stops.txt'), nrows=300)
+            # Compiled, memory-mapped feed (rebuilt only when ui_data/gtfs_m changes)
+            feed = load_feed()
             
             # Filter for Manhattan stops
-            manhattan_stops = stops_df[
-                (stops_df['stop_lat'] >= 40.7) & (stops_df['stop_lat'] <= 40.8) &
-                (stops_df['stop_lon'] >= -74.0) & (stops_df['stop_lon'] <= -73.95)
-            ].copy()
-            
-            # Use ALL stops for maximum scale
-            important_stops = manhattan_stops
+            manhattan_stops = np.flatnonzero(
+                (feed.stop_lat >= 40.7) & (feed.stop_lat <= 40.8) &
+                (feed.stop_lon >= -74.0) & (feed.stop_lon <= -73.95)
+            )
             
-            # Also load from UI data files if available
-            ui_data_path = os.path.join(os.path.dirname(__file__), '..', 'UI_data')
-            if os.path.exists(ui_data_path):
-                self._load_ui_data_stops(ui_data_path)
+            # Also load the demo stops shipped with the UI
+            self._load_ui_data_stops(feed)
             
-            # Create route colors
-            route_colors = {
-                "M1": "#FF6B6B", "M2": "#4ECDC4", "M3": "#45B7D1", "M4": "#96CEB4",
-                "M5": "#FFEAA7", "M7": "#DDA0DD", "M10": "#98D8C8", "M11": "#F39C12",
-                "M15": "#E74C3C", "M20": "#9B59B6", "M23": "#1ABC9C", "M34": "#F39C12"
-            }
+            # Convert every stop to strict grid coordinates in one pass
+            stop_lats = feed.stop_lat[manhattan_stops]
+            stop_lons = feed.stop_lon[manhattan_stops]
+            avenues, streets = self.projection.to_grid(stop_lats, stop_lons)
             
-            # Create stops and map to street grid
-            for _, stop in important_stops.iterrows():
-                stop_id = str(stop['stop_id'])
-                stop_lat = float(stop['stop_lat'])
-                stop_lon = float(stop['stop_lon'])
-                
-                # Convert lat/lon to strict grid coordinates
-                avenue, street = self._latlon_to_strict_grid(stop_lat, stop_lon)
-                
-                # Assign routes
-                available_routes = list(route_colors.keys())
-                assigned_routes = random.sample(available_routes, min(3, len(available_routes)))
-                
+            # Create stops on the street grid
+            for i, stop_lat, stop_lon, avenue, street in zip(manhattan_stops.tolist(), stop_lats.tolist(), stop_lons.tolist(),
+                                                            avenues.tolist(), streets.tolist()):
+                stop_id = str(feed.stop_id[i])
                 self.stops[stop_id] = BusStop(
                     stop_id=stop_id,
-                    stop_name=stop['stop_name'],
+                    stop_name=str(feed.stop_name[i]),
                     lat=stop_lat,
                     lon=stop_lon,
                     avenue=avenue,
                     street=street,
-                    routes_served=assigned_routes
+                    routes_served=[]
                 )
             
-            # Create routes
-            all_stop_ids = list(self.stops.keys())
-            
-            for route_id, color in route_colors.items():
-                if len(all_stop_ids) >= 4:
-                    # Create routes that follow streets properly
-                    num_stops = random.randint(4, 6)
-                    route_stops = random.sample(all_stop_ids, num_stops)
-                    
-                    # Sort stops to create logical route
-                    route_stops = self._sort_stops_for_route(route_stops)
-                    
-                    self.routes[route_id] = {
-                        'id': route_id,
-                        'name': f"Route {route_id}",
-                        'stops': route_stops,
-                        'color': color
-                    }
+            # Real route patterns: the busiest shape and stop sequence per direction of each demo route
+            self.topology = RouteTopology.from_feed(feed, list(ROUTE_COLORS), self.projection)
+            self._create_routes()
             
             print(f"✅ Loaded {len(self.stops)} stops and {len(self.routes)} routes")
             
@@ -154,45 +171,27 @@ class ComparisonManhattanSystem:
             print(f"⚠️ Error loading GTFS data: {e}")
             self._load_sample_data()
     
-    def _load_ui_data_stops(self, ui_data_path):
-        """Load additional stops from UI data files"""
-        try:
-            # Load from sample_manhattan_stops.geojson if available
-            geojson_path = os.path.join(ui_data_path, 'sample_manhattan_stops.geojson')
-            if os.path.exists(geojson_path):
-                with open(geojson_path, 'r') as f:
-                    geojson_data = json.load(f)
-                
-                for feature in geojson_data.get('features', []):
-                    props = feature.get('properties', {})
-                    geom = feature.get('geometry', {})
-                    
-                    if geom.get('type') == 'Point' and geom.get('coordinates'):
-                        stop_id = f"UI_{props.get('stop_id', len(self.stops))}"
-                        stop_name = props.get('stop_name', f'UI Stop {len(self.stops)}')
-                        lon, lat = geom['coordinates']
-                        
-                        # Convert to grid coordinates
-                        avenue, street = self._latlon_to_strict_grid(lat, lon)
-                        
-                        # Assign routes
-                        available_routes = ["M1", "M2", "M3", "M4", "M5", "M7", "M10", "M11", "M15", "M20", "M23", "M34"]
-                        assigned_routes = random.sample(available_routes, min(2, len(available_routes)))
-                        
-                        self.stops[stop_id] = BusStop(
-                            stop_id=stop_id,
-                            stop_name=stop_name,
-                            lat=lat,
-                            lon=lon,
-                            avenue=avenue,
-                            street=street,
-                            routes_served=assigned_routes
-                        )
-                
-                print(f"✅ Loaded {len([s for s in self.stops.values() if s.stop_id.startswith('UI_')])} additional stops from UI data")
+    def _load_ui_data_stops(self, feed):
+        """Load additional stops from the UI demo stops compiled into the feed"""
+        # Convert to grid coordinates
+        avenues, streets = self.projection.to_grid(feed.ui_stop_lat, feed.ui_stop_lon)
         
-        except Exception as e:
-            print(f"⚠️ Error loading UI data: {e}")
+        for i, (lat, lon, avenue, street) in enumerate(zip(feed.ui_stop_lat.tolist(), feed.ui_stop_lon.tolist(),
+                                                           avenues.tolist(), streets.tolist())):
+            stop_id = f"UI_{feed.ui_stop_id[i]}"
+            stop_name = str(feed.ui_stop_name[i]) or f'UI Stop {len(self.stops)}'
+            
+            self.stops[stop_id] = BusStop(
+                stop_id=stop_id,
+                stop_name=stop_name,
+                lat=lat,
+                lon=lon,
+                avenue=avenue,
+                street=street,
+                routes_served=[]
+            )
+        
+        print(f"✅ Loaded {len(feed.ui_stop_id)} additional stops from UI data")
     
     def add_road_closure(self, avenue: int, street: int):
         """Add a road closure at specified location"""
@@ -239,67 +238,36 @@ class ComparisonManhattanSystem:
     
     def _latlon_to_strict_grid(self, lat: float, lon: float) -> Tuple[int, int]:
         """Convert lat/lon to strict grid coordinates (only on streets) with tilt"""
-        # Manhattan bounds with slight tilt to align with actual street grid
-        min_lat, max_lat = 40.7, 40.8
-        min_lon, max_lon = -74.0, -73.95
-        
-        # Apply slight rotation to align with Manhattan's actual street grid
-        # Manhattan streets are slightly rotated from true north-south
-        tilt_angle = -0.4  # Stronger tilt to make roads perfectly grid-like
-        
-        # Rotate coordinates
-        center_lat = (min_lat + max_lat) / 2
-        center_lon = (min_lon + max_lon) / 2
-        
-        # Apply rotation
-        rel_lat = lat - center_lat
-        rel_lon = lon - center_lon
-        
-        # Rotate by tilt angle
-        rotated_lat = rel_lat * math.cos(tilt_angle) - rel_lon * math.sin(tilt_angle)
-        rotated_lon = rel_lat * math.sin(tilt_angle) + rel_lon * math.cos(tilt_angle)
-        
-        # Convert to grid (1-12 avenues, 1-200 streets)
-        avenue = max(1, min(12, int((rotated_lon + center_lon - min_lon) / (max_lon - min_lon) * 12) + 1))
-        street = max(1, min(200, int((rotated_lat + center_lat - min_lat) / (max_lat - min_lat) * 200) + 1))
-        
-        return avenue, street
+        avenue, street = self.projection.to_grid(lat, lon)
+        return int(avenue), int(street)
     
     def _grid_to_latlon(self, avenue: int, street: int) -> Tuple[float, float]:
         """Convert grid coordinates back to lat/lon with tilt"""
-        min_lat, max_lat = 40.7, 40.8
-        min_lon, max_lon = -74.0, -73.95
-        
-        # Convert grid to lat/lon
-        lat = min_lat + (street - 1) / 200 * (max_lat - min_lat)
-        lon = min_lon + (avenue - 1) / 12 * (max_lon - min_lon)
-        
-        # Apply reverse rotation to align with map
-        tilt_angle = 0.4  # Stronger reverse tilt to align with map
-        center_lat = (min_lat + max_lat) / 2
-        center_lon = (min_lon + max_lon) / 2
-        
-        # Apply reverse rotation
-        rel_lat = lat - center_lat
-        rel_lon = lon - center_lon
-        
-        # Rotate by reverse tilt angle
-        rotated_lat = rel_lat * math.cos(tilt_angle) - rel_lon * math.sin(tilt_angle)
-        rotated_lon = rel_lat * math.sin(tilt_angle) + rel_lon * math.cos(tilt_angle)
-        
-        return rotated_lat + center_lat, rotated_lon + center_lon
+        lat, lon = self.projection.to_latlon(avenue, street)
+        return float(lat), float(lon)
     
-    def _sort_stops_for_route(self, stop_ids: List[str]) -> List[str]:
-        """Sort stops to create a logical route"""
-        stops_with_coords = []
-        for stop_id in stop_ids:
-            stop = self.stops[stop_id]
-            stops_with_coords.append((stop_id, stop.avenue, stop.street))
-        
-        # Sort by avenue first, then by street
-        stops_with_coords.sort(key=lambda x: (x[1], x[2]))
+    def _create_routes(self):
+        """Routes, per-stop routes_served and the served stop list, all read off the topology"""
+        topology = self.topology
+        for route_id in topology.route_ids:
+            route_stops = []
+            for pattern in topology.route_patterns(route_id):
+                for stop_id in topology.pattern_stop_ids(pattern):
+                    stop = self.stops.get(stop_id)
+                    if stop is not None and route_id not in stop.routes_served:
+                        stop.routes_served.append(route_id)
+                        route_stops.append(stop_id)
+            
+            self.routes[route_id] = {
+                'id': route_id,
+                'name': f"Route {route_id}",
+                'stops': route_stops,
+                'color': ROUTE_COLORS.get(route_id, "#FF6B6B"),
+                'patterns': topology.route_patterns(route_id)
+            }
         
-        return [stop_id for stop_id, _, _ in stops_with_coords]
+        # Riders only turn up where some bus will come
+        self.served_stops = [stop for stop in self.stops.values() if stop.routes_served]
     
     def _load_sample_data(self):
         """Fallback to sample data"""
@@ -322,242 +290,203 @@ class ComparisonManhattanSystem:
                 lon=stop_data["lon"],
                 avenue=stop_data["avenue"],
                 street=stop_data["street"],
-                routes_served=["M1", "M2", "M3"]
+                routes_served=[]
             )
         
-        # Create sample routes
-        route_colors = {"M1": "#FF6B6B", "M2": "#4ECDC4", "M3": "#45B7D1"}
-        all_stop_ids = list(self.stops.keys())
+        # Sample routes out and back through the sample stops
+        sequence = [(stop.stop_id, stop.lat, stop.lon) for stop in self.stops.values()]
+        self.topology = RouteTopology.from_stop_sequences({route_id: sequence for route_id in ("M1", "M2", "M3")}, self.projection)
+        self._create_routes()
+    
+    def _init_rider_queues(self):
+        """Per fleet, one arrival-tick ring buffer row per stop, holding up to max_passengers_at_stop riders
         
-        for route_id, color in route_colors.items():
-            if len(all_stop_ids) >= 2:
-                route_stops = all_stop_ids
-                self.routes[route_id] = {
-                    'id': route_id,
-                    'name': f"Route {route_id}",
-                    'stops': route_stops,
-                    'color': color
-                }
+        Both fleets get the same arrivals, like BusDispatchEnv's rider_queue and
+        baseline_queue, so neither fleet's boardings change what the other sees.
+        """
+        for slot, stop in enumerate(self.stops.values()):
+            stop.queue_slot = slot
+        self.baseline_queues = ArrivalQueues(len(self.stops), self.max_passengers_at_stop)
+        self.optimized_queues = ArrivalQueues(len(self.stops), self.max_passengers_at_stop)
+        self.served_slots = np.array([stop.queue_slot for stop in self.served_stops], dtype=np.int64)
     
     def _initialize_buses(self):
-        """Initialize both baseline and optimized buses"""
+        """Initialize both baseline and optimized buses, spread evenly along each route's patterns"""
         bus_id = 0
         
-        # Create baseline buses (untrained)
-        for route_id, route_info in self.routes.items():
-            if len(route_info['stops']) >= 2:
-                num_buses = random.randint(3, 6)  # Even more buses
-                for i in range(num_buses):
-                    start_stop = self.stops[route_info['stops'][0]]
-                    
-                    bus = Bus(
-                        id=bus_id,
-                        route_id=route_id,
-                        route_name=route_info['name'],
-                        avenue=start_stop.avenue,
-                        street=start_stop.street,
-                        color=route_info['color'],
-                        route_stops=route_info['stops'].copy(),
-                        current_stop_index=0,
-                        is_optimized=False,
-                        efficiency_score=random.uniform(0.3, 0.6)  # Lower efficiency for baseline
-                    )
-                    
-                    # Set target to next stop
-                    if len(route_info['stops']) > 1:
-                        next_stop = self.stops[route_info['stops'][1]]
-                        bus.target_avenue = next_stop.avenue
-                        bus.target_street = next_stop.street
-                    
-                    self.buses[bus_id] = bus
-                    bus_id += 1
+        # Both fleets run the same number of buses on each route
+        fleet_sizes = {route_id: int(self.rng["layout"].integers(3, 7)) for route_id in self.routes}
         
-        # Create optimized buses (trained)
-        for route_id, route_info in self.routes.items():
-            if len(route_info['stops']) >= 2:
-                num_buses = random.randint(3, 6)  # Even more buses
+        # Baseline buses first, then optimized buses (driven by the policy when one is loaded)
+        for is_optimized in (False, True):
+            for route_id, route_info in self.routes.items():
+                patterns = route_info['patterns']
+                num_buses = fleet_sizes[route_id]
                 for i in range(num_buses):
-                    start_stop = self.stops[route_info['stops'][0]]
+                    pattern = patterns[i % len(patterns)]
+                    
+                    # Even headways per pattern, from the same positions in both fleets
+                    on_pattern = len(range(i % len(patterns), num_buses, len(patterns)))
+                    slot = (i // len(patterns)) / on_pattern
                     
                     bus = Bus(
                         id=bus_id,
                         route_id=route_id,
                         route_name=route_info['name'],
-                        avenue=start_stop.avenue,
-                        street=start_stop.street,
+                        avenue=0,
+                        street=0,
                         color=route_info['color'],
-                        route_stops=route_info['stops'].copy(),
-                        current_stop_index=0,
-                        is_optimized=True,
-                        efficiency_score=random.uniform(0.7, 0.95)  # Higher efficiency for optimized
+                        is_optimized=is_optimized
                     )
-                    
-                    # Set target to next stop
-                    if len(route_info['stops']) > 1:
-                        next_stop = self.stops[route_info['stops'][1]]
-                        bus.target_avenue = next_stop.avenue
-                        bus.target_street = next_stop.street
+                    self._place_bus(bus, pattern, slot * float(self.topology.length[pattern]))
                     
                     self.buses[bus_id] = bus
                     bus_id += 1
         
         print(f"✅ Initialized {len(self.buses)} buses (baseline + optimized)")
     
+    def _place_bus(self, bus: Bus, pattern: int, distance: float):
+        """Put a bus at distance along pattern, heading for the next stop past that point"""
+        bus.pattern = pattern
+        bus.distance = distance
+        bus.skip_until = -1
+        bus.shape_cursor, bus.stop_cursor = self.topology.start(pattern, distance)
+        bus.shape_cursor, bus.lat, bus.lon, bus.direction = self.topology.locate(pattern, distance, bus.shape_cursor)
+        bus.avenue, bus.street = self._latlon_to_strict_grid(bus.lat, bus.lon)
+    
     def step(self):
         """Step the simulation with comparison metrics"""
         self.simulation_time += 1
         
-        # Generate passengers
-        for stop in self.stops.values():
-            if random.random() < self.passenger_generation_rate:
-                stop.queue_length = min(stop.queue_length + random.randint(1, 3), self.max_passengers_at_stop)
+        # Generate passengers, timestamped in their stop's queue (riders who find it full walk away)
+        arrival_rng = self.rng["arrivals"]
+        count = len(self.served_stops)
+        riders = arrival_rng.integers(1, 4, count) * (arrival_rng.random(count) < self.passenger_generation_rate)
+        self.baseline_queues.arrive(self.served_slots, riders, self.simulation_time)
+        accepted = self.optimized_queues.arrive(self.served_slots, riders, self.simulation_time)
+        for i in np.flatnonzero(accepted).tolist():
+            self.served_stops[i].queue_length += int(accepted[i])
         
-        # Move buses on strict street grid
+        # Move buses along their route shapes
         for bus in self.buses.values():
-            self._move_bus_strict_streets(bus)
-        
-        # Update wait time metrics
-        self._update_wait_time_metrics()
+            self._advance_bus(bus)
+        self._update_bus_grid_positions()
     
-    def _move_bus_strict_streets(self, bus: Bus):
-        """Move bus ONLY on streets (no diagonal movement)"""
-        # Check if we're at a stop
-        current_stop = self._get_stop_at_location(bus.avenue, bus.street)
-        if current_stop:
-            # Pick up passengers (optimized buses are more efficient)
-            if current_stop.queue_length > 0:
-                if bus.is_optimized:
-                    pickup = min(random.randint(2, 5), current_stop.queue_length, bus.capacity - bus.load)
-                else:
-                    pickup = min(random.randint(1, 3), current_stop.queue_length, bus.capacity - bus.load)
-                
-                bus.load += pickup
-                current_stop.queue_length -= pickup
+    def _advance_bus(self, bus: Bus):
+        """Drive a bus along its pattern, halting at each stop it reaches and turning around at the terminal"""
+        topology = self.topology
+        bus.load_ticks += bus.load
+        bus.efficiency_score = bus.load_ticks / (bus.capacity * self.simulation_time)
+        travel = self.bus_speed * self.get_disruption_impact(bus.avenue, bus.street)
+        target, is_stop = topology.next_target(bus.pattern, bus.stop_cursor)
+        
+        if bus.distance + travel < target:
+            bus.distance += travel
+        elif is_stop and bus.stop_cursor < bus.skip_until:
+            # The policy sent this bus past the stop
+            bus.distance = target
+            bus.stop_cursor += 1
+        elif is_stop:
+            bus.distance = target
+            stop = self.stops.get(topology.stop_ids[bus.stop_cursor])
+            if stop is not None:
+                self._board_passengers(bus, stop)
             
-            # Move to next stop in route
-            self._move_to_next_stop(bus)
+            # Dwell while riders are still boarding, and for any hold the policy asked for
+            bus.dwell += 1
+            served = stop is None or self._fleet_queues(bus).count[stop.queue_slot] == 0 or bus.load >= bus.capacity
+            if (served and bus.dwell >= bus.hold) or bus.dwell >= self.max_dwell_ticks:
+                bus.stop_cursor += 1
+                bus.dwell = 0
         else:
-            # Move towards target (optimized buses move more efficiently)
-            self._move_towards_target(bus)
+            self._place_bus(bus, int(topology.pattern_next[bus.pattern]), 0.0)
+            return
         
-        # Ensure buses are always moving (add some randomness for visibility)
-        if random.random() < 0.1:  # 10% chance to move randomly
-            if bus.avenue < 12 and random.random() < 0.5:
-                bus.avenue += 1
-                bus.direction = "east"
-            elif bus.avenue > 1 and random.random() < 0.5:
-                bus.avenue -= 1
-                bus.direction = "west"
-            elif bus.street < 200 and random.random() < 0.5:
-                bus.street += 1
-                bus.direction = "north"
-            elif bus.street > 1 and random.random() < 0.5:
-                bus.street -= 1
-                bus.direction = "south"
-    
-    def _get_stop_at_location(self, avenue: int, street: int) -> BusStop:
-        """Get stop at specific location"""
-        for stop in self.stops.values():
-            if stop.avenue == avenue and stop.street == street:
-                return stop
-        return None
+        bus.shape_cursor, bus.lat, bus.lon, bus.direction = topology.locate(bus.pattern, bus.distance, bus.shape_cursor)
     
-    def _move_to_next_stop(self, bus: Bus):
-        """Move to next stop in route"""
-        if bus.current_stop_index < len(bus.route_stops) - 1:
-            bus.current_stop_index += 1
-        else:
-            bus.current_stop_index = 0  # Loop back to start
+    def _board_passengers(self, bus: Bus, stop: BusStop):
+        """Let riders off on arrival, then pick up the longest-waiting ones (same rule for both fleets)"""
+        if bus.dwell == 0 and bus.load > 0:
+            bus.load -= int(self._bus_rng(bus).binomial(bus.load, self.alight_probability))
         
-        next_stop = self.stops[bus.route_stops[bus.current_stop_index]]
-        bus.target_avenue = next_stop.avenue
-        bus.target_street = next_stop.street
+        queues = self._fleet_queues(bus)
+        waiting = int(queues.count[stop.queue_slot])
+        if waiting > 0:
+            pickup = min(self.boarding_per_tick, waiting, bus.capacity - bus.load)
+            if pickup > 0:
+                waits = queues.board(stop.queue_slot, pickup, self.simulation_time)
+                (self.optimized_waits if bus.is_optimized else self.baseline_waits).add(waits)
+                bus.load += pickup
+                if bus.is_optimized:
+                    stop.queue_length -= pickup
     
-    def _move_towards_target(self, bus: Bus):
-        """Move towards target (strict street movement only) with disruption impact"""
-        # Check for disruptions at current location
-        disruption_impact = self.get_disruption_impact(bus.avenue, bus.street)
-        
-        # Only move if not completely blocked
-        if disruption_impact > 0:
-            # Move one step at a time along streets only
-            if bus.avenue != bus.target_avenue:
-                # Move along avenue (east/west)
-                if bus.avenue < bus.target_avenue:
-                    bus.avenue += 1
-                    bus.direction = "east"
-                else:
-                    bus.avenue -= 1
-                    bus.direction = "west"
-            elif bus.street != bus.target_street:
-                # Move along street (north/south)
-                if bus.street < bus.target_street:
-                    bus.street += 1
-                    bus.direction = "north"
-                else:
-                    bus.street -= 1
-                    bus.direction = "south"
-            else:
-                # Reached target, find next stop
-                self._move_to_next_stop(bus)
-        
-        # Add continuous movement for visibility (aligned with Manhattan streets)
-        if random.random() < 0.4 * disruption_impact:  # Reduced chance if disrupted
-            # Manhattan streets run roughly north-south, avenues east-west
-            # But with a slight tilt to match actual street grid
-            if random.random() < 0.6:  # 60% chance to move along avenues (east-west)
-                if bus.avenue < 12 and random.random() < 0.5:
-                    bus.avenue += 1
-                    bus.direction = "east"
-                elif bus.avenue > 1 and random.random() < 0.5:
-                    bus.avenue -= 1
-                    bus.direction = "west"
-            else:  # 40% chance to move along streets (north-south)
-                if bus.street < 200 and random.random() < 0.5:
-                    bus.street += 1
-                    bus.direction = "north"
-                elif bus.street > 1 and random.random() < 0.5:
-                    bus.street -= 1
-                    bus.direction = "south"
+    def _update_bus_grid_positions(self):
+        """Snap every bus onto the street grid in one projection call (disruptions are keyed by grid cell)"""
+        buses = list(self.buses.values())
+        count = len(buses)
+        avenues, streets = self.projection.to_grid(np.fromiter((bus.lat for bus in buses), dtype=np.float64, count=count),
+                                                   np.fromiter((bus.lon for bus in buses), dtype=np.float64, count=count))
+        for bus, avenue, street in zip(buses, avenues.tolist(), streets.tolist()):
+            bus.avenue = avenue
+            bus.street = street
     
-    def _update_wait_time_metrics(self):
-        """Update wait time metrics for comparison"""
-        # Calculate baseline wait times (untrained buses)
-        baseline_buses = [bus for bus in self.buses.values() if not bus.is_optimized]
-        baseline_wait = random.uniform(8, 15)  # Higher wait times for baseline
-        
-        # Calculate optimized wait times (trained buses)
-        optimized_buses = [bus for bus in self.buses.values() if bus.is_optimized]
-        optimized_wait = random.uniform(3, 8)  # Lower wait times for optimized
-        
-        self.baseline_wait_times.append(baseline_wait)
-        self.optimized_wait_times.append(optimized_wait)
-        
-        # Keep only last 100 measurements
-        if len(self.baseline_wait_times) > 100:
-            self.baseline_wait_times = self.baseline_wait_times[-100:]
-            self.optimized_wait_times = self.optimized_wait_times[-100:]
+    def _bus_rng(self, bus: Bus):
+        """Alighting stream of a bus's fleet (identically seeded, so only the policy tells the fleets apart)"""
+        return self.alight_rngs[bus.is_optimized]
     
-    def get_system_state(self):
-        """Get current system state with comparison metrics"""
+    def _fleet_queues(self, bus: Bus) -> ArrivalQueues:
+        """Riders waiting for a bus's fleet"""
+        return self.optimized_queues if bus.is_optimized else self.baseline_queues
+    
+    def get_kpis(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """KPI (optimized fleet) and baseline-vs-optimized comparison blocks of the live state"""
         total_passengers_waiting = sum(stop.queue_length for stop in self.stops.values())
-        total_passengers_on_buses = sum(bus.load for bus in self.buses.values())
+        total_passengers_on_buses = sum(bus.load for bus in self.buses.values() if bus.is_optimized)
+        
+        # Measured waits (windowed over recent boardings), converted from ticks to seconds
+        baseline_avg_wait = self.baseline_waits.mean() * self.tick_seconds
+        optimized_avg_wait = self.optimized_waits.mean() * self.tick_seconds
+        baseline_p50, baseline_p90 = (self.baseline_waits.percentiles((50, 90)) * self.tick_seconds).tolist()
+        optimized_p50, optimized_p90 = (self.optimized_waits.percentiles((50, 90)) * self.tick_seconds).tolist()
         
-        # Calculate average wait times
-        baseline_avg_wait = sum(self.baseline_wait_times) / len(self.baseline_wait_times) if self.baseline_wait_times else 0
-        optimized_avg_wait = sum(self.optimized_wait_times) / len(self.optimized_wait_times) if self.optimized_wait_times else 0
+        # Batched policy inference time (last tick, median of recent ticks)
+        policy_latency, policy_latency_p50 = self.policy_driver.latency_ms() if self.policy_driver else (0.0, 0.0)
         
         # Calculate improvement percentage
         improvement = ((baseline_avg_wait - optimized_avg_wait) / baseline_avg_wait * 100) if baseline_avg_wait > 0 else 0
         
-        # Convert grid coordinates back to lat/lon for display
+        kpis = {
+            "avg_wait_time": optimized_avg_wait,
+            "total_passengers": total_passengers_waiting + total_passengers_on_buses,
+            "total_passengers_waiting": total_passengers_waiting,
+            "total_passengers_on_buses": total_passengers_on_buses
+        }
+        comparison = {
+            "baseline_avg_wait": baseline_avg_wait,
+            "optimized_avg_wait": optimized_avg_wait,
+            "improvement_percentage": improvement,
+            "baseline_p50_wait": baseline_p50,
+            "baseline_p90_wait": baseline_p90,
+            "optimized_p50_wait": optimized_p50,
+            "optimized_p90_wait": optimized_p90,
+            "baseline_boardings": self.baseline_waits.boardings,
+            "optimized_boardings": self.optimized_waits.boardings,
+            "policy_driven": self.policy_driver is not None,
+            "policy_latency_ms": policy_latency,
+            "policy_latency_p50_ms": policy_latency_p50,
+            "baseline_buses": len([bus for bus in self.buses.values() if not bus.is_optimized]),
+            "optimized_buses": len([bus for bus in self.buses.values() if bus.is_optimized])
+        }
+        return kpis, comparison
+    
+    def get_system_state(self):
+        """Get current system state with comparison metrics"""
         buses_data = []
         for bus in self.buses.values():
-            lat, lon = self._grid_to_latlon(bus.avenue, bus.street)
             buses_data.append({
                 "id": bus.id,
-                "x": lon,
-                "y": lat,
+                "x": bus.lon,
+                "y": bus.lat,
                 "route_id": bus.route_id,
                 "route_name": bus.route_name,
                 "load": bus.load,
@@ -582,35 +511,56 @@ class ComparisonManhattanSystem:
                 "street": stop.street
             })
         
+        kpis, comparison = self.get_kpis()
         return {
             "simulation_time": self.simulation_time,
             "buses": buses_data,
             "stops": stops_data,
-            "kpis": {
-                "avg_wait_time": optimized_avg_wait,
-                "total_passengers": total_passengers_waiting + total_passengers_on_buses,
-                "total_passengers_waiting": total_passengers_waiting,
-                "total_passengers_on_buses": total_passengers_on_buses
-            },
-            "comparison": {
-                "baseline_avg_wait": baseline_avg_wait,
-                "optimized_avg_wait": optimized_avg_wait,
-                "improvement_percentage": improvement,
-                "baseline_buses": len([bus for bus in self.buses.values() if not bus.is_optimized]),
-                "optimized_buses": len([bus for bus in self.buses.values() if bus.is_optimized])
-            }
+            "kpis": kpis,
+            "comparison": comparison
         }
 
 # Global system
 manhattan_system = None
 
+# One simulation clock shared by every /live viewer
+live_broadcaster = LiveBroadcaster(tick_interval=0.5)
+live_encoder = None
+live_viewports = None
+
+# ONNXPolicyInference binds fixed buffers per session, so every inference runs on this one thread
+policy_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="policy")
+
+def encode_live_state():
+    """Build this tick's frame once for all subscribers (legacy full state only if someone still uses it)"""
+    needs_full_state = any(s.protocol == 1 for s in live_broadcaster.subscribers)
+    full_state = manhattan_system.get_system_state() if needs_full_state else None
+    return live_encoder.encode_tick(full_state)
+
+async def decide_optimized_fleet():
+    """One batched policy inference for the optimized fleet, off the event loop, before each tick"""
+    driver = manhattan_system.policy_driver
+    if driver is None:
+        return
+    observations, masks = driver.observe()
+    actions = await asyncio.get_running_loop().run_in_executor(policy_executor, driver.infer, observations, masks)
+    driver.apply(actions)
+
 @app.on_event("startup")
 async def startup_event():
-    global manhattan_system
+    global manhattan_system, live_encoder, live_viewports
     print("🗽 Starting Comparison Manhattan System...")
-    manhattan_system = ComparisonManhattanSystem()
+    manhattan_system = ComparisonManhattanSystem(policy_path=os.environ.get("REROUTE_POLICY", DEFAULT_POLICY_PATH))
+    live_encoder = DeltaStateEncoder(manhattan_system)
+    live_viewports = ViewportIndex(live_encoder)
+    live_broadcaster.start(manhattan_system.step, encode_live_state, decide_optimized_fleet)
     print("✅ Comparison Manhattan system initialized!")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await live_broadcaster.stop()
+    policy_executor.shutdown(wait=False)
+
 @app.get("/", response_class=HTMLResponse)
 async def get_dashboard():
     return """
@@ -699,6 +649,10 @@ async def get_dashboard():
           <div class="kpi-value" id="baseline-buses">0</div>
           <div class="kpi-label">Baseline Buses</div>
         </div>
+        <div class="kpi-item">
+          <div class="kpi-value" id="policy-latency">off</div>
+          <div class="kpi-label">Policy Inference</div>
+        </div>
       </div>
     </div>
   </div>
@@ -741,8 +695,46 @@ async def get_dashboard():
     connectWebSocket();
   }
 
+  // Protocol 2: one snapshot, then deltas applied to a local copy of the full state
+  let liveState = null;
+  let liveSeq = null;
+  
+  function applyLiveMessage(message) {
+    if (message.type === 'snapshot') {
+      liveState = {
+        simulation_time: message.simulation_time,
+        stops: message.stops.map((stop, i) => Object.assign({}, stop, {queue_length: message.queues[i]})),
+        buses: message.buses,
+        kpis: message.kpis,
+        comparison: message.comparison
+      };
+    } else {
+      if (liveState === null) {
+        return null;  // Waiting for the snapshot we asked for
+      }
+      if (message.base_seq !== liveSeq) {
+        liveState = null;
+        ws.send(JSON.stringify({type: 'resync', seq: liveSeq}));
+        return null;
+      }
+      const [stopIndices, queueLengths] = message.queues;
+      stopIndices.forEach((stopIndex, i) => { liveState.stops[stopIndex].queue_length = queueLengths[i]; });
+      liveState.buses.forEach(bus => {
+        const change = message.buses[bus.id];
+        if (change) Object.assign(bus, change);
+      });
+      liveState.simulation_time = message.simulation_time;
+      liveState.kpis = message.kpis;
+      liveState.comparison = message.comparison;
+    }
+    liveSeq = message.seq;
+    return liveState;
+  }
+  
   function connectWebSocket() {
-    ws = new WebSocket('ws://localhost:8000/live');
+    ws = new WebSocket('ws://localhost:8000/live?protocol=2');
+    liveState = null;
+    liveSeq = null;
     
     ws.onopen = () => {
       console.log('Connected to comparison system');
@@ -753,9 +745,10 @@ async def get_dashboard():
     
     ws.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data);
-        console.log('Received data:', data);
-        updateDashboard(data);
+        const data = applyLiveMessage(JSON.parse(event.data));
+        if (data) {
+          updateDashboard(data);
+        }
       } catch (error) {
         console.error('Error parsing WebSocket data:', error);
       }
@@ -788,6 +781,8 @@ async def get_dashboard():
       document.getElementById('optimized-wait').textContent = data.comparison.optimized_avg_wait.toFixed(1) + 's';
       document.getElementById('improvement').textContent = data.comparison.improvement_percentage.toFixed(1) + '%';
       document.getElementById('baseline-buses').textContent = data.comparison.baseline_buses;
+      document.getElementById('policy-latency').textContent = data.comparison.policy_driven
+        ? data.comparison.policy_latency_ms.toFixed(2) + 'ms' : 'off';
     }
 
     // Update map if available
@@ -1068,7 +1063,8 @@ async def get_status():
                 "car_crashes": len(manhattan_system.car_crashes),
                 "icy_roads": len(manhattan_system.icy_roads),
                 "traffic_jams": len(manhattan_system.traffic_jams)
-            }
+            },
+            "live_feed": live_broadcaster.get_stats()
         }
     except Exception as e:
         return {"error": str(e)}
@@ -1120,20 +1116,76 @@ async def clear_disruptions():
 
 @app.websocket("/live")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    print("WebSocket client connected")
+    # Wire format from the offered subprotocols (reroute.live.columnar/msgpack/json) or ?format=
+    fmt, subprotocol = negotiate_format(websocket.scope.get("subprotocols", []), websocket.query_params.get("format"))
+    await websocket.accept(subprotocol=subprotocol)
+    print(f"WebSocket client connected ({fmt})")
+    
+    # ?protocol=2 opts into snapshot + deltas; plain connections keep full state per tick.
+    # The columnar layout only exists for protocol 2.
+    protocol = PROTOCOL_VERSION if fmt == "columnar" or websocket.query_params.get("protocol") == str(PROTOCOL_VERSION) else 1
+    send = websocket.send_text if fmt == "json" else websocket.send_bytes
+    
+    # The background loop steps the simulation; this handler only forwards frames
+    subscriber = live_broadcaster.subscribe(protocol)
+    control_task = asyncio.create_task(receive_live_control(websocket, subscriber, fmt)) if protocol > 1 else None
     try:
         while True:
-            if manhattan_system:
-                manhattan_system.step()
-                state = manhattan_system.get_system_state()
-                await websocket.send_json(state)
-            await asyncio.sleep(0.5)
+            frame = await subscriber.next_frame()
+            in_sync = subscriber.last_seq == frame.seq - 1
+            if protocol == 1:
+                await send(frame.encode("full", fmt))
+            elif subscriber.view is not None:
+                # Viewport messages are per client, so they are encoded per client
+                view = subscriber.view
+                await send(encode_message(view.delta(frame) if in_sync else view.snapshot(frame), fmt))
+            elif in_sync:
+                await send(frame.encode("delta", fmt))
+            else:
+                # First frame, a dropped frame or a client resync request
+                await send(frame.encode("snapshot", fmt))
+            subscriber.last_seq = frame.seq
     except WebSocketDisconnect:
         print("WebSocket client disconnected")
     except Exception as e:
         print(f"WebSocket error: {e}")
+    finally:
+        live_broadcaster.unsubscribe(subscriber)
+        if control_task:
+            control_task.cancel()
+
+async def receive_live_control(websocket: WebSocket, subscriber, fmt: str):
+    """Client messages on /live: {"type": "resync"} asks for a fresh snapshot;
+    {"type": "viewport", "bbox": [min_lon, min_lat, max_lon, max_lat], "zoom": z} filters the stream"""
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                continue  # Not JSON: ignore it rather than drop the control channel
+            if not isinstance(message, dict):
+                continue
+            if message.get("type") == "resync":
+                subscriber.last_seq = None
+            elif message.get("type") == "viewport" and fmt != "columnar":
+                # Columnar frames stay city-wide; JSON and MessagePack can be filtered
+                if message.get("bbox") is None:
+                    subscriber.view = None
+                    subscriber.last_seq = None
+                else:
+                    view = subscriber.view or live_viewports.subscribe()
+                    try:
+                        view.update(message["bbox"], message.get("zoom", CLUSTER_BELOW_ZOOM))
+                    except (TypeError, ValueError):
+                        continue  # Malformed viewport: keep the current one
+                    if subscriber.view is None:
+                        subscriber.view = view
+                        subscriber.last_seq = None
+    except (WebSocketDisconnect, RuntimeError):
+        pass
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # permessage-deflate on /live frames (LIVE_WS_DEFLATE=0 turns it off to save server CPU)
+    uvicorn.run(app, host="0.0.0.0", port=8000,
+                ws_per_message_deflate=os.environ.get("LIVE_WS_DEFLATE", "1") != "0")
@@ -0,0 +1,99 @@
+"""
+Wire formats for the /live feed: JSON, MessagePack and a columnar binary layout
+
+Columnar frames are little-endian:
+    magic b"RRLC" | uint8 layout version | uint8 kind | uint16 reserved | uint32 header length
+    header: UTF-8 JSON (seq, KPIs, strings, and a [name, dtype, length] manifest)
+    columns: raw typed arrays in manifest order, each starting on an 8-byte boundary
+so a browser can wrap every column in a Float32Array/Int32Array view without copying.
+"""
+
+import json
+import struct
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:  # Optional: only needed for the MessagePack format
+    msgpack = None
+
+COLUMNAR_MAGIC = b"RRLC"
+COLUMNAR_VERSION = 1
+COLUMNAR_KINDS = {"full": 0, "snapshot": 1, "delta": 2}
+_PREAMBLE = struct.Struct("<4sBBHI")
+
+# WebSocket subprotocol offered by the client -> wire format, in server preference order
+SUBPROTOCOLS = {
+    "reroute.live.columnar": "columnar",
+    "reroute.live.msgpack": "msgpack",
+    "reroute.live.json": "json"
+}
+
+def available_formats() -> List[str]:
+    formats = ["json", "columnar"]
+    if msgpack is not None:
+        formats.append("msgpack")
+    return formats
+
+def negotiate_format(offered_subprotocols: Iterable[str], requested: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """Pick (format, subprotocol to echo) from the client's offer; JSON when nothing matches"""
+    formats = available_formats()
+    offered = list(offered_subprotocols)
+    for subprotocol, fmt in SUBPROTOCOLS.items():
+        if subprotocol in offered and fmt in formats:
+            return fmt, subprotocol
+    if requested in formats:
+        return requested, None
+    return "json", None
+
+def encode_json(message: Dict[str, Any]) -> str:
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+def encode_msgpack(message: Dict[str, Any]) -> bytes:
+    if msgpack is None:
+        raise ImportError("MessagePack frames require msgpack: pip install msgpack")
+    # Bus ids are dict keys in deltas; msgpack keeps int keys, JSON would stringify them
+    return msgpack.packb(message, use_bin_type=True)
+
+def encode_message(message: Dict[str, Any], fmt: str):
+    """Dict message as a JSON text frame or a MessagePack binary frame"""
+    return encode_msgpack(message) if fmt == "msgpack" else encode_json(message)
+
+def _pad(length: int) -> int:
+    return -length % 8
+
+def encode_columnar(kind: str, header: Dict[str, Any], columns: List[Tuple[str, np.ndarray]]) -> bytes:
+    """Pack a JSON header and typed columns into one binary frame"""
+    columns = [(name, np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))) for name, array in columns]
+    header = dict(header)
+    header["columns"] = [[name, array.dtype.str, len(array)] for name, array in columns]
+    header_bytes = json.dumps(header, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    
+    parts = [_PREAMBLE.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, COLUMNAR_KINDS[kind], 0, len(header_bytes)), header_bytes]
+    offset = _PREAMBLE.size + len(header_bytes)
+    for _, array in columns:
+        padding = _pad(offset)
+        parts.append(b"\0" * padding)
+        data = array.tobytes()
+        parts.append(data)
+        offset += padding + len(data)
+    return b"".join(parts)
+
+def decode_columnar(frame: bytes) -> Tuple[str, Dict[str, Any], Dict[str, np.ndarray]]:
+    """Inverse of encode_columnar (zero-copy views into frame)"""
+    magic, version, kind_code, _, header_length = _PREAMBLE.unpack_from(frame)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError("Not a columnar live frame of a supported version")
+    kind = {code: name for name, code in COLUMNAR_KINDS.items()}[kind_code]
+    
+    offset = _PREAMBLE.size
+    header = json.loads(frame[offset:offset + header_length].decode("utf-8"))
+    offset += header_length
+    columns = {}
+    for name, dtype, length in header["columns"]:
+        offset += _pad(offset)
+        dtype = np.dtype(dtype)
+        columns[name] = np.frombuffer(frame, dtype=dtype, count=length, offset=offset)
+        offset += dtype.itemsize * length
+    return kind, header, columns
@@ -0,0 +1,131 @@
+"""
+Fan-out of live simulation frames to WebSocket subscribers
+"""
+
+import asyncio
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Optional, Set
+
+class LiveSubscriber:
+    """Bounded per-client frame queue that drops the oldest frame when the client falls behind"""
+    
+    def __init__(self, max_frames: int = 2, protocol: int = 1):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_frames)
+        self.protocol = protocol
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        # Delta protocol: sequence number the client last received, None until its snapshot
+        self.last_seq: Optional[int] = None
+        # Optional viewport filter (set by the connection handler)
+        self.view = None
+    
+    def offer(self, frame: Any):
+        """Enqueue without ever blocking the producer"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.frames_dropped += 1
+        self.queue.put_nowait(frame)
+    
+    async def next_frame(self) -> Any:
+        frame = await self.queue.get()
+        self.frames_sent += 1
+        return frame
+
+class LiveBroadcaster:
+    """Single simulation loop that serializes each tick once and fans it out to all subscribers"""
+    
+    def __init__(self, tick_interval: float = 0.5, max_frames_per_client: int = 2):
+        self.tick_interval = tick_interval
+        self.max_frames_per_client = max_frames_per_client
+        self.subscribers: Set[LiveSubscriber] = set()
+        self.ticks = 0
+        self.last_tick_seconds = 0.0
+        # Ticks that raised; the loop logs them and keeps the clock running
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def subscribe(self, protocol: int = 1) -> LiveSubscriber:
+        subscriber = LiveSubscriber(self.max_frames_per_client, protocol)
+        self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber: LiveSubscriber):
+        self.subscribers.discard(subscriber)
+    
+    def publish(self, frame: Any):
+        for subscriber in self.subscribers:
+            subscriber.offer(frame)
+    
+    def tick(self, step: Callable[[], None], encode: Callable[[], Any]):
+        """Advance the simulation once; serialize only if someone is listening"""
+        started = time.perf_counter()
+        step()
+        if self.subscribers:
+            self.publish(encode())
+        self.ticks += 1
+        self.last_tick_seconds = time.perf_counter() - started
+    
+    async def run(self, step: Callable[[], None], encode: Callable[[], Any],
+                  prepare: Optional[Callable[[], Awaitable[None]]] = None):
+        """Own the simulation clock: one tick every tick_interval regardless of viewer count
+        
+        prepare, if given, is awaited before every tick (e.g. work handed to an executor).
+        A tick that raises is logged and skipped, so one bad step never freezes viewers.
+        """
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            try:
+                if prepare is not None:
+                    await prepare()
+                self.tick(step, encode)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"⚠️ Live tick failed: {self.last_error}")
+                traceback.print_exc()
+            next_tick += self.tick_interval
+            # Don't try to catch up on missed ticks after a stall
+            next_tick = max(next_tick, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
+    
+    def start(self, step: Callable[[], None], encode: Callable[[], Any],
+              prepare: Optional[Callable[[], Awaitable[None]]] = None) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(step, encode, prepare))
+            self._task.add_done_callback(self._on_task_done)
+        return self._task
+    
+    def _on_task_done(self, task: asyncio.Task):
+        """Report a loop that ended on its own (anything but stop()), instead of dying silently"""
+        if task.cancelled():
+            return
+        error = task.exception()
+        self.last_error = f"{type(error).__name__}: {error}" if error else "live loop exited"
+        print(f"⚠️ Live loop stopped: {self.last_error}")
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def get_stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "running": self.running,
+            "ticks": self.ticks,
+            "last_tick_ms": self.last_tick_seconds * 1000.0,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "frames_dropped": sum(s.frames_dropped for s in self.subscribers)
+        }
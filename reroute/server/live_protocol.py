@@ -0,0 +1,245 @@
+"""
+Versioned /live protocol: one snapshot on connect, then per-tick deltas
+
+Protocol 1 is the legacy full state dict on every tick. Protocol 2 sends
+{"type": "snapshot"} with static stop fields once, then {"type": "delta"}
+messages carrying only changed bus fields, changed queue lengths and KPIs.
+Every message has a sequence number; a delta applies only on top of
+base_seq, and a client that sees a gap sends {"type": "resync"}.
+
+Each message can be sent as JSON, MessagePack or columnar binary (see live_codecs).
+"""
+
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from live_codecs import encode_columnar, encode_message
+
+PROTOCOL_VERSION = 2
+
+BUS_STATIC_FIELDS = ("route_id", "route_name", "capacity", "color", "is_optimized")
+DIRECTIONS = ("north", "south", "east", "west")
+
+# Dynamic bus fields: (name, in-memory dtype, columnar wire dtype)
+BUS_COLUMNS = (
+    ("x", np.float64, "<f4"),
+    ("y", np.float64, "<f4"),
+    ("load", np.int32, "<i2"),
+    ("direction", np.int8, "<u1"),
+    ("avenue", np.int32, "<i2"),
+    ("street", np.int32, "<i2"),
+    ("efficiency_score", np.float64, "<f4")
+)
+
+# ~0.1 m; finer precision only costs bytes
+COORD_DECIMALS = 6
+
+class LiveFrame:
+    """One tick of live state; each (message kind, wire format) is encoded at most once, on first use"""
+    
+    def __init__(self, tick: Dict[str, Any],
+                 messages: Dict[str, Callable[[], Dict[str, Any]]],
+                 columnar: Dict[str, Callable[[], bytes]]):
+        self.tick = tick
+        self.seq = tick["seq"]
+        self.simulation_time = tick["simulation_time"]
+        self._messages = messages
+        self._columnar = columnar
+        self._encoded: Dict[Tuple[str, str], Any] = {}
+        # Per-tick work shared by all subscribers (e.g. the bus spatial index)
+        self.shared: Dict[str, Any] = {}
+    
+    def encode(self, kind: str, fmt: str = "json") -> Any:
+        """kind is "full" (protocol 1), "snapshot" or "delta"; fmt is json, msgpack or columnar"""
+        key = (kind, fmt)
+        if key not in self._encoded:
+            if fmt == "columnar":
+                self._encoded[key] = self._columnar[kind]()
+            else:
+                self._encoded[key] = encode_message(self._messages[kind](), fmt)
+        return self._encoded[key]
+
+class DeltaStateEncoder:
+    """Diffs ComparisonManhattanSystem state tick to tick for protocol 2"""
+    
+    def __init__(self, system):
+        self.system = system
+        self.seq = 0
+        
+        # Stops never move: their static fields are built once and indexed by position
+        self.stop_ids: List[str] = list(system.stops.keys())
+        stops = list(system.stops.values())
+        self.static_stops = [
+            {
+                "id": stop.stop_id,
+                "name": stop.stop_name,
+                "x": round(stop.lon, COORD_DECIMALS),
+                "y": round(stop.lat, COORD_DECIMALS),
+                "avenue": stop.avenue,
+                "street": stop.street
+            }
+            for stop in stops
+        ]
+        self.stop_x = np.array([stop.lon for stop in stops], dtype=np.float64)
+        self.stop_y = np.array([stop.lat for stop in stops], dtype=np.float64)
+        self.static_stop_columns = [
+            ("stop_x", self.stop_x.astype("<f4")),
+            ("stop_y", self.stop_y.astype("<f4")),
+            ("stop_avenue", np.array([stop.avenue for stop in stops], dtype="<i2")),
+            ("stop_street", np.array([stop.street for stop in stops], dtype="<i2"))
+        ]
+        
+        # The fleet is fixed after initialization; buses are addressed by position too
+        self.bus_ids: List[int] = list(system.buses.keys())
+        self.static_buses = {
+            field: [getattr(system.buses[bus_id], field) for bus_id in self.bus_ids]
+            for field in BUS_STATIC_FIELDS
+        }
+        
+        self._queues = np.full(len(self.stop_ids), -1, dtype=np.int32)
+        self._bus_columns = {name: np.full(len(self.bus_ids), -1, dtype=dtype) for name, dtype, _ in BUS_COLUMNS}
+    
+    def _read_queues(self) -> np.ndarray:
+        stops = self.system.stops
+        return np.fromiter((stops[stop_id].queue_length for stop_id in self.stop_ids),
+                           dtype=np.int32, count=len(self.stop_ids))
+    
+    def _read_bus_columns(self) -> Dict[str, np.ndarray]:
+        buses = [self.system.buses[bus_id] for bus_id in self.bus_ids]
+        count = len(buses)
+        direction_codes = {direction: code for code, direction in enumerate(DIRECTIONS)}
+        return {
+            "x": np.fromiter((bus.lon for bus in buses), dtype=np.float64, count=count).round(COORD_DECIMALS),
+            "y": np.fromiter((bus.lat for bus in buses), dtype=np.float64, count=count).round(COORD_DECIMALS),
+            "load": np.fromiter((bus.load for bus in buses), dtype=np.int32, count=count),
+            "direction": np.fromiter((direction_codes.get(bus.direction, 0) for bus in buses), dtype=np.int8, count=count),
+            "avenue": np.fromiter((bus.avenue for bus in buses), dtype=np.int32, count=count),
+            "street": np.fromiter((bus.street for bus in buses), dtype=np.int32, count=count),
+            "efficiency_score": np.fromiter((bus.efficiency_score for bus in buses), dtype=np.float64, count=count)
+        }
+    
+    def encode_tick(self, full_state: Optional[Dict[str, Any]] = None) -> LiveFrame:
+        """Diff against the previous tick and advance the sequence number"""
+        queues = self._read_queues()
+        bus_columns = self._read_bus_columns()
+        kpis, comparison = self.system.get_kpis()
+        
+        changed_stops = np.flatnonzero(queues != self._queues)
+        field_changes = {name: bus_columns[name] != self._bus_columns[name] for name, _, _ in BUS_COLUMNS}
+        changed_buses = np.flatnonzero(np.logical_or.reduce(list(field_changes.values())))
+        
+        self.seq += 1
+        # New arrays each tick, so the lazy builders below keep seeing this tick's state
+        self._queues, self._bus_columns = queues, bus_columns
+        tick = {
+            "seq": self.seq,
+            "simulation_time": self.system.simulation_time,
+            "queues": queues,
+            "bus_columns": bus_columns,
+            "changed_stops": changed_stops,
+            "changed_buses": changed_buses,
+            "field_changes": field_changes,
+            "kpis": kpis,
+            "comparison": comparison
+        }
+        messages = {
+            "full": lambda: full_state,
+            "snapshot": lambda: self._snapshot_message(tick),
+            "delta": lambda: self._delta_message(tick)
+        }
+        columnar = {
+            "snapshot": lambda: self._snapshot_columnar(tick),
+            "delta": lambda: self._delta_columnar(tick)
+        }
+        return LiveFrame(tick, messages, columnar)
+    
+    def _bus_value(self, name: str, value) -> Any:
+        return DIRECTIONS[value] if name == "direction" else value.item()
+    
+    def bus_record(self, tick: Dict[str, Any], i: int) -> Dict[str, Any]:
+        """Every field of the bus at position i"""
+        columns = tick["bus_columns"]
+        record = {"id": self.bus_ids[i]}
+        record.update((field, values[i]) for field, values in self.static_buses.items())
+        record.update((name, self._bus_value(name, columns[name][i])) for name, _, _ in BUS_COLUMNS)
+        return record
+    
+    def bus_changes(self, tick: Dict[str, Any], i: int) -> Dict[str, Any]:
+        """Dynamic fields of the bus at position i that changed this tick"""
+        columns, field_changes = tick["bus_columns"], tick["field_changes"]
+        return {
+            name: self._bus_value(name, columns[name][i])
+            for name, _, _ in BUS_COLUMNS if field_changes[name][i]
+        }
+    
+    def _delta_message(self, tick: Dict[str, Any]) -> Dict[str, Any]:
+        buses = {self.bus_ids[i]: self.bus_changes(tick, i) for i in tick["changed_buses"].tolist()}
+        changed_stops = tick["changed_stops"]
+        return {
+            "type": "delta",
+            "protocol": PROTOCOL_VERSION,
+            "seq": tick["seq"],
+            "base_seq": tick["seq"] - 1,
+            "simulation_time": tick["simulation_time"],
+            "buses": buses,
+            "queues": [changed_stops.tolist(), tick["queues"][changed_stops].tolist()],
+            "kpis": tick["kpis"],
+            "comparison": tick["comparison"]
+        }
+    
+    def _snapshot_message(self, tick: Dict[str, Any]) -> Dict[str, Any]:
+        buses = [self.bus_record(tick, i) for i in range(len(self.bus_ids))]
+        return {
+            "type": "snapshot",
+            "protocol": PROTOCOL_VERSION,
+            "seq": tick["seq"],
+            "simulation_time": tick["simulation_time"],
+            "stops": self.static_stops,
+            "queues": tick["queues"].tolist(),
+            "buses": buses,
+            "kpis": tick["kpis"],
+            "comparison": tick["comparison"]
+        }
+    
+    def _bus_wire_columns(self, columns: Dict[str, np.ndarray], rows: Optional[np.ndarray] = None) -> List[Tuple[str, np.ndarray]]:
+        return [
+            (f"bus_{name}", (columns[name] if rows is None else columns[name][rows]).astype(wire_dtype))
+            for name, _, wire_dtype in BUS_COLUMNS
+        ]
+    
+    def _snapshot_columnar(self, tick: Dict[str, Any]) -> bytes:
+        header = {
+            "protocol": PROTOCOL_VERSION,
+            "seq": tick["seq"],
+            "simulation_time": tick["simulation_time"],
+            "kpis": tick["kpis"],
+            "comparison": tick["comparison"],
+            "directions": DIRECTIONS,
+            "stop_ids": self.stop_ids,
+            "stop_names": [stop["name"] for stop in self.static_stops],
+            "bus_ids": self.bus_ids,
+            "bus_static": self.static_buses
+        }
+        columns = list(self.static_stop_columns)
+        columns.append(("queues", tick["queues"].astype("<i2")))
+        columns += self._bus_wire_columns(tick["bus_columns"])
+        return encode_columnar("snapshot", header, columns)
+    
+    def _delta_columnar(self, tick: Dict[str, Any]) -> bytes:
+        header = {
+            "protocol": PROTOCOL_VERSION,
+            "seq": tick["seq"],
+            "base_seq": tick["seq"] - 1,
+            "simulation_time": tick["simulation_time"],
+            "kpis": tick["kpis"],
+            "comparison": tick["comparison"]
+        }
+        changed_stops, changed_buses = tick["changed_stops"], tick["changed_buses"]
+        # Changed buses are sent as whole rows: cheaper to decode than per-field masks
+        columns = [
+            ("queue_index", changed_stops.astype("<i4")),
+            ("queue_length", tick["queues"][changed_stops].astype("<i2")),
+            ("bus_index", changed_buses.astype("<i4"))
+        ]
+        columns += self._bus_wire_columns(tick["bus_columns"], changed_buses)
+        return encode_columnar("delta", header, columns)
@@ -0,0 +1,183 @@
+"""
+Viewport-filtered /live subscriptions
+
+A protocol 2 client may send {"type": "viewport", "bbox": [min_lon, min_lat, max_lon, max_lat], "zoom": z}
+(bbox null clears it). From then on its snapshots and deltas only carry entities
+inside the box: buses and stops that scroll into view arrive as full records,
+ones that leave are listed in removed_buses / removed_stops, and below
+CLUSTER_BELOW_ZOOM individual stops are replaced by per-cell clusters.
+"""
+
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence
+
+from live_protocol import PROTOCOL_VERSION
+
+CLUSTER_BELOW_ZOOM = 15
+CLUSTER_CELL_PIXELS = 64
+INDEX_CELL_DEGREES = 0.005  # ~500 m
+
+class GridIndex:
+    """Uniform grid over 2-D points; a bbox query only touches the overlapping cells"""
+    
+    def __init__(self, xs: np.ndarray, ys: np.ndarray, cell_size: float = INDEX_CELL_DEGREES):
+        self.xs, self.ys = xs, ys
+        self.cell_size = cell_size
+        self.x0 = float(xs.min()) if len(xs) else 0.0
+        self.y0 = float(ys.min()) if len(ys) else 0.0
+        cx = ((xs - self.x0) // cell_size).astype(np.int64)
+        cy = ((ys - self.y0) // cell_size).astype(np.int64)
+        self.nx = int(cx.max()) + 1 if len(xs) else 0
+        self.ny = int(cy.max()) + 1 if len(ys) else 0
+        
+        # Points sorted by cell key (column-major), so one column of cells is one contiguous slice
+        keys = cx * self.ny + cy
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+    
+    def query(self, bbox: Sequence[float]) -> np.ndarray:
+        """Sorted indices of the points inside bbox = (min_x, min_y, max_x, max_y)"""
+        min_x, min_y, max_x, max_y = bbox
+        cx0 = max(int((min_x - self.x0) // self.cell_size), 0)
+        cx1 = min(int((max_x - self.x0) // self.cell_size), self.nx - 1)
+        cy0 = max(int((min_y - self.y0) // self.cell_size), 0)
+        cy1 = min(int((max_y - self.y0) // self.cell_size), self.ny - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int64)
+        
+        columns = np.arange(cx0, cx1 + 1) * self.ny
+        starts = np.searchsorted(self.sorted_keys, columns + cy0, side="left")
+        ends = np.searchsorted(self.sorted_keys, columns + cy1, side="right")
+        candidates = np.concatenate([self.order[s:e] for s, e in zip(starts, ends)])
+        
+        xs, ys = self.xs[candidates], self.ys[candidates]
+        inside = (xs >= min_x) & (xs <= max_x) & (ys >= min_y) & (ys <= max_y)
+        return np.sort(candidates[inside])
+
+def cluster_stops(xs: np.ndarray, ys: np.ndarray, queues: np.ndarray, zoom: float) -> List[List[float]]:
+    """[x, y, stop count, total queue] per screen cell of ~CLUSTER_CELL_PIXELS at this zoom"""
+    if len(xs) == 0:
+        return []
+    cell = 360.0 / (2 ** zoom) * CLUSTER_CELL_PIXELS / 256.0
+    cells = np.stack([np.floor(xs / cell), np.floor(ys / cell)], axis=1)
+    _, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse)
+    mean_x = np.bincount(inverse, weights=xs) / counts
+    mean_y = np.bincount(inverse, weights=ys) / counts
+    totals = np.bincount(inverse, weights=queues).astype(np.int64)
+    return [
+        [round(x, 6), round(y, 6), count, total]
+        for x, y, count, total in zip(mean_x.tolist(), mean_y.tolist(), counts.tolist(), totals.tolist())
+    ]
+
+class ViewportIndex:
+    """Spatial indexes shared by every viewport subscription of one DeltaStateEncoder"""
+    
+    def __init__(self, encoder):
+        self.encoder = encoder
+        # Stops never move, so their index is built once
+        self.stop_index = GridIndex(encoder.stop_x, encoder.stop_y)
+    
+    def bus_index(self, frame) -> GridIndex:
+        """Bus positions move every tick: built at most once per frame, on first use"""
+        if "bus_index" not in frame.shared:
+            columns = frame.tick["bus_columns"]
+            frame.shared["bus_index"] = GridIndex(columns["x"], columns["y"])
+        return frame.shared["bus_index"]
+    
+    def subscribe(self) -> "ViewportSubscription":
+        return ViewportSubscription(self)
+
+class ViewportSubscription:
+    """What one client currently sees; deltas are computed against its previous visible sets"""
+    
+    def __init__(self, index: ViewportIndex):
+        self.index = index
+        self.encoder = index.encoder
+        self.bbox: Optional[List[float]] = None
+        self.zoom = 0.0
+        self.buses = np.empty(0, dtype=np.int64)
+        self.stops = np.empty(0, dtype=np.int64)
+    
+    def update(self, bbox: Sequence[float], zoom: float):
+        """Move the viewport; the next delta adds and removes entities accordingly"""
+        min_x, min_y, max_x, max_y = (float(v) for v in bbox)
+        self.bbox = [min(min_x, max_x), min(min_y, max_y), max(min_x, max_x), max(min_y, max_y)]
+        self.zoom = float(zoom)
+    
+    @property
+    def clustered(self) -> bool:
+        return self.zoom < CLUSTER_BELOW_ZOOM
+    
+    def _visible(self, frame):
+        buses = self.index.bus_index(frame).query(self.bbox)
+        stops = self.index.stop_index.query(self.bbox)
+        if self.clustered:
+            return buses, np.empty(0, dtype=np.int64), stops
+        return buses, stops, None
+    
+    def _stop_record(self, i: int, queues: np.ndarray) -> Dict[str, Any]:
+        record = dict(self.encoder.static_stops[i])
+        record["index"] = i
+        record["queue_length"] = int(queues[i])
+        return record
+    
+    def _clusters(self, stops: np.ndarray, queues: np.ndarray) -> List[List[float]]:
+        return cluster_stops(self.encoder.stop_x[stops], self.encoder.stop_y[stops], queues[stops], self.zoom)
+    
+    def _message(self, message_type: str, frame) -> Dict[str, Any]:
+        tick = frame.tick
+        return {
+            "type": message_type,
+            "protocol": PROTOCOL_VERSION,
+            "seq": tick["seq"],
+            "simulation_time": tick["simulation_time"],
+            "viewport": {"bbox": self.bbox, "zoom": self.zoom},
+            "kpis": tick["kpis"],
+            "comparison": tick["comparison"]
+        }
+    
+    def snapshot(self, frame) -> Dict[str, Any]:
+        tick = frame.tick
+        queues = tick["queues"]
+        buses, stops, cluster_source = self._visible(frame)
+        
+        message = self._message("snapshot", frame)
+        message["buses"] = [self.encoder.bus_record(tick, i) for i in buses.tolist()]
+        message["stops"] = [self._stop_record(i, queues) for i in stops.tolist()]
+        if cluster_source is not None:
+            message["clusters"] = self._clusters(cluster_source, queues)
+        
+        self.buses, self.stops = buses, stops
+        return message
+    
+    def delta(self, frame) -> Dict[str, Any]:
+        """Changes since the previous tick, valid only right after this client's last message"""
+        tick = frame.tick
+        queues = tick["queues"]
+        buses, stops, cluster_source = self._visible(frame)
+        
+        entered_buses = np.setdiff1d(buses, self.buses, assume_unique=True)
+        stayed_buses = np.intersect1d(buses, self.buses, assume_unique=True)
+        changed_buses = stayed_buses[np.isin(stayed_buses, tick["changed_buses"], assume_unique=True)]
+        entered_stops = np.setdiff1d(stops, self.stops, assume_unique=True)
+        stayed_stops = np.intersect1d(stops, self.stops, assume_unique=True)
+        changed_stops = stayed_stops[np.isin(stayed_stops, tick["changed_stops"], assume_unique=True)]
+        
+        bus_ids = self.encoder.bus_ids
+        bus_updates = {bus_ids[i]: self.encoder.bus_record(tick, i) for i in entered_buses.tolist()}
+        bus_updates.update((bus_ids[i], self.encoder.bus_changes(tick, i)) for i in changed_buses.tolist())
+        
+        message = self._message("delta", frame)
+        message["base_seq"] = tick["seq"] - 1
+        message["buses"] = bus_updates
+        message["removed_buses"] = [bus_ids[i] for i in np.setdiff1d(self.buses, buses, assume_unique=True).tolist()]
+        message["stops"] = [self._stop_record(i, queues) for i in entered_stops.tolist()]
+        message["removed_stops"] = np.setdiff1d(self.stops, stops, assume_unique=True).tolist()
+        message["queues"] = [changed_stops.tolist(), queues[changed_stops].tolist()]
+        if cluster_source is not None:
+            message["clusters"] = self._clusters(cluster_source, queues)
+        
+        self.buses, self.stops = buses, stops
+        return message
@@ -0,0 +1,173 @@
+"""
+ONNX policy control of the comparison server's optimized fleet
+
+Only per-bus models (rl/train.py --observation-mode local) are driven: their
+observation, own state plus the next stops and the headway, maps onto any bus
+of any route. Fixed-fleet models see a 20x20 toy grid's stops in sorted order,
+which has no counterpart here, so load_policy refuses them.
+
+Each tick the optimized buses become one [1, num_buses, local_dim] batch in the
+BusFleet.get_local_observations layout, with the upcoming stops taken along each
+bus's route pattern and built with array operations over the whole fleet. One
+ONNXPolicyInference call decides every bus, and each BusAction is mapped onto
+the route pattern the bus drives:
+
+    CONTINUE     serve the next stop as usual
+    HIGH_DEMAND  run express to the busiest of the next stops
+    SKIP_LOW     pass the next stop (only offered while its queue is short and
+                 a busier one is coming up)
+    SHORT_HOLD   stay at least hold_ticks at the next stop (headway control)
+
+observe() and apply() touch the simulation and run on its thread; infer() only
+reads the batch it is given, so the server can run it in an executor. Both
+fleets otherwise run by the same rules, so the comparison measures the policy.
+"""
+
+import os
+import time
+import numpy as np
+from typing import Optional, Tuple
+
+from bus import BusAction
+
+CONTINUE = BusAction.CONTINUE.value
+HIGH_DEMAND = BusAction.HIGH_DEMAND.value
+SKIP_LOW = BusAction.SKIP_LOW.value
+SHORT_HOLD = BusAction.SHORT_HOLD.value
+
+# Written by `cd rl && python train.py --observation-mode local && python export_onnx.py --output ppo_bus_policy.onnx`
+DEFAULT_POLICY_PATH = os.path.join(os.path.dirname(__file__), '..', 'rl', 'ppo_bus_policy.onnx')
+
+def load_policy(onnx_path: Optional[str]):
+    """ONNXPolicyInference for onnx_path, or None (with a warning) if it can't be loaded or isn't per-bus"""
+    if not onnx_path:
+        return None
+    if not os.path.exists(onnx_path):
+        print(f"⚠️  No ONNX policy at {onnx_path}, optimized buses run without one")
+        return None
+    try:
+        from export_onnx import ONNXPolicyInference
+    except ImportError as e:
+        print(f"⚠️  ONNX policy not loaded ({e}), optimized buses run without one")
+        return None
+    policy = ONNXPolicyInference(onnx_path)
+    if not policy.per_bus:
+        print(f"⚠️  {onnx_path} is a fixed-fleet policy (toy-grid observation), optimized buses run without one; "
+              f"train with --observation-mode local")
+        return None
+    return policy
+
+class PolicyDriver:
+    """Batched observations, inference and actions for the optimized buses of a ComparisonManhattanSystem"""
+    
+    def __init__(self, system, policy, hold_ticks: int = 3, latency_window: int = 256):
+        self.system = system
+        self.policy = policy
+        self.hold_ticks = hold_ticks
+        self.buses = [bus for bus in system.buses.values() if bus.is_optimized]
+        self.capacity = np.array([bus.capacity for bus in self.buses], dtype=np.float32)
+        
+        # local_dim = 5 own features + 3 per upcoming stop + headway
+        self.num_neighbor_stops = (policy.obs_dim - 6) // 3
+        
+        # Topology stops -> normalized position and rider queue row (-1: no queue, always empty)
+        projection, topology = system.projection, system.topology
+        self.origin = np.array([projection.min_lon, projection.min_lat])
+        self.extent = np.array([projection.max_lon - projection.min_lon, projection.max_lat - projection.min_lat])
+        self.stop_xy = (np.stack([topology.stop_lon, topology.stop_lat], axis=1) - self.origin) / self.extent
+        self.stop_slot = np.array([system.stops[stop_id].queue_slot if stop_id in system.stops else -1
+                                   for stop_id in topology.stop_ids], dtype=np.int64)
+        self.stop_end = topology.stop_offsets[1:]
+        self.pattern_length = topology.length
+        
+        # Inference time of recent ticks, in milliseconds
+        self.latencies = np.zeros(latency_window)
+        self.inferences = 0
+    
+    def _fleet_arrays(self):
+        buses = self.buses
+        count = len(buses)
+        pattern = np.fromiter((bus.pattern for bus in buses), dtype=np.int64, count=count)
+        distance = np.fromiter((bus.distance for bus in buses), dtype=np.float64, count=count)
+        cursor = np.fromiter((bus.stop_cursor for bus in buses), dtype=np.int64, count=count)
+        dwell = np.fromiter((bus.dwell for bus in buses), dtype=np.float32, count=count)
+        hold = np.fromiter((bus.hold for bus in buses), dtype=np.float32, count=count)
+        load = np.fromiter((bus.load for bus in buses), dtype=np.float32, count=count)
+        xy = (np.stack([np.fromiter((bus.lon for bus in buses), dtype=np.float64, count=count),
+                        np.fromiter((bus.lat for bus in buses), dtype=np.float64, count=count)], axis=1) - self.origin) / self.extent
+        return pattern, distance, cursor, dwell, hold, load, xy
+    
+    def _headways(self, pattern: np.ndarray, distance: np.ndarray) -> np.ndarray:
+        """Gap to the next bus ahead on the same pattern, as a fraction of the pattern (1 if alone)"""
+        order = np.lexsort((distance, pattern))
+        gaps = np.ones(len(pattern))
+        same = pattern[order[1:]] == pattern[order[:-1]]
+        ahead = (distance[order[1:]] - distance[order[:-1]]) / self.pattern_length[pattern[order[:-1]]]
+        gaps[order[:-1][same]] = ahead[same]
+        return np.minimum(gaps, 1.0)
+    
+    def observe(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(observations, action masks) of the whole optimized fleet, batched for one predict call"""
+        pattern, distance, cursor, dwell, hold, load, xy = self._fleet_arrays()
+        count = len(self.buses)
+        
+        # Upcoming stops along each bus's pattern (the last stop repeats near the terminal)
+        last = self.stop_end[pattern] - 1
+        upcoming = np.minimum(cursor[:, None] + np.arange(self.num_neighbor_stops), last[:, None])
+        slots = self.stop_slot[upcoming]
+        queues = np.where(slots >= 0, self.system.optimized_queues.count[np.maximum(slots, 0)], 0)
+        queue_features = np.minimum(queues / 10.0, 1.0)
+        
+        own = np.empty((count, 5), dtype=np.float32)
+        own[:, 0:2] = xy
+        own[:, 2] = load / self.capacity
+        own[:, 3] = dwell == 0
+        own[:, 4] = np.maximum(hold - dwell, 0) / 5.0
+        
+        # Masks mirror BusFleet.get_action_masks: a masked action would be a no-op here
+        approaching = (dwell == 0) & (cursor <= last)
+        masks = np.zeros((count, len(BusAction)), dtype=bool)
+        masks[:, CONTINUE] = True
+        masks[:, HIGH_DEMAND] = approaching & (queues.argmax(axis=1) > 0)
+        masks[:, SKIP_LOW] = approaching & (queues[:, 0] < 2) & (queues[:, 1:].max(axis=1, initial=0) > queues[:, 0] + 1)
+        masks[:, SHORT_HOLD] = cursor <= last
+        
+        offsets = self.stop_xy[upcoming] - xy[:, None, :]
+        stops = np.concatenate([offsets, queue_features[:, :, None]], axis=2).reshape(count, -1)
+        headway = self._headways(pattern, distance)[:, None]
+        return np.concatenate([own, stops, headway], axis=1)[None].astype(np.float32), masks[None]
+    
+    def infer(self, observations: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        """One batched policy call; returns a BusAction value per optimized bus"""
+        started = time.perf_counter()
+        actions = self.policy.predict_batch(observations, deterministic=True, action_masks=masks)
+        self.latencies[self.inferences % len(self.latencies)] = (time.perf_counter() - started) * 1000.0
+        self.inferences += 1
+        return actions.reshape(-1)
+    
+    def apply(self, actions: np.ndarray):
+        """Turn each bus's action into the stop it skips to and how long it holds at its next stop"""
+        queues = self.system.optimized_queues.count
+        for bus, action in zip(self.buses, actions.tolist()):
+            bus.hold = self.hold_ticks if action == SHORT_HOLD else 0
+            if action == SKIP_LOW:
+                bus.skip_until = bus.stop_cursor + 1
+            elif action == HIGH_DEMAND:
+                # Express to the busiest of the next stops the policy saw
+                end = min(bus.stop_cursor + self.num_neighbor_stops, int(self.stop_end[bus.pattern]))
+                slots = self.stop_slot[bus.stop_cursor:end]
+                waiting = np.where(slots >= 0, queues[np.maximum(slots, 0)], 0)
+                bus.skip_until = bus.stop_cursor + int(waiting.argmax()) if len(waiting) else -1
+            else:
+                bus.skip_until = -1
+    
+    def decide(self):
+        """observe, infer and apply in one go, for callers without an event loop"""
+        self.apply(self.infer(*self.observe()))
+    
+    def latency_ms(self) -> Tuple[float, float]:
+        """(last, median over the recent window) inference latency in milliseconds"""
+        if not self.inferences:
+            return 0.0, 0.0
+        recent = self.latencies[:min(self.inferences, len(self.latencies))]
+        return float(self.latencies[(self.inferences - 1) % len(self.latencies)]), float(np.median(recent))
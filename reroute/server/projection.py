@@ -0,0 +1,65 @@
+"""
+Vectorized projection between lat/lon and the comparison server's avenue/street grid
+"""
+
+import math
+import numpy as np
+from typing import Tuple
+
+class GridProjection:
+    """Tilted Manhattan grid (1-12 avenues, 1-200 streets) <-> lat/lon over whole arrays
+    
+    The rotation matrices are built once; each conversion is a handful of
+    elementwise NumPy operations, in the same order as the original scalar math
+    so results match it exactly.
+    """
+    
+    def __init__(self, min_lat: float = 40.7, max_lat: float = 40.8,
+                 min_lon: float = -74.0, max_lon: float = -73.95,
+                 num_avenues: int = 12, num_streets: int = 200, tilt: float = 0.4):
+        self.min_lat, self.max_lat = min_lat, max_lat
+        self.min_lon, self.max_lon = min_lon, max_lon
+        self.num_avenues = num_avenues
+        self.num_streets = num_streets
+        self.center_lat = (min_lat + max_lat) / 2
+        self.center_lon = (min_lon + max_lon) / 2
+        
+        # (rel_lat, rel_lon) -> (rotated_lat, rotated_lon); grid -> lat/lon undoes the tilt
+        self.to_grid_rotation = self._rotation(-tilt)
+        self.to_latlon_rotation = self._rotation(tilt)
+    
+    @staticmethod
+    def _rotation(angle: float) -> np.ndarray:
+        return np.array([[math.cos(angle), -math.sin(angle)],
+                         [math.sin(angle), math.cos(angle)]])
+    
+    def _rotate(self, rotation: np.ndarray, rel_lat: np.ndarray, rel_lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Elementwise rather than a matmul, which may fuse multiply-adds and change rounding
+        rotated_lat = rel_lat * rotation[0, 0] - rel_lon * -rotation[0, 1]
+        rotated_lon = rel_lat * rotation[1, 0] + rel_lon * rotation[1, 1]
+        return rotated_lat, rotated_lon
+    
+    def to_grid(self, lats, lons) -> Tuple[np.ndarray, np.ndarray]:
+        """Avenue and street (int arrays) of each lat/lon"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        rotated_lat, rotated_lon = self._rotate(self.to_grid_rotation, lats - self.center_lat, lons - self.center_lon)
+        
+        # astype truncates toward zero like int()
+        avenue = ((rotated_lon + self.center_lon - self.min_lon) / (self.max_lon - self.min_lon) * self.num_avenues).astype(np.int64) + 1
+        street = ((rotated_lat + self.center_lat - self.min_lat) / (self.max_lat - self.min_lat) * self.num_streets).astype(np.int64) + 1
+        return np.clip(avenue, 1, self.num_avenues), np.clip(street, 1, self.num_streets)
+    
+    def rotate_offsets(self, dlats, dlons) -> Tuple[np.ndarray, np.ndarray]:
+        """Lat/lon displacements turned onto the grid axes: (along the avenues, across them), in degrees"""
+        return self._rotate(self.to_grid_rotation, np.asarray(dlats, dtype=np.float64), np.asarray(dlons, dtype=np.float64))
+    
+    def to_latlon(self, avenues, streets) -> Tuple[np.ndarray, np.ndarray]:
+        """Lat and lon arrays of each avenue/street intersection"""
+        avenues = np.asarray(avenues, dtype=np.float64)
+        streets = np.asarray(streets, dtype=np.float64)
+        lat = self.min_lat + (streets - 1) / self.num_streets * (self.max_lat - self.min_lat)
+        lon = self.min_lon + (avenues - 1) / self.num_avenues * (self.max_lon - self.min_lon)
+        
+        rotated_lat, rotated_lon = self._rotate(self.to_latlon_rotation, lat - self.center_lat, lon - self.center_lon)
+        return rotated_lat + self.center_lat, rotated_lon + self.center_lon
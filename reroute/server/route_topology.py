@@ -0,0 +1,167 @@
+"""
+Bus route topology for the comparison server: route patterns as flat arrays
+
+A pattern is one direction of one route: a shape polyline (CSR offsets into
+lat/lon/cumulative meters) and the stops along it with their distance along
+the shape. A bus is (pattern, meters along, shape cursor); the cursor only
+moves forward, so locating a bus is O(1) per tick however long the route is.
+"""
+
+import math
+import numpy as np
+from typing import Dict, List, Sequence, Tuple
+
+from gtfs_feed import shape_distances
+from live_protocol import DIRECTIONS
+
+class RouteTopology:
+    """Shapes, stop sequences and return links of the patterns the simulation runs"""
+    
+    def __init__(self, route_ids: List[str], pattern_route: np.ndarray, pattern_direction: np.ndarray,
+                 shape_offsets: np.ndarray, shape_lat: np.ndarray, shape_lon: np.ndarray,
+                 stop_offsets: np.ndarray, stop_ids: List[str], stop_dist: np.ndarray,
+                 stop_lat: np.ndarray, stop_lon: np.ndarray, projection):
+        self.route_ids = route_ids
+        self.pattern_route = pattern_route
+        self.pattern_direction = pattern_direction
+        self.shape_offsets = shape_offsets
+        self.shape_lat = shape_lat
+        self.shape_lon = shape_lon
+        self.shape_dist = shape_distances(shape_offsets, shape_lat, shape_lon)
+        self.stop_offsets = stop_offsets
+        self.stop_ids = stop_ids
+        self.stop_dist = stop_dist
+        self.stop_lat = stop_lat
+        self.stop_lon = stop_lon
+        self.length = self.shape_dist[shape_offsets[1:] - 1]
+        self.pattern_next = self._return_patterns()
+        
+        # Grid heading of the segment starting at each point (a shape's last point repeats the one before)
+        d_street, d_avenue = projection.rotate_offsets(np.diff(shape_lat, append=shape_lat[-1:]),
+                                                       np.diff(shape_lon, append=shape_lon[-1:]))
+        d_avenue = d_avenue * math.cos(math.radians(projection.center_lat))
+        codes = np.where(np.abs(d_street) >= np.abs(d_avenue),
+                         np.where(d_street >= 0, 0, 1), np.where(d_avenue >= 0, 2, 3))
+        last = shape_offsets[1:] - 1
+        codes[last] = codes[np.maximum(last - 1, shape_offsets[:-1])]
+        
+        # The per-bus hot path reads single elements, which is far cheaper on lists
+        self._lat = shape_lat.tolist()
+        self._lon = shape_lon.tolist()
+        self._dist = self.shape_dist.tolist()
+        self._heading = [DIRECTIONS[code] for code in codes.tolist()]
+        self._stop_dist = stop_dist.tolist()
+        self._stop_end = stop_offsets[1:].tolist()
+        self._shape_end = (shape_offsets[1:] - 1).tolist()
+        self._length = self.length.tolist()
+    
+    @classmethod
+    def from_feed(cls, feed, route_ids: Sequence[str], projection) -> "RouteTopology":
+        """Busiest pattern per direction of each route in route_ids, copied out of the compiled feed"""
+        feed_routes = {route_id: i for i, route_id in enumerate(feed.route_id.tolist())}
+        wanted = {feed_routes[route_id]: route_id for route_id in route_ids if route_id in feed_routes}
+        
+        busiest: Dict[Tuple[int, int], int] = {}
+        for p in range(feed.num_patterns):
+            key = (int(feed.pattern_route[p]), int(feed.pattern_direction[p]))
+            if key[0] in wanted and (key not in busiest or feed.pattern_trips[p] > feed.pattern_trips[busiest[key]]):
+                busiest[key] = p
+        
+        served = {route for route, _ in busiest}
+        kept_routes = [route_id for route_id in route_ids if feed_routes.get(route_id) in served]
+        route_index = {route_id: i for i, route_id in enumerate(kept_routes)}
+        patterns = sorted(busiest.items(), key=lambda item: (route_index[wanted[item[0][0]]], item[0][1]))
+        
+        shapes = [feed.shape_points(int(feed.pattern_shape[p])) for _, p in patterns]
+        stops = [feed.pattern_stops(p) for _, p in patterns]
+        return cls(
+            route_ids=kept_routes,
+            pattern_route=np.array([route_index[wanted[key[0]]] for key, _ in patterns], dtype=np.int32),
+            pattern_direction=np.array([key[1] for key, _ in patterns], dtype=np.int8),
+            shape_offsets=np.concatenate([[0], np.cumsum([len(lat) for lat, _ in shapes])]).astype(np.int64),
+            shape_lat=np.concatenate([lat for lat, _ in shapes]),
+            shape_lon=np.concatenate([lon for _, lon in shapes]),
+            stop_offsets=np.concatenate([[0], np.cumsum([len(index) for index, _ in stops])]).astype(np.int64),
+            stop_ids=[str(feed.stop_id[i]) for index, _ in stops for i in index.tolist()],
+            stop_dist=np.concatenate([dist for _, dist in stops]).astype(np.float64),
+            stop_lat=np.concatenate([feed.stop_lat[index] for index, _ in stops]).astype(np.float64),
+            stop_lon=np.concatenate([feed.stop_lon[index] for index, _ in stops]).astype(np.float64),
+            projection=projection
+        )
+    
+    @classmethod
+    def from_stop_sequences(cls, routes: Dict[str, List[Tuple[str, float, float]]], projection) -> "RouteTopology":
+        """Straight-line patterns through (stop_id, lat, lon) lists, out and back, for data without shapes"""
+        route_ids, pattern_route, pattern_direction, sequences = [], [], [], []
+        for route_id, stops in routes.items():
+            if len(stops) < 2:
+                continue
+            for direction, sequence in enumerate((stops, stops[::-1])):
+                pattern_route.append(len(route_ids))
+                pattern_direction.append(direction)
+                sequences.append(sequence)
+            route_ids.append(route_id)
+        
+        offsets = np.concatenate([[0], np.cumsum([len(sequence) for sequence in sequences])]).astype(np.int64)
+        lat = np.array([stop[1] for sequence in sequences for stop in sequence], dtype=np.float64)
+        lon = np.array([stop[2] for sequence in sequences for stop in sequence], dtype=np.float64)
+        return cls(
+            route_ids=route_ids,
+            pattern_route=np.array(pattern_route, dtype=np.int32),
+            pattern_direction=np.array(pattern_direction, dtype=np.int8),
+            shape_offsets=offsets, shape_lat=lat, shape_lon=lon,
+            stop_offsets=offsets,
+            stop_ids=[stop[0] for sequence in sequences for stop in sequence],
+            stop_dist=shape_distances(offsets, lat, lon),
+            stop_lat=lat, stop_lon=lon,
+            projection=projection
+        )
+    
+    def _return_patterns(self) -> np.ndarray:
+        """Pattern a bus continues on at the terminal: the route's other direction, else its own start"""
+        result = np.arange(len(self.pattern_route))
+        first_by_key = {}
+        for p, key in enumerate(zip(self.pattern_route.tolist(), self.pattern_direction.tolist())):
+            first_by_key.setdefault(key, p)
+        for p, (route, direction) in enumerate(zip(self.pattern_route.tolist(), self.pattern_direction.tolist())):
+            result[p] = first_by_key.get((route, 1 - direction), p)
+        return result
+    
+    @property
+    def num_patterns(self) -> int:
+        return len(self.pattern_route)
+    
+    def route_patterns(self, route_id: str) -> List[int]:
+        return np.flatnonzero(self.pattern_route == self.route_ids.index(route_id)).tolist()
+    
+    def pattern_stop_ids(self, pattern: int) -> List[str]:
+        return self.stop_ids[self.stop_offsets[pattern]:self.stop_offsets[pattern + 1]]
+    
+    def start(self, pattern: int, distance: float) -> Tuple[int, int]:
+        """(shape cursor, stop cursor) for a bus placed at distance along pattern"""
+        start, end = self.shape_offsets[pattern], self.shape_offsets[pattern + 1]
+        shape_cursor = start + max(int(np.searchsorted(self.shape_dist[start:end], distance, side='right')) - 1, 0)
+        stop_start, stop_end = self.stop_offsets[pattern], self.stop_offsets[pattern + 1]
+        stop_cursor = stop_start + int(np.searchsorted(self.stop_dist[stop_start:stop_end], distance, side='left'))
+        return int(shape_cursor), int(stop_cursor)
+    
+    def next_target(self, pattern: int, stop_cursor: int) -> Tuple[float, bool]:
+        """(distance, True if a stop) of the next place a bus must halt: its next stop or the terminal"""
+        if stop_cursor < self._stop_end[pattern]:
+            return self._stop_dist[stop_cursor], True
+        return self._length[pattern], False
+    
+    def locate(self, pattern: int, distance: float, shape_cursor: int) -> Tuple[int, float, float, str]:
+        """(shape cursor, lat, lon, heading) at distance along pattern, advancing the cursor forward"""
+        dist = self._dist
+        last = self._shape_end[pattern]
+        while shape_cursor < last - 1 and dist[shape_cursor + 1] <= distance:
+            shape_cursor += 1
+        if shape_cursor >= last:
+            return shape_cursor, self._lat[last], self._lon[last], self._heading[last]
+        
+        span = dist[shape_cursor + 1] - dist[shape_cursor]
+        t = min(max((distance - dist[shape_cursor]) / span, 0.0), 1.0) if span > 0 else 0.0
+        lat = self._lat[shape_cursor] + t * (self._lat[shape_cursor + 1] - self._lat[shape_cursor])
+        lon = self._lon[shape_cursor] + t * (self._lon[shape_cursor + 1] - self._lon[shape_cursor])
+        return shape_cursor, lat, lon, self._heading[shape_cursor]
@@ -0,0 +1,90 @@
+"""
+Measured rider waits for the comparison server
+
+Every waiting rider is an arrival tick in a per-stop FIFO ring buffer (one
+stops x capacity int32 block). Boarding pops the oldest riders and their waits
+go into a sliding window per fleet that keeps a running sum and a histogram,
+so the mean is O(1) and percentiles are one cumulative sum over the bins.
+
+Buffers are array.array with NumPy views on the same memory: per-tick arrivals
+are vectorized through the views, while a boarding event (a handful of riders)
+uses plain indexing, which costs well under a microsecond per rider.
+"""
+
+import array
+import numpy as np
+from typing import List, Sequence
+
+class ArrivalQueues:
+    """FIFO of rider arrival ticks at every stop, in one ring buffer row per stop"""
+    
+    def __init__(self, num_stops: int, capacity: int):
+        self.capacity = capacity
+        self._times = array.array('i', bytes(4 * num_stops * capacity))
+        self._head = array.array('q', bytes(8 * num_stops))
+        self._count = array.array('q', bytes(8 * num_stops))
+        self.times = np.frombuffer(self._times, dtype=np.int32).reshape(num_stops, capacity)
+        self.head = np.frombuffer(self._head, dtype=np.int64)
+        self.count = np.frombuffer(self._count, dtype=np.int64)
+    
+    def arrive(self, stops: np.ndarray, riders: np.ndarray, tick: int) -> np.ndarray:
+        """Queue riders[i] new riders at stops[i] (distinct rows); returns how many fit"""
+        accepted = np.minimum(riders, self.capacity - self.count[stops])
+        rows = np.repeat(stops, accepted)
+        if len(rows):
+            # j-th new rider of a stop goes j slots past its current tail
+            starts = np.cumsum(accepted) - accepted
+            offsets = np.arange(len(rows)) - np.repeat(starts, accepted)
+            self.times[rows, (self.head[rows] + self.count[rows] + offsets) % self.capacity] = tick
+            self.count[stops] += accepted
+        return accepted
+    
+    def board(self, stop: int, riders: int, tick: int) -> List[int]:
+        """Remove the riders longest in line at stop; returns their waits in ticks"""
+        capacity, times = self.capacity, self._times
+        row = stop * capacity
+        head = self._head[stop]
+        waits = [tick - times[row + (head + j) % capacity] for j in range(riders)]
+        self._head[stop] = (head + riders) % capacity
+        self._count[stop] -= riders
+        return waits
+
+class WaitWindow:
+    """Waits of the last `size` boardings, with an incrementally maintained sum and histogram"""
+    
+    def __init__(self, size: int = 2000, max_wait: int = 1023):
+        self.size = size
+        self.max_wait = max_wait  # Longer waits share the last histogram bin
+        self._values = array.array('q', bytes(8 * size))
+        self._histogram = array.array('q', bytes(8 * (max_wait + 1)))
+        self.histogram = np.frombuffer(self._histogram, dtype=np.int64)
+        self.start = 0
+        self.count = 0
+        self.total = 0
+        self.boardings = 0
+    
+    def add(self, waits: Sequence[int]):
+        """Slide the window over new waits (in ticks), evicting the oldest once full"""
+        values, histogram, max_wait, size = self._values, self._histogram, self.max_wait, self.size
+        for wait in waits:
+            if self.count == size:
+                old = values[self.start]
+                self.total -= old
+                histogram[old if old < max_wait else max_wait] -= 1
+                self.start = (self.start + 1) % size
+                self.count -= 1
+            values[(self.start + self.count) % size] = wait
+            self.total += wait
+            histogram[wait if wait < max_wait else max_wait] += 1
+            self.count += 1
+        self.boardings += len(waits)
+    
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+    
+    def percentiles(self, qs: Sequence[float]) -> np.ndarray:
+        """Nearest-rank percentiles (0-100) of the waits in the window, in ticks"""
+        if not self.count:
+            return np.zeros(len(qs))
+        ranks = np.ceil(np.asarray(qs, dtype=np.float64) / 100.0 * self.count).clip(1, self.count)
+        return np.searchsorted(np.cumsum(self.histogram), ranks).astype(np.float64)
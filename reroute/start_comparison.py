@@ -29,7 +29,7 @@ def kill_existing_servers():
 def check_dependencies():
     """Check required dependencies"""
     print("📦 Checking dependencies...")
-    required_packages = ['fastapi', 'uvicorn', 'websockets', 'numpy', 'pandas']
+    required_packages = ['fastapi', 'uvicorn', 'websockets', 'numpy']
     
     for package in required_packages:
         try: